@@ -0,0 +1,255 @@
+#
+# This module contains batched Uniswap math kernels that work on numpy arrays:
+#  1) v3 sqrtPriceX96 and tick to price (and log price) conversions
+#  2) v2 constant-product `getAmountOut` / `getAmountIn` and price impact
+#
+# The fast versions use float64. The `*_exact` versions use Python integers
+# (numpy object arrays, or plain ints) and follow the integer math of the contracts;
+# they are slow and meant for validating the fast versions, except that `sqrt_price_x96_to_tick`
+# uses `tick_to_sqrt_price_x96_exact` for the few values next to a tick boundary.
+# Run this file to check the tick round trips over all ticks.
+#
+# Prices are in units of token1 per token0. If decimals are given, the price is
+# in whole tokens instead of the smallest units. For example, the USDC/WETH pools
+# have decimals0=6, decimals1=18, and the price of ETH in USDC is 1 / price.
+#
+
+from fractions import Fraction
+import numpy as np
+
+Q96 = 2 ** 96
+LOG_Q96 = 96 * np.log(2)
+TICK_BASE = 1.0001
+LOG_TICK_BASE = np.log(TICK_BASE)
+
+MIN_TICK = -887272
+MAX_TICK = 887272
+
+# the float tick estimates of the prices closer than this to a tick boundary are rounded to it, see `price_to_tick`
+TICK_TOLERANCE = 1e-6
+# the integer sqrtPriceX96 values whose float tick estimate is closer than this to a tick boundary are checked
+# exactly; the rounding of `TickMath.getSqrtRatioAtTick` alone is up to 5e-6 ticks near MIN_TICK
+EXACT_TICK_WINDOW = 1e-3
+
+# the tick spacing of the v3 fee tiers (the fee is in hundredths of a bip, as in the contracts)
+TICK_SPACINGS = {100: 1, 500: 10, 3000: 60, 10000: 200}
+
+V2_FEE = 0.003
+V2_FEE_NUMERATOR = 997
+V2_FEE_DENOMINATOR = 1000
+
+
+def to_float64(values):
+    # converts strings or Python ints (possibly larger than 2**64) to a float64 array
+    if isinstance(values, np.ndarray) and values.dtype == np.float64:
+        return values
+    return np.asarray(values, dtype=np.float64)
+
+
+def _decimals_factor(decimals0, decimals1):
+    return 10.0 ** (decimals0 - decimals1)
+
+
+############################################################
+# v3 prices
+
+def sqrt_price_x96_to_price(sqrt_price_x96, decimals0=0, decimals1=0):
+    s = to_float64(sqrt_price_x96) / Q96
+    return s * s * _decimals_factor(decimals0, decimals1)
+
+
+def sqrt_price_x96_to_log_price(sqrt_price_x96, decimals0=0, decimals1=0):
+    log_price = 2 * (np.log(to_float64(sqrt_price_x96)) - LOG_Q96)
+    return log_price + (decimals0 - decimals1) * np.log(10)
+
+
+def price_to_sqrt_price_x96(price, decimals0=0, decimals1=0):
+    return np.sqrt(to_float64(price) / _decimals_factor(decimals0, decimals1)) * Q96
+
+
+def tick_to_price(tick, decimals0=0, decimals1=0):
+    return np.exp(np.asarray(tick, dtype=np.float64) * LOG_TICK_BASE) * _decimals_factor(decimals0, decimals1)
+
+
+def tick_to_log_price(tick, decimals0=0, decimals1=0):
+    return np.asarray(tick, dtype=np.float64) * LOG_TICK_BASE + (decimals0 - decimals1) * np.log(10)
+
+
+def tick_to_sqrt_price_x96(tick):
+    return np.exp(np.asarray(tick, dtype=np.float64) * LOG_TICK_BASE / 2) * Q96
+
+
+def _floor_ticks(ticks):
+    # the float tick estimates within TICK_TOLERANCE of a tick boundary are rounded to it, so that
+    # a float price computed from a tick (e.g. by `tick_to_price`) maps back to the same tick
+    nearest = np.rint(ticks)
+    return np.where(np.abs(ticks - nearest) < TICK_TOLERANCE, nearest, np.floor(ticks)).astype(np.int64)
+
+
+def price_to_tick(price, decimals0=0, decimals1=0):
+    log_price = np.log(to_float64(price) / _decimals_factor(decimals0, decimals1))
+    return _floor_ticks(log_price / LOG_TICK_BASE)
+
+
+#
+# Returns the largest tick whose sqrtPriceX96 is <= the given one, same as `TickMath.getTickAtSqrtRatio`.
+# The integer inputs (Python ints, strings or object arrays) are exact: the float estimate is corrected
+# with integer comparisons against `tick_to_sqrt_price_x96_exact` near the tick boundaries.
+# The float inputs are not exact to begin with, so they are rounded as in `price_to_tick`.
+#
+def sqrt_price_x96_to_tick(sqrt_price_x96):
+    log_price = 2 * (np.log(to_float64(sqrt_price_x96)) - LOG_Q96)
+    ticks = log_price / LOG_TICK_BASE
+    if np.asarray(sqrt_price_x96).dtype.kind == "f":
+        return _floor_ticks(ticks)
+    result = np.atleast_1d(np.floor(ticks).astype(np.int64))
+    ticks = np.atleast_1d(ticks)
+    near = np.nonzero(np.abs(ticks - np.rint(ticks)) < EXACT_TICK_WINDOW)[0]
+    if len(near):
+        values = np.asarray(sqrt_price_x96, dtype=object).reshape(-1)[near]
+        values = np.asarray([int(u) for u in values], dtype=object)
+        candidates = np.clip(np.rint(ticks[near]).astype(np.int64), MIN_TICK, MAX_TICK)
+        # the boundary tick if its sqrtPriceX96 is not above the value, otherwise the tick below it
+        at_or_above = values >= tick_to_sqrt_price_x96_exact(candidates)
+        result[near] = np.where(at_or_above, candidates, candidates - 1)
+    return result.reshape(np.shape(sqrt_price_x96)) if np.ndim(sqrt_price_x96) else result[0]
+
+
+# the multipliers of `TickMath.getSqrtRatioAtTick` for each bit of the tick, as Q128 numbers
+_TICK_BIT_RATIOS = [
+    0xfffcb933bd6fad37aa2d162d1a594001, 0xfff97272373d413259a46990580e213a, 0xfff2e50f5f656932ef12357cf3c7fdcc,
+    0xffe5caca7e10e4e61c3624eaa0941cd0, 0xffcb9843d60f6159c9db58835c926644, 0xff973b41fa98c081472e6896dfb254c0,
+    0xff2ea16466c96a3843ec78b326b52861, 0xfe5dee046a99a2a811c461f1969c3053, 0xfcbe86c7900a88aedcffc83b479aa3a4,
+    0xf987a7253ac413176f2b074cf7815e54, 0xf3392b0822b70005940c7a398e4b70f3, 0xe7159475a2c29b7443b29c7fa6e889d9,
+    0xd097f3bdfd2022b8845ad8f792aa5825, 0xa9f746462d870fdf8a65dc1f90e061e5, 0x70d869a156d2a1b890bb3df62baf32f7,
+    0x31be135f97d08fd981231505542fcfa6, 0x9aa508b5b7a84e1c677de54f3e99bc9, 0x5d6af8dedb81196699c329225ee604,
+    0x2216e584f5fa1ea926041bedfe98, 0x48a170391f7dc42444e8fa2,
+]
+
+
+def tick_to_sqrt_price_x96_exact(tick):
+    # same as `TickMath.getSqrtRatioAtTick`; returns an object array of ints
+    ticks = np.asarray(tick, dtype=np.int64)
+    abs_ticks = np.abs(ticks)
+    ratios = np.full(ticks.shape, 1 << 128, dtype=object)
+    for bit, multiplier in enumerate(_TICK_BIT_RATIOS):
+        mask = (abs_ticks & (1 << bit)) != 0
+        if bit == 0:
+            ratios[mask] = multiplier
+        elif mask.any():
+            ratios[mask] = (ratios[mask] * multiplier) >> 128
+    positive = ticks > 0
+    ratios[positive] = ((1 << 256) - 1) // ratios[positive]
+    # rounded up to Q96
+    return (ratios >> 32) + (ratios % (1 << 32) != 0).astype(np.int64).astype(object)
+
+
+def sqrt_price_x96_to_price_exact(sqrt_price_x96, decimals0=0, decimals1=0):
+    # returns an object array of Fractions
+    factor = Fraction(10) ** (decimals0 - decimals1)
+    values = np.asarray(sqrt_price_x96, dtype=object)
+    return np.vectorize(lambda s: Fraction(int(s) * int(s), Q96 * Q96) * factor, otypes=[object])(values)
+
+
+def compare_sqrt_prices_exact(a, b):
+    # returns -1, 0 or 1 for each pair; squaring is not needed, as the sqrt is monotonic
+    a = np.asarray(a, dtype=object)
+    b = np.asarray(b, dtype=object)
+    return np.vectorize(lambda x, y: (int(x) > int(y)) - (int(x) < int(y)), otypes=[np.int64])(a, b)
+
+
+############################################################
+# v2 constant product
+
+def get_amount_out(amount_in, reserve_in, reserve_out, fee=V2_FEE):
+    amount_in_with_fee = to_float64(amount_in) * (1 - fee)
+    reserve_in = to_float64(reserve_in)
+    return amount_in_with_fee * to_float64(reserve_out) / (reserve_in + amount_in_with_fee)
+
+
+def get_amount_in(amount_out, reserve_in, reserve_out, fee=V2_FEE):
+    amount_out = to_float64(amount_out)
+    return to_float64(reserve_in) * amount_out / ((to_float64(reserve_out) - amount_out) * (1 - fee))
+
+
+def get_amount_out_exact(amount_in, reserve_in, reserve_out,
+                         fee_numerator=V2_FEE_NUMERATOR, fee_denominator=V2_FEE_DENOMINATOR):
+    # same as UniswapV2Library.getAmountOut; works on ints or object arrays of ints
+    amount_in_with_fee = amount_in * fee_numerator
+    numerator = amount_in_with_fee * reserve_out
+    denominator = reserve_in * fee_denominator + amount_in_with_fee
+    return numerator // denominator
+
+
+def get_amount_in_exact(amount_out, reserve_in, reserve_out,
+                        fee_numerator=V2_FEE_NUMERATOR, fee_denominator=V2_FEE_DENOMINATOR):
+    # same as UniswapV2Library.getAmountIn; works on ints or object arrays of ints
+    numerator = reserve_in * amount_out * fee_denominator
+    denominator = (reserve_out - amount_out) * fee_numerator
+    return numerator // denominator + 1
+
+
+#
+# Relative change of the pool's mid price (reserve_out / reserve_in) caused by the swap.
+#
+def price_impact(amount_in, reserve_in, reserve_out, fee=V2_FEE):
+    amount_in = to_float64(amount_in)
+    reserve_in = to_float64(reserve_in)
+    reserve_out = to_float64(reserve_out)
+    amount_out = get_amount_out(amount_in, reserve_in, reserve_out, fee)
+    mid_before = reserve_out / reserve_in
+    mid_after = (reserve_out - amount_out) / (reserve_in + amount_in)
+    return 1 - mid_after / mid_before
+
+
+#
+# Relative difference between the execution price of the swap and the pool's mid price,
+# including the swap fee.
+#
+def execution_slippage(amount_in, reserve_in, reserve_out, fee=V2_FEE):
+    amount_in = to_float64(amount_in)
+    reserve_in = to_float64(reserve_in)
+    reserve_out = to_float64(reserve_out)
+    amount_out = get_amount_out(amount_in, reserve_in, reserve_out, fee)
+    return 1 - (amount_out / amount_in) / (reserve_out / reserve_in)
+
+
+def reserves_to_price(reserve0, reserve1, decimals0=0, decimals1=0):
+    return to_float64(reserve1) / to_float64(reserve0) * _decimals_factor(decimals0, decimals1)
+
+
+############################################################
+# validation
+
+def max_relative_error(fast, exact):
+    fast = to_float64(fast)
+    exact = np.asarray([float(u) for u in np.asarray(exact, dtype=object).reshape(-1)]).reshape(fast.shape)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        err = np.abs(fast - exact) / np.abs(exact)
+    err[exact == 0] = np.abs(fast[exact == 0])
+    return float(np.max(err)) if err.size else 0.0
+
+
+def check_ticks(ticks=None):
+    # the tick conversions should round-trip at the tick boundaries, over all ticks by default
+    if ticks is None:
+        ticks = np.arange(MIN_TICK, MAX_TICK + 1, dtype=np.int64)
+    ticks = np.asarray(ticks, dtype=np.int64)
+    exact = tick_to_sqrt_price_x96_exact(ticks)
+    assert exact[ticks == MIN_TICK].tolist() in ([], [4295128739])
+    assert exact[ticks == MAX_TICK].tolist() in ([], [1461446703485210103287273052203988822378723970342])
+    # the exact values are rounded to integers, which is up to 2.3e-10 relative near MIN_TICK
+    assert max_relative_error(tick_to_sqrt_price_x96(ticks), exact) < 1e-9
+    assert np.array_equal(sqrt_price_x96_to_tick(exact), ticks)
+    # just below the boundary is the tick below
+    below = ticks > MIN_TICK
+    assert np.array_equal(sqrt_price_x96_to_tick(exact[below] - 1), ticks[below] - 1)
+    assert np.array_equal(sqrt_price_x96_to_tick(tick_to_sqrt_price_x96(ticks)), ticks)
+    assert np.array_equal(price_to_tick(tick_to_price(ticks)), ticks)
+    assert np.array_equal(price_to_tick(tick_to_price(ticks, 6, 18), 6, 18), ticks)
+    print(f"tick round trips checked for {len(ticks)} ticks")
+
+
+if __name__ == "__main__":
+    check_ticks()
+    print("all done")
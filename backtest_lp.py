@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+
+#
+# This file backtests many candidate LP positions on a Uniswap v3 pool at once, over the swaps
+# of a year in `uniswap-v3-all`.
+#
+# A candidate is a range width and a rebalance rule. The range is +-WIDTH around the price
+# (in log terms, rounded out to the tick spacing); the position is rebalanced to a new range around
+# the current price when the log price drifts from the center of the range by more than THRESHOLD times
+# the half-width of the range. A threshold of 1 rebalances about when the price leaves the range, and
+# "inf" never rebalances.
+#
+# The candidates are price takers: the pool price follows the recorded swaps. For each swap, the amounts
+# of each candidate change along the price path from the previous swap, clipped to its range, and
+#  1) the fees are fee / (1 - fee) of its input amount, diluted by the liquidity of the pool:
+#     the share of a candidate with liquidity l is L / (L + l) of the fees of l alone, where L is the
+#     active liquidity recorded in the Swap event (the same value that `v3_replay.py` validates);
+#  2) the LVR is the loss of the trade valued at the pool price after the swap;
+#  3) the impermanent loss of each range is its value when it is closed minus the value of holding
+#     the amounts it was opened with.
+# All values are in the numeraire token, relative to POSITION_VALUE.
+#
+# The swaps are processed in chunks of CHUNK_SWAPS, as arrays with the shape (swaps, candidates),
+# so the memory does not depend on the length of the history. Within a chunk, the candidates
+# that are rebalanced are processed again from the swap after the rebalance, in windows of
+# REPROCESS_SWAPS swaps.
+#
+# The results are written to:
+#   backtest-lp-{YEAR}-{POOL}.csv
+#
+
+import os
+import numpy as np
+import pandas as pd
+
+from amm_math import Q96, LOG_TICK_BASE, TICK_SPACINGS
+import price_pyramid
+
+YEAR = os.getenv("YEAR")
+if YEAR is None or len(YEAR) == 0:
+    YEAR = "2023"
+
+POOL = os.getenv("POOL")
+if POOL is None or len(POOL) == 0:
+    POOL = "0x88e6a0c2ddd26feeb64f039a2c41296fcb3f5640" # USDC/ETH 0.05%
+POOL = POOL.lower()
+
+FEE = os.getenv("FEE")
+try:
+    FEE = float(FEE)
+except:
+    FEE = 0.0005
+
+# token decimals and the index of the risky (non-numeraire) token; the defaults are for USDC/WETH
+DECIMALS0 = int(os.getenv("DECIMALS0", "6"))
+DECIMALS1 = int(os.getenv("DECIMALS1", "18"))
+RISKY_TOKEN = int(os.getenv("RISKY_TOKEN", "1"))
+
+# in whole numeraire tokens
+POSITION_VALUE = float(os.getenv("POSITION_VALUE", "100000"))
+
+# the relative cost of each rebalance (swap fees, slippage and gas), as a fraction of the position value
+REBALANCE_COST = float(os.getenv("REBALANCE_COST", "0.001"))
+
+# the half-widths of the ranges, as relative price changes
+NUM_WIDTHS = int(os.getenv("NUM_WIDTHS", "400"))
+MIN_WIDTH = float(os.getenv("MIN_WIDTH", "0.001"))
+MAX_WIDTH = float(os.getenv("MAX_WIDTH", "2.0"))
+
+THRESHOLDS = os.getenv("THRESHOLDS")
+if THRESHOLDS is None or len(THRESHOLDS) == 0:
+    THRESHOLDS = "inf,0.5,0.75,1,1.5"
+THRESHOLDS = [float(u) for u in THRESHOLDS.split(",")]
+
+CHUNK_SWAPS = int(os.getenv("CHUNK_SWAPS", "512"))
+
+# the window of swaps that the rebalanced candidates are processed again in
+REPROCESS_SWAPS = int(os.getenv("REPROCESS_SWAPS", "32"))
+
+############################################################
+
+#
+# Yields the sqrt prices (not scaled by Q96) and the active liquidity after each swap of the pool, per day.
+#
+def load_swaps(pool, year):
+    for date, filename in price_pyramid.source_files(3, year):
+        df = pd.read_csv(filename, usecols=["block", "pool", "type", "price", "liquidity"],
+                         dtype={"block": np.int64, "pool": str, "type": np.int64,
+                                "price": np.float64, "liquidity": np.float64})
+        df = df[(df["pool"] == pool) & (df["type"] == 3)]
+        if len(df) == 0:
+            continue
+        yield date, df["price"].to_numpy() / Q96, df["liquidity"].to_numpy()
+
+
+class LpBacktest:
+    def __init__(self, widths, thresholds, fee=FEE, position_value=POSITION_VALUE,
+                 rebalance_cost=REBALANCE_COST, decimals0=DECIMALS0, decimals1=DECIMALS1, risky_token=RISKY_TOKEN):
+        # all combinations; the candidate i has the width i // len(thresholds)
+        self.widths = np.repeat(np.asarray(widths, dtype=np.float64), len(thresholds))
+        self.thresholds = np.tile(np.asarray(thresholds, dtype=np.float64), len(widths))
+        self.fee = fee
+        self.tick_spacing = TICK_SPACINGS[round(fee * 1e6)]
+        self.rebalance_cost = rebalance_cost
+        self.risky_token = risky_token
+        # in the smallest units of the numeraire token
+        self.numeraire_decimals = decimals1 if risky_token == 0 else decimals0
+        self.initial_value = position_value * 10.0 ** self.numeraire_decimals
+        self.num_candidates = len(self.widths)
+        self.half_widths = np.log1p(self.widths)
+        self.center = np.zeros(self.num_candidates)
+        self.lower = np.zeros(self.num_candidates)
+        self.upper = np.zeros(self.num_candidates)
+        self.liquidity = np.zeros(self.num_candidates)
+        # the amounts that the current ranges were opened with
+        self.amount0 = np.zeros(self.num_candidates)
+        self.amount1 = np.zeros(self.num_candidates)
+        self.fees = np.zeros(self.num_candidates)
+        self.lvr = np.zeros(self.num_candidates)
+        self.il = np.zeros(self.num_candidates)
+        self.costs = np.zeros(self.num_candidates)
+        self.rebalances = np.zeros(self.num_candidates, dtype=np.int64)
+        self.in_range = np.zeros(self.num_candidates, dtype=np.int64)
+        self.num_swaps = 0
+        self.final_value = None
+
+    def numeraire_factors(self, s):
+        # the value of one unit of token0 and of token1 in the numeraire, at the sqrt price s
+        price = s * s
+        if self.risky_token == 1:
+            return np.ones_like(price), 1 / price
+        return price, np.ones_like(price)
+
+    def amounts(self, idx, s):
+        c = np.clip(s, self.lower[idx], self.upper[idx])
+        l = self.liquidity[idx]
+        return l * (1 / c - 1 / self.upper[idx]), l * (c - self.lower[idx])
+
+    def value(self, idx, s):
+        x, y = self.amounts(idx, s)
+        n0, n1 = self.numeraire_factors(s)
+        return x * n0 + y * n1
+
+    def open(self, idx, s, value):
+        # opens new ranges around the sqrt price s (per candidate) with the value in the numeraire
+        log_price = 2 * np.log(s)
+        self.center[idx] = log_price
+        tick_lower = np.floor((log_price - self.half_widths[idx]) / LOG_TICK_BASE / self.tick_spacing)
+        tick_upper = np.ceil((log_price + self.half_widths[idx]) / LOG_TICK_BASE / self.tick_spacing)
+        tick_upper = np.maximum(tick_upper, tick_lower + 1)
+        self.lower[idx] = np.exp(tick_lower * self.tick_spacing * LOG_TICK_BASE / 2)
+        self.upper[idx] = np.exp(tick_upper * self.tick_spacing * LOG_TICK_BASE / 2)
+        # the value of the unit liquidity
+        self.liquidity[idx] = 1.0
+        self.liquidity[idx] = value / self.value(idx, s)
+        self.amount0[idx], self.amount1[idx] = self.amounts(idx, s)
+
+    def close(self, idx, s):
+        # returns the value of the ranges and adds their impermanent loss
+        value = self.value(idx, s)
+        n0, n1 = self.numeraire_factors(s)
+        self.il[idx] += value - (self.amount0[idx] * n0 + self.amount1[idx] * n1)
+        return value
+
+    def start(self, s):
+        idx = np.arange(self.num_candidates)
+        self.open(idx, np.full(self.num_candidates, s), self.initial_value)
+
+    def rebalance(self, idx, s):
+        value = self.close(idx, s)
+        self.costs[idx] += value * self.rebalance_cost
+        self.rebalances[idx] += 1
+        self.open(idx, s, value * (1 - self.rebalance_cost))
+
+    #
+    # Processes a chunk of swaps: `s_start` has the sqrt price before each swap, `s_end` after it,
+    # and `pool_liquidity` the active liquidity of the pool after it.
+    #
+    def step(self, s_start, s_end, pool_liquidity):
+        k = len(s_end)
+        n0_all, n1_all = self.numeraire_factors(s_end)
+        log_price_all = 2 * np.log(s_end)
+        fee_factor = self.fee / (1 - self.fee)
+
+        # the first swap to process for each candidate
+        begin = np.zeros(self.num_candidates, dtype=np.int64)
+        idx = np.arange(self.num_candidates)
+        end = k
+        while len(idx):
+            # the swaps [first, end); after the first pass, only a short window, as the candidates
+            # that are left are the ones that are rebalanced often
+            first = begin[idx].min()
+            if first > 0:
+                end = min(first + REPROCESS_SWAPS, k)
+            rows = np.arange(first, end).reshape(-1, 1)
+            s0 = s_start[first:end].reshape(-1, 1)
+            s1 = s_end[first:end].reshape(-1, 1)
+            n0 = n0_all[first:end].reshape(-1, 1)
+            n1 = n1_all[first:end].reshape(-1, 1)
+            log_price = log_price_all[first:end].reshape(-1, 1)
+            pool = pool_liquidity[first:end].reshape(-1, 1)
+
+            lower = self.lower[idx]
+            upper = self.upper[idx]
+            l = self.liquidity[idx]
+            active = rows >= begin[idx]
+
+            # the rebalance after the first swap that moves the price too far from the center, if any
+            drift = np.abs(log_price - self.center[idx])
+            trigger = (drift > self.thresholds[idx] * self.half_widths[idx]) & active
+            triggered = trigger.any(axis=0)
+            last = np.where(triggered, first + trigger.argmax(axis=0), end - 1)
+            mask = active & (rows <= last)
+
+            c0 = np.clip(s0, lower, upper)
+            c1 = np.clip(s1, lower, upper)
+            dx = l * (1 / c1 - 1 / c0)
+            dy = l * (c1 - c0)
+            dilution = pool / (pool + l)
+            fees = fee_factor * (np.maximum(dx, 0) * n0 + np.maximum(dy, 0) * n1) * dilution
+            self.fees[idx] += np.sum(fees * mask, axis=0)
+            self.lvr[idx] -= np.sum((dx * n0 + dy * n1) * mask, axis=0)
+            self.in_range[idx] += np.sum((s1 >= lower) & (s1 < upper) & mask, axis=0)
+
+            self.rebalance(idx[triggered], s_end[last[triggered]])
+            begin[idx] = np.maximum(begin[idx], last + 1)
+            idx = idx[begin[idx] < k]
+        self.num_swaps += k
+
+    def finish(self, s):
+        idx = np.arange(self.num_candidates)
+        self.final_value = self.close(idx, np.full(self.num_candidates, s))
+
+    def result(self):
+        # relative to the initial value
+        v = self.initial_value
+        return pd.DataFrame({
+            "width": self.widths,
+            "threshold": self.thresholds,
+            "fees": self.fees / v,
+            "il": self.il / v,
+            "lvr": self.lvr / v,
+            "rebalance_costs": self.costs / v,
+            "rebalances": self.rebalances,
+            "time_in_range": self.in_range / max(self.num_swaps, 1),
+            "final_value": self.final_value / v,
+            "pnl": (self.final_value + self.fees - v) / v,
+        })
+
+
+def run_backtest(backtest, swaps, chunk_swaps=CHUNK_SWAPS):
+    last = None
+    for date, sqrt_prices, liquidity in swaps:
+        if last is None:
+            # the first swap only gives the starting price
+            backtest.start(sqrt_prices[0])
+            last = sqrt_prices[0]
+            sqrt_prices = sqrt_prices[1:]
+            liquidity = liquidity[1:]
+        starts = np.concatenate(([last], sqrt_prices[:-1]))
+        for i in range(0, len(sqrt_prices), chunk_swaps):
+            backtest.step(starts[i:i + chunk_swaps], sqrt_prices[i:i + chunk_swaps], liquidity[i:i + chunk_swaps])
+        if len(sqrt_prices):
+            last = sqrt_prices[-1]
+        print(f"{date}: {len(sqrt_prices)} swaps")
+    if last is not None:
+        backtest.finish(last)
+    return last is not None
+
+
+def main():
+    widths = np.geomspace(MIN_WIDTH, MAX_WIDTH, NUM_WIDTHS)
+    backtest = LpBacktest(widths, THRESHOLDS)
+    print(f"backtesting {backtest.num_candidates} candidates on {POOL} in {YEAR}")
+    if not run_backtest(backtest, load_swaps(POOL, YEAR)):
+        print("no swaps")
+        return
+    df = backtest.result()
+    filename = f"backtest-lp-{YEAR}-{POOL}.csv"
+    df.to_csv(filename, index=False)
+    print(f"{backtest.num_swaps} swaps, results written to {filename}")
+    best = df.sort_values("pnl", ascending=False).head(10)
+    for _, row in best.iterrows():
+        print(f"width={row['width']:.4f} threshold={row['threshold']}: pnl={row['pnl']:.4f}"
+              f" fees={row['fees']:.4f} il={row['il']:.4f} lvr={row['lvr']:.4f} rebalances={row['rebalances']}")
+
+
+if __name__ == "__main__":
+    main()
+    print("all done")
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+#
+# This file creates and reads a block number <-> timestamp index for a chain.
+#
+# The index is two sorted int64 arrays (blocks, timestamps), stored in:
+#   data/block-index/{CHAIN}.npz
+# It is built from the downloaded data files (the rows that have a timestamp)
+# and/or from an extract of the blocks table, e.g. the result of:
+#   SELECT number, timestamp FROM `bigquery-public-data.goog_blockchain_arbitrum_one_us.blocks`
+# saved as a CSV file (set BLOCKS_CSV to its path).
+#
+# The conversions in both directions are vectorized with `np.searchsorted`.
+# Block timestamps are non-decreasing, so both arrays are sorted.
+#
+# For Arbitrum, the downloaded events have `timestamp = 0`; running this file with CHAIN=arbitrum
+# fills in the timestamps and splits the block-partitioned files into daily files:
+#   data/uniswap-arb-v3-all/events-arb-{MILLION}.csv -> data/uniswap-arb-v3-all/{YEAR}/{DATE}-events.csv
+#
+
+
+import os
+import glob
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+
+CHAIN = os.getenv("CHAIN")
+if CHAIN is None or len(CHAIN) == 0:
+    CHAIN = "ethereum"
+
+BLOCKS_CSV = os.getenv("BLOCKS_CSV")
+
+self_dir = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(self_dir, "data")
+
+# the data files that have `timestamp` and `block` columns, for each chain
+DATA_FILE_PATTERNS = {
+    "ethereum": [
+        os.path.join("uniswap-v3-all", "*", "*-events.csv"),
+        os.path.join("uniswap-v3-swaps", "*", "*-swaps.csv"),
+        os.path.join("uniswap-v2-swaps", "*", "*-swaps.csv"),
+        os.path.join("uniswap-v2-swaps", "*", "*-sync.csv"),
+    ],
+    # the Arbitrum events have no timestamps, so the blocks table extract is needed
+    "arbitrum": [],
+}
+
+SECONDS_PER_DAY = 86400
+
+
+def index_filename(chain, data_dir=DATA_DIR):
+    return os.path.join(data_dir, "block-index", chain + ".npz")
+
+
+def date_to_timestamp(date):
+    # "YYYY-MM-DD" -> the UTC timestamp of the start of the day
+    return int(datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp())
+
+
+def timestamp_to_date(timestamp):
+    return datetime.fromtimestamp(int(timestamp), tz=timezone.utc).strftime("%Y-%m-%d")
+
+
+def _to_unix_seconds(values):
+    # the blocks table has timestamps as strings ("2023-01-01 00:00:11 UTC"); the data files have integers
+    if pd.api.types.is_numeric_dtype(values):
+        return values.to_numpy(np.int64)
+    elapsed = pd.to_datetime(values, utc=True) - pd.Timestamp(0, tz="UTC")
+    return (elapsed // pd.Timedelta(seconds=1)).to_numpy(np.int64)
+
+
+class BlockIndex:
+    def __init__(self, blocks=None, timestamps=None):
+        if blocks is None:
+            blocks = np.zeros(0, dtype=np.int64)
+            timestamps = np.zeros(0, dtype=np.int64)
+        self.blocks = np.asarray(blocks, dtype=np.int64)
+        self.timestamps = np.asarray(timestamps, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def add(self, blocks, timestamps):
+        # adds (block, timestamp) points; the existing points are kept on duplicates.
+        # Rows with zero timestamps (e.g. the Arbitrum events) are ignored.
+        blocks = np.asarray(blocks, dtype=np.int64)
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        selected = timestamps > 0
+        all_blocks = np.concatenate((self.blocks, blocks[selected]))
+        all_timestamps = np.concatenate((self.timestamps, timestamps[selected]))
+        self.blocks, first = np.unique(all_blocks, return_index=True)
+        self.timestamps = all_timestamps[first]
+
+        num_bad = int(np.sum(np.diff(self.timestamps) < 0))
+        if num_bad:
+            print(f"warning: {num_bad} blocks have a timestamp smaller than the previous block")
+
+    def add_csv(self, filename, block_column="block", timestamp_column="timestamp"):
+        df = pd.read_csv(filename, usecols=[block_column, timestamp_column])
+        self.add(df[block_column].to_numpy(np.int64), _to_unix_seconds(df[timestamp_column]))
+
+    def save(self, filename):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        np.savez_compressed(filename, blocks=self.blocks, timestamps=self.timestamps)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename, allow_pickle=False) as f:
+            return cls(f["blocks"], f["timestamps"])
+
+    #
+    # Returns the timestamp of each block. Blocks that are not in the index get the timestamp
+    # of the closest earlier block (as-of lookup), or with `interpolate=True`, a linear interpolation
+    # between the neighbouring blocks. Blocks before the first indexed block get -1.
+    #
+    def block_to_timestamp(self, blocks, interpolate=False):
+        blocks = np.asarray(blocks, dtype=np.int64)
+        if interpolate:
+            result = np.floor(np.interp(blocks, self.blocks, self.timestamps)).astype(np.int64)
+        else:
+            i = np.searchsorted(self.blocks, blocks, side="right") - 1
+            result = self.timestamps[np.maximum(i, 0)]
+        return np.where(blocks < self.blocks[0], -1, result)
+
+    #
+    # Returns the first indexed block with timestamp >= the given timestamp,
+    # or the last indexed block + 1 if there is no such block.
+    #
+    def timestamp_to_block(self, timestamps):
+        i = np.searchsorted(self.timestamps, np.asarray(timestamps, dtype=np.int64), side="left")
+        extended = np.append(self.blocks, self.blocks[-1] + 1)
+        return extended[i]
+
+    def day_of_block(self, blocks):
+        # days since the epoch (UTC) of each block; -1 for unknown blocks
+        timestamps = self.block_to_timestamp(blocks)
+        return np.where(timestamps < 0, -1, timestamps // SECONDS_PER_DAY)
+
+    def day_block_range(self, date):
+        # the blocks [start, end) of the given date
+        start = date_to_timestamp(date)
+        start_block, end_block = self.timestamp_to_block([start, start + SECONDS_PER_DAY])
+        return int(start_block), int(end_block)
+
+
+def load_index(chain, data_dir=DATA_DIR):
+    filename = index_filename(chain, data_dir)
+    if not os.access(filename, os.R_OK):
+        return None
+    return BlockIndex.load(filename)
+
+
+def build_index(chain, blocks_csv=None, data_dir=DATA_DIR):
+    index = load_index(chain, data_dir) or BlockIndex()
+    if blocks_csv is not None and len(blocks_csv):
+        print(f"adding blocks from {blocks_csv}")
+        # the blocks table calls the block column `number`
+        columns = pd.read_csv(blocks_csv, nrows=0).columns
+        index.add_csv(blocks_csv, block_column="number" if "number" in columns else "block")
+    for pattern in DATA_FILE_PATTERNS.get(chain, []):
+        for filename in sorted(glob.glob(os.path.join(data_dir, pattern))):
+            index.add_csv(filename)
+    if len(index):
+        index.save(index_filename(chain, data_dir))
+    return index
+
+
+############################################################
+
+#
+# Fills in the timestamps of the block-partitioned Arbitrum events and splits them in daily files.
+# The amounts and the liquidity can be larger than int64, so all columns are kept as strings.
+#
+def backfill_arbitrum_events(index, data_dir=DATA_DIR):
+    in_dir = os.path.join(data_dir, "uniswap-arb-v3-all")
+    filenames = glob.glob(os.path.join(in_dir, "events-arb-*.csv"))
+    # sort by the block range, as a day may span two files
+    filenames.sort(key=lambda f: int(os.path.basename(f)[len("events-arb-"):-len(".csv")]))
+    written = set()
+    for filename in filenames:
+        print(f"backfilling timestamps in {filename}")
+        df = pd.read_csv(filename, dtype=str)
+        if len(df) == 0:
+            continue
+        timestamps = index.block_to_timestamp(df["block"].to_numpy(np.int64), interpolate=True)
+        if np.any(timestamps < 0):
+            print(f"warning: {int(np.sum(timestamps < 0))} events are before the first indexed block, skipping them")
+        df["timestamp"] = timestamps.astype(str)
+        df = df[timestamps >= 0]
+        days = timestamps[timestamps >= 0] // SECONDS_PER_DAY
+        for day in np.unique(days):
+            date = timestamp_to_date(day * SECONDS_PER_DAY)
+            out_filename = os.path.join(in_dir, date[:4], date + "-events.csv")
+            os.makedirs(os.path.dirname(out_filename), exist_ok=True)
+            append = out_filename in written
+            df[days == day].to_csv(out_filename, mode="a" if append else "w", header=not append, index=False)
+            written.add(out_filename)
+
+
+def main():
+    print(f"building the block index for {CHAIN}")
+    index = build_index(CHAIN, BLOCKS_CSV)
+    if len(index) == 0:
+        print("no blocks found")
+        return
+    print(f"{len(index)} blocks, {index.blocks[0]}..{index.blocks[-1]}, "
+          f"{timestamp_to_date(index.timestamps[0])}..{timestamp_to_date(index.timestamps[-1])}")
+    if CHAIN == "arbitrum":
+        backfill_arbitrum_events(index)
+
+
+if __name__ == "__main__":
+    main()
+    print("all done")
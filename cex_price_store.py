@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+
+#
+# This file creates and reads a local store of intraday CEX prices.
+#
+# The input is kline (candlestick) CSV dumps in the Binance public data format
+# (https://data.binance.vision), one or more files per symbol, e.g.:
+#   data/cex-prices/klines/ETHUSDT/ETHUSDT-1m-2023-01.zip
+# The zipped files can be used directly. The kline open time is in milliseconds
+# (or microseconds in the newer dumps, or seconds); the unit is detected from the values.
+#
+# The store is a compact time-indexed array file per symbol:
+#   data/cex-prices/intraday/{SYMBOL}.npz
+# with `time` (the end of each candle, in Unix seconds, sorted) and the OHLCV columns.
+#
+# The as-of join gives each timestamp the close price of the last candle that ended
+# at or before it; the close price is used as the mid price.
+#
+# Run this file to ingest all kline files of the symbol that are not in the store yet.
+#
+
+import os
+import glob
+import numpy as np
+import pandas as pd
+
+SYMBOL = os.getenv("SYMBOL")
+if SYMBOL is None or len(SYMBOL) == 0:
+    SYMBOL = "ETHUSDT"
+
+self_dir = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(self_dir, "data")
+
+KLINE_COLUMNS = ["open_time", "open", "high", "low", "close", "volume", "close_time",
+                 "quote_volume", "count", "taker_buy_volume", "taker_buy_quote_volume", "ignore"]
+
+PRICE_COLUMNS = ["open", "high", "low", "close", "volume"]
+
+
+def klines_dir(symbol, data_dir=DATA_DIR):
+    return os.path.join(data_dir, "cex-prices", "klines", symbol)
+
+
+def store_filename(symbol, data_dir=DATA_DIR):
+    return os.path.join(data_dir, "cex-prices", "intraday", symbol + ".npz")
+
+
+def _to_seconds(values):
+    # detects microseconds, milliseconds or seconds from the magnitude of the values
+    values = np.asarray(values, dtype=np.int64)
+    if len(values) == 0:
+        return values
+    if values.max() > 10 ** 14:
+        return values // 1_000_000
+    if values.max() > 10 ** 11:
+        return values // 1_000
+    return values
+
+
+def load_klines(filename):
+    # the older dumps have no header, the newer ones do
+    first = pd.read_csv(filename, header=None, nrows=1)
+    has_header = not str(first.iloc[0, 0]).isdigit()
+    df = pd.read_csv(filename, header=0 if has_header else None, names=KLINE_COLUMNS)
+    open_time = _to_seconds(df["open_time"].to_numpy(np.int64))
+    # close_time is the last moment of the candle (e.g. 59.999s), so the end is one unit later
+    close_time = _to_seconds(df["close_time"].to_numpy(np.int64) + 1)
+    result = {"time": np.maximum(close_time, open_time)}
+    for c in PRICE_COLUMNS:
+        result[c] = df[c].to_numpy(np.float64)
+    return result
+
+
+class CexPriceStore:
+    def __init__(self, columns=None, sources=None):
+        if columns is None:
+            columns = {"time": np.zeros(0, dtype=np.int64)}
+            columns.update({c: np.zeros(0) for c in PRICE_COLUMNS})
+        self.columns = columns
+        self.sources = set(sources or [])
+
+    def __len__(self):
+        return len(self.columns["time"])
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def add(self, columns):
+        # adds candles; on duplicate times, the new candle replaces the old one
+        merged = {c: np.concatenate((columns[c], self.columns[c])) for c in self.columns}
+        _, first = np.unique(merged["time"], return_index=True)
+        self.columns = {c: v[first] for c, v in merged.items()}
+
+    def ingest(self, filenames):
+        new = [f for f in sorted(filenames) if os.path.basename(f) not in self.sources]
+        for filename in new:
+            print(f"ingesting {filename}")
+            self.add(load_klines(filename))
+            self.sources.add(os.path.basename(filename))
+        return len(new)
+
+    def save(self, filename):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        np.savez_compressed(filename, sources=np.asarray(sorted(self.sources), dtype=str), **self.columns)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename, allow_pickle=False) as f:
+            columns = {c: f[c] for c in ["time"] + PRICE_COLUMNS}
+            sources = [str(u) for u in f["sources"]]
+        return cls(columns, sources)
+
+    def asof_index(self, timestamps):
+        # the index of the last candle that ended at or before each timestamp (-1 if none)
+        return np.searchsorted(self.columns["time"], np.asarray(timestamps, dtype=np.int64), side="right") - 1
+
+    #
+    # Returns the price (the close price of the prevailing candle) at each timestamp.
+    # The timestamps do not need to be sorted. The result is NaN before the first candle,
+    # and also if the prevailing candle ended more than `max_staleness` seconds earlier.
+    #
+    def asof(self, timestamps, max_staleness=None, column="close"):
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        if len(self) == 0:
+            return np.full(len(timestamps), np.nan)
+        i = self.asof_index(timestamps)
+        valid = i >= 0
+        i = np.maximum(i, 0)
+        if max_staleness is not None:
+            valid &= timestamps - self.columns["time"][i] <= max_staleness
+        return np.where(valid, self.columns[column][i], np.nan)
+
+
+def load_store(symbol, data_dir=DATA_DIR):
+    filename = store_filename(symbol, data_dir)
+    if not os.access(filename, os.R_OK):
+        return None
+    return CexPriceStore.load(filename)
+
+
+def update_store(symbol, data_dir=DATA_DIR):
+    store = load_store(symbol, data_dir) or CexPriceStore()
+    directory = klines_dir(symbol, data_dir)
+    filenames = glob.glob(os.path.join(directory, "*.csv")) + glob.glob(os.path.join(directory, "*.zip"))
+    if store.ingest(filenames):
+        store.save(store_filename(symbol, data_dir))
+    return store
+
+
+#
+# Adds the `cex_price` column to a dataframe of swaps (or any rows with a `timestamp` column).
+#
+def attach_cex_prices(df, store, max_staleness=None, column="cex_price"):
+    df[column] = store.asof(df["timestamp"].to_numpy(np.int64), max_staleness)
+    return df
+
+
+def main():
+    print(f"updating the intraday CEX price store for {SYMBOL}")
+    store = update_store(SYMBOL)
+    if len(store) == 0:
+        print(f"no klines found in {klines_dir(SYMBOL)}")
+        return
+    time = pd.to_datetime(store["time"][[0, -1]], unit="s", utc=True)
+    print(f"{len(store)} candles from {time[0]} to {time[1]}")
+
+
+if __name__ == "__main__":
+    main()
+    print("all done")
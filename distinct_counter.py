@@ -0,0 +1,142 @@
+#
+# This module contains a HyperLogLog distinct counter (Flajolet et al., 2007).
+#
+# The registers of many pools are kept in a single 2D array, one row per pool,
+# so that a day of swaps for all pools can be added with a few numpy operations.
+# Sketches with the same precision can be merged with element-wise max, so the number
+# of distinct items over any date range can be found by merging the daily sketches.
+#
+# The relative standard error is about 1.04 / sqrt(2 ** precision):
+#   precision=10 -> 3.3%,  precision=12 -> 1.6%,  precision=14 -> 0.8%
+#
+
+import math
+import numpy as np
+import pandas as pd
+
+MIN_PRECISION = 4
+MAX_PRECISION = 16
+
+
+def precision_for_error(error):
+    p = int(math.ceil(2 * math.log2(1.04 / error)))
+    return min(max(p, MIN_PRECISION), MAX_PRECISION)
+
+
+def hash_values(values):
+    # stable 64-bit hashes (same in every process, unlike the builtin `hash`)
+    return pd.util.hash_pandas_object(pd.Series(values), index=False).to_numpy()
+
+
+def _bit_length(w):
+    # vectorized int.bit_length() for uint64 arrays
+    result = np.zeros(len(w), dtype=np.int64)
+    w = w.copy()
+    for shift in [32, 16, 8, 4, 2, 1]:
+        mask = w >= (np.uint64(1) << np.uint64(shift))
+        result[mask] += shift
+        w[mask] >>= np.uint64(shift)
+    result += (w > 0)
+    return result
+
+
+def _alpha(m):
+    if m == 16:
+        return 0.673
+    if m == 32:
+        return 0.697
+    if m == 64:
+        return 0.709
+    return 0.7213 / (1 + 1.079 / m)
+
+
+class HyperLogLog:
+    def __init__(self, precision=12, num_rows=1, registers=None):
+        assert MIN_PRECISION <= precision <= MAX_PRECISION
+        self.precision = precision
+        self.m = 1 << precision
+        if registers is None:
+            registers = np.zeros((num_rows, self.m), dtype=np.uint8)
+        self.registers = registers
+
+    @property
+    def num_rows(self):
+        return self.registers.shape[0]
+
+    def add_hashes(self, hashes, rows=None):
+        # `rows` selects the sketch row (e.g. the pool index) for each hash
+        hashes = np.asarray(hashes, dtype=np.uint64)
+        if rows is None:
+            rows = np.zeros(len(hashes), dtype=np.int64)
+        p = np.uint64(self.precision)
+        buckets = (hashes >> (np.uint64(64) - p)).astype(np.int64)
+        rest = hashes & ((np.uint64(1) << (np.uint64(64) - p)) - np.uint64(1))
+        ranks = (64 - self.precision) - _bit_length(rest) + 1
+        flat = self.registers.reshape(-1)
+        np.maximum.at(flat, rows * self.m + buckets, ranks.astype(np.uint8))
+
+    def add(self, values, rows=None):
+        self.add_hashes(hash_values(values), rows)
+
+    def merge(self, other):
+        assert self.precision == other.precision, "cannot merge sketches with different precision"
+        return HyperLogLog(self.precision, registers=np.maximum(self.registers, other.registers))
+
+    def count(self):
+        # returns the estimated number of distinct items for each row
+        m = self.m
+        registers = self.registers.astype(np.float64)
+        raw = _alpha(m) * m * m / np.sum(np.exp2(-registers), axis=1)
+        zeros = np.sum(self.registers == 0, axis=1)
+        # use linear counting for small cardinalities
+        with np.errstate(divide="ignore"):
+            linear = m * np.log(m / np.maximum(zeros, 1))
+        return np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+
+
+#
+# The daily sketches are stored next to the swap data, one file per day,
+# with one row per pool for the traders and the transactions.
+#
+def save_day_sketches(filename, pools, traders, txs):
+    np.savez_compressed(filename, precision=traders.precision, pools=np.asarray(pools, dtype=str),
+                        traders=traders.registers, txs=txs.registers)
+
+
+def load_day_sketches(filename):
+    with np.load(filename, allow_pickle=False) as f:
+        precision = int(f["precision"])
+        # the stored names are numpy string scalars (np.str_); convert them to plain str,
+        # so that they pickle, print and sort like the pool names read from the swap files
+        pools = [str(u) for u in f["pools"]]
+        return pools, HyperLogLog(precision, registers=f["traders"]), HyperLogLog(precision, registers=f["txs"])
+
+
+#
+# Merges the daily sketches of the given files. Returns (pools, traders, txs),
+# where the sketches have one row for each pool that appears in any of the files
+# (or only for the selected pools, if given).
+#
+def merge_day_sketches(filenames, selected_pools=None):
+    merged = {}
+    precision = None
+    for filename in filenames:
+        pools, traders, txs = load_day_sketches(filename)
+        if precision is None:
+            precision = traders.precision
+        assert precision == traders.precision, "cannot merge sketches with different precision"
+        for i, pool in enumerate(pools):
+            if selected_pools is not None and pool not in selected_pools:
+                continue
+            if pool in merged:
+                np.maximum(merged[pool][0], traders.registers[i], out=merged[pool][0])
+                np.maximum(merged[pool][1], txs.registers[i], out=merged[pool][1])
+            else:
+                merged[pool] = (traders.registers[i].copy(), txs.registers[i].copy())
+
+    pools = sorted(merged)
+    if len(pools) == 0:
+        return pools, None, None
+    traders = HyperLogLog(precision, registers=np.stack([merged[pool][0] for pool in pools]))
+    txs = HyperLogLog(precision, registers=np.stack([merged[pool][1] for pool in pools]))
+    return pools, traders, txs
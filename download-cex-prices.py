@@ -2,23 +2,19 @@
 
 #
 # This script downloads BTC and ETH price data from yfinance, for offline use. 
+# The data is stored in data/cex-prices by the market data cache (see `market_data.py`),
+# so only the dates that are not stored yet are downloaded.
 #
 
-import yfinance as yf
-import pandas as pd
-import os
-
-DIR = os.path.join("data", f"cex-prices")
+from market_data import get_prices
 
 PERIOD_START = "2020-01-01"
 PERIOD_END = "2024-01-01"
 
 def download(symbol):
     pair = symbol + "-USD" 
-    data = yf.download(pair, start=PERIOD_START, end=PERIOD_END)
+    data = get_prices(pair, PERIOD_START, PERIOD_END)
     print(data)
-    filename = os.path.join(DIR, pair + ".csv")
-    data.to_csv(filename)
 
 def main():
     download("ETH")
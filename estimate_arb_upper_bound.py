@@ -42,111 +42,159 @@
 # because some of the perceived arbitragers will in fact be normal traders swapping.
 #
 #
+# The estimate is computed for every pool in the swap files at once, and saved as
+# a per-pool, per-day table, for both token0 and token1 volumes.
+# For a single pool, the token0 volume is also printed, using the given decimals.
+#
 # Warning: for now, always assumes that token1 is ETH! Change the code for pools where false!
 
 import os
+import numpy as np
+from swap_data import swaps_dir, list_day_files, load_swaps, get_in_out_amounts
+import flow_cube
 
 YEAR = os.getenv("YEAR")
 if YEAR is None or len(YEAR) == 0:
     YEAR = "2023"
 
+# a single pool, a comma-separated list of pools, or "all"
 POOL = os.getenv("POOL")
 if POOL is None or len(POOL) == 0:
     POOL = "0xb4e16d0168e52d35cacd2c6185b44281ec28c9dc" # v2 USDC/ETH
 POOL = POOL.lower()
+POOLS = None if POOL == "all" else POOL.split(",")
 
 DECIMALS = os.getenv("DECIMALS")
 if DECIMALS is None or len(DECIMALS) == 0:
     DECIMALS = 6 # for USDC
 DECIMALS = int(DECIMALS)
 
-# only v2 supported for now
-VERSION = 2
+VERSION = os.getenv("VERSION")
+try:
+    VERSION = int(VERSION)
+except:
+    VERSION = 2
+if VERSION not in [2, 3]:
+    print("Uniswap v2 or v3 supported")
+    exit(-1)
+
+# read the per-block aggregates from the flow cube, where it exists (see `flow_cube.py`)
+USE_CUBE = os.getenv("USE_CUBE", "1") != "0"
+
+# pools with fewer swaps are not included in the ranking
+MIN_SWAPS = 1000
 
 print(f"using pool {POOL} on Uniswap v{VERSION}, year {YEAR}, token0 decimals {DECIMALS}")
 
 self_dir = os.path.dirname(os.path.abspath(__file__))
-data_dir = os.path.join(self_dir, "data", f"uniswap-v{VERSION}-swaps", YEAR)
-
-
-def load_csv(filename):
-    result = []
-    with open(os.path.join(data_dir, filename)) as f:
-        f.readline() # skip the header
-        for line in f.readlines():
-            fields = line.strip().split(",")
-            if len(fields) == 0:
-                continue
-            pool = fields[2]
-            if pool != POOL:
-                continue
-            result.append(fields)
-    return result
+data_dir = swaps_dir(os.path.join(self_dir, "data"), VERSION, YEAR)
 
 
-def classify_trades(data):
-    current_block = None # start from a fresh block
-
-    block_volume_token0_in = 0
-    block_volume_token0_out = 0
-
-    total_volume_token0 = 0
-    maybe_arb_volume_token0 = 0
-
-    # token0: e.g. USDC, token1: ETH
-    for row in data:
-        if VERSION == 2:
-            (_, block, _, amount0_in, amount1_in, amount0_out, amount1_out, address, _) = row
-            amount0_in = int(amount0_in)
-            amount0_out = int(amount0_out)
-
-            # remove fake "volume" created due to pool imbalance, returned to the swapper due to sync() call
-            if amount0_in > 0 and amount0_out > 0:
-                if amount0_in > amount0_out:
-                    amount0_in -= amount0_out
-                    amount0_out = 0
-                else:
-                    amount0_out -= amount0_in
-                    amount0_in = 0
-
-        if current_block != block:
-            current_block = block
-            total_volume_token0 += block_volume_token0_in + block_volume_token0_out
-            maybe_arb_volume_token0 += abs(block_volume_token0_in - block_volume_token0_out) 
-            block_volume_token0_in = 0
-            block_volume_token0_out = 0
+#
+# Returns the start indices of the segments where any of the (sorted) keys changes.
+#
+def segment_starts(*keys):
+    changed = np.zeros(len(keys[0]), dtype=bool)
+    changed[0] = True
+    for key in keys:
+        changed[1:] |= key[1:] != key[:-1]
+    return np.flatnonzero(changed)
 
-        block_volume_token0_in += amount0_in
-        block_volume_token0_out += amount0_out
 
+#
+# Returns a dict {pool: (num_swaps, total0, maybe_arb0, total1, maybe_arb1)}.
+#
+def classify_trades(data):
+    if len(data) == 0:
+        return {}
+    pools, codes = np.unique(data["pool"].to_numpy(), return_inverse=True)
+    blocks = data["block"].to_numpy()
+    # the rows are ordered by block already; a stable sort keeps that order for each pool
+    order = np.argsort(codes, kind="stable")
+    codes = codes[order]
+    blocks = blocks[order]
+
+    a0_in, a0_out, a1_in, a1_out = [u[order] for u in get_in_out_amounts(data, VERSION)]
+
+    block_starts = segment_starts(codes, blocks)
+    pool_starts = segment_starts(codes)
+    # the first block segment of each pool
+    pool_block_starts = segment_starts(codes[block_starts])
+
+    result = {}
+    totals = []
+    for a_in, a_out in [(a0_in, a0_out), (a1_in, a1_out)]:
+        block_in = np.add.reduceat(a_in, block_starts)
+        block_out = np.add.reduceat(a_out, block_starts)
+        total = np.add.reduceat(block_in + block_out, pool_block_starts)
+        maybe_arb = np.add.reduceat(np.abs(block_in - block_out), pool_block_starts)
+        totals.append((total, maybe_arb))
+
+    num_swaps = np.diff(np.append(pool_starts, len(codes)))
+    for i, code in enumerate(codes[pool_starts]):
+        result[pools[code]] = (int(num_swaps[i]), totals[0][0][i], totals[0][1][i], totals[1][0][i], totals[1][1][i])
+    return result
 
-    total_volume_token0 += block_volume_token0_in + block_volume_token0_out
-    maybe_arb_volume_token0 += abs(block_volume_token0_in - block_volume_token0_out) 
 
-    return (total_volume_token0, maybe_arb_volume_token0)
+#
+# Same as `classify_trades`, but from the per-block aggregates of the flow cube.
+#
+def classify_cube_trades(cube):
+    result = {}
+    pools = cube.pools if POOLS is None else [p for p in POOLS if p in cube.pool_index]
+    for pool in pools:
+        rows = cube.pool_rows(pool)
+        result[pool] = (int(rows["n_trades"].sum()),
+                        np.sum(rows["token0_in"] + rows["token0_out"]),
+                        np.sum(np.abs(rows["token0_in"] - rows["token0_out"])),
+                        np.sum(rows["token1_in"] + rows["token1_out"]),
+                        np.sum(np.abs(rows["token1_in"] - rows["token1_out"])))
+    return result
 
 
 def main():
-    total = 0
-    maybe_arb = 0
+    per_pool = {}
     days_tracked = 0
-    for filename in sorted(os.listdir(data_dir)):
-        if "-swaps.csv" in filename:
-            data = load_csv(filename)
-            day_total, day_maybe_arb = classify_trades(data)
-            total += day_total
-            maybe_arb += day_maybe_arb
+    filename = f"arb-upper-bound-v{VERSION}-{YEAR}.csv"
+    with open(filename, "w") as outf:
+        outf.write("date,pool,num_swaps,total0,maybe_arb0,total1,maybe_arb1\n")
+        for date, swaps_filename in list_day_files(data_dir):
+            cube = flow_cube.load_day(VERSION, date) if USE_CUBE else None
+            if cube is not None:
+                day_result = classify_cube_trades(cube)
+            else:
+                data = load_swaps(swaps_filename, VERSION, pools=POOLS)
+                day_result = classify_trades(data)
+            for pool in sorted(day_result):
+                r = day_result[pool]
+                outf.write(f"{date},{pool},{r[0]},{r[1]:.0f},{r[2]:.0f},{r[3]:.0f},{r[4]:.0f}\n")
+                if pool in per_pool:
+                    per_pool[pool] = [a + b for a, b in zip(per_pool[pool], r)]
+                else:
+                    per_pool[pool] = list(r)
             days_tracked += 1
+    print(f"{days_tracked} days tracked, the per-day table saved in {filename}")
+
+    if POOLS is not None and len(POOLS) == 1:
+        if POOLS[0] not in per_pool:
+            return
+        _, total, maybe_arb, _, _ = per_pool[POOLS[0]]
+        if total / (10 ** DECIMALS) > 1_000_000:
+            print(f"total token0 volume: {total / (10 ** DECIMALS) * 1e-6:.2f} million")
+            print(f"maybe arbitrage token0 volume: {maybe_arb / (10 ** DECIMALS) * 1e-6:.2f} million")
+        else:
+            print(f"total token0 volume: {total / (10 ** DECIMALS)}")
+            print(f"maybe arbitrage token0 volume: {maybe_arb / (10 ** DECIMALS)}")
+        maybe_arb_proportion = maybe_arb / total
+        print(f"maybe arbitrage volume proportion: {100*maybe_arb_proportion:.2f}%")
+        return
+
+    ranking = [(pool, r[2] / r[1]) for pool, r in per_pool.items() if r[0] >= MIN_SWAPS and r[1] > 0]
+    ranking.sort(key=lambda x: -x[1])
+    print(f"pools with at least {MIN_SWAPS} swaps, by maybe arbitrage volume proportion:")
+    for pool, proportion in ranking:
+        print(f"{pool} {100*proportion:.2f}%")
 
-    print(f"{days_tracked} days tracked")
-    if total / (10 ** DECIMALS) > 1_000_000:
-        print(f"total token0 volume: {total / (10 ** DECIMALS) * 1e-6:.2f} million")
-        print(f"maybe arbitrage token0 volume: {maybe_arb / (10 ** DECIMALS) * 1e-6:.2f} million")
-    else:
-        print(f"total token0 volume: {total / (10 ** DECIMALS)}")
-        print(f"maybe arbitrage token0 volume: {maybe_arb / (10 ** DECIMALS)}")
-    maybe_arb_proportion = maybe_arb / total
-    print(f"maybe arbitrage volume proportion: {100*maybe_arb_proportion:.2f}%")
 
 if __name__ == "__main__":
     main()
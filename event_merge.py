@@ -0,0 +1,131 @@
+#
+# This module merges the Uniswap v3 mints and burns (`download-lp-data-v3.py`) with the swaps
+# (`download-swap-data-v3.py`) into a single stream of events, ordered by block and log position.
+#
+# Each day file is read line by line and the files are merged with `heapq.merge`, so only the current
+# line of each file is in memory. The events are dicts with the common fields:
+#   type (MINT, BURN or SWAP, as in `v3_replay.py`), timestamp, block, pool, tx_hash, amount0, amount1
+# plus tick_lower, tick_upper and liquidity for the mints and burns, and to and sender for the swaps.
+# The amounts are Python ints; the v3 swap amounts are signed, from the pool's point of view.
+#
+# These files do not have the log indexes of the events. Each file is in log order, so the events
+# of the same type are in order; across the files, the order within a block comes from the position
+# of the transaction in the block, taken from the `uniswap-v3-all` events of the same day (which are
+# in log order) if they are downloaded. The events of the same transaction, and of all transactions
+# if that file is missing, are ordered mints first, then swaps, then burns.
+#
+
+import os
+import heapq
+
+from swap_data import swaps_dir, list_day_files
+from v3_replay import MINT, BURN, SWAP
+
+self_dir = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(self_dir, "data")
+
+# the order of the events of the same transaction
+TYPE_RANKS = {MINT: 0, SWAP: 1, BURN: 2}
+
+
+def lp_dir(data_dir, year):
+    return os.path.join(data_dir, "uniswap-v3-lp", str(year))
+
+
+def events_filename(data_dir, date):
+    return os.path.join(data_dir, "uniswap-v3-all", date[:4], date + "-events.csv")
+
+
+#
+# Returns a sorted list of (date, {MINT: filename, BURN: filename, SWAP: filename}) for the days
+# that have all three files.
+#
+def day_files(year, data_dir=DATA_DIR):
+    mints = dict(list_day_files(lp_dir(data_dir, year), "-mints.csv"))
+    burns = dict(list_day_files(lp_dir(data_dir, year), "-burns.csv"))
+    swaps = dict(list_day_files(swaps_dir(data_dir, 3, year), "-swaps.csv"))
+    result = []
+    for date in sorted(set(mints) & set(burns) & set(swaps)):
+        result.append((date, {MINT: mints[date], BURN: burns[date], SWAP: swaps[date]}))
+    return result
+
+
+#
+# Returns {tx_hash: position in the block}, from the `uniswap-v3-all` events of the day;
+# None if the file is not downloaded.
+#
+def load_tx_positions(date, data_dir=DATA_DIR):
+    filename = events_filename(data_dir, date)
+    if not os.access(filename, os.R_OK):
+        return None
+    result = {}
+    with open(filename) as f:
+        header = f.readline().strip().split(",")
+        block_column = header.index("block")
+        tx_column = header.index("tx_hash")
+        block = None
+        position = 0
+        for line in f:
+            fields = line.strip().split(",")
+            if len(fields) <= tx_column:
+                continue
+            if fields[block_column] != block:
+                block = fields[block_column]
+                position = 0
+            tx_hash = fields[tx_column]
+            if tx_hash not in result:
+                result[tx_hash] = position
+                position += 1
+    return result
+
+
+def parse_lp_event(fields, event_type):
+    # timestamp, block, pool, tickLower, tickUpper, liquidity, amount0, amount1, tx_hash
+    return {"type": event_type, "timestamp": int(fields[0]), "block": int(fields[1]), "pool": fields[2],
+            "tick_lower": int(fields[3]), "tick_upper": int(fields[4]), "liquidity": int(fields[5]),
+            "amount0": int(fields[6]), "amount1": int(fields[7]), "tx_hash": fields[8]}
+
+
+def parse_swap_event(fields):
+    # timestamp, block, pool, amount0, amount1, to, sender, tx_hash
+    return {"type": SWAP, "timestamp": int(fields[0]), "block": int(fields[1]), "pool": fields[2],
+            "amount0": int(fields[3]), "amount1": int(fields[4]), "to": fields[5], "sender": fields[6],
+            "tx_hash": fields[7]}
+
+
+#
+# Yields (sort key, event) for the events of a day file, in the order of the file.
+#
+def read_events(filename, event_type, tx_positions=None, pools=None):
+    rank = TYPE_RANKS[event_type]
+    position = 0
+    block = None
+    with open(filename) as f:
+        f.readline() # skip the header
+        for row, line in enumerate(f):
+            fields = line.strip().split(",")
+            if len(fields) < 8:
+                continue
+            if pools is not None and fields[2] not in pools:
+                continue
+            if event_type == SWAP:
+                event = parse_swap_event(fields)
+            else:
+                event = parse_lp_event(fields, event_type)
+            if event["block"] != block:
+                block = event["block"]
+                position = 0
+            if tx_positions is not None:
+                # a transaction that is missing from the events keeps the position of the previous one
+                position = tx_positions.get(event["tx_hash"], position)
+            yield (event["block"], position, rank, row), event
+
+
+#
+# Yields the events of the day files ({type: filename}) in block and log order.
+#
+def merge_events(files, tx_positions=None, pools=None):
+    streams = [read_events(filename, event_type, tx_positions, pools) for event_type, filename in files.items()]
+    for _, event in heapq.merge(*streams, key=lambda u: u[0]):
+        yield event
+
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+#
+# This file creates and reads the "flow cube": per-pool, per-block aggregates of the swaps.
+#
+# For each pool and each block with at least one swap, the cube has:
+#   n_trades, token0_in, token0_out, token1_in, token1_out (from the pool's point of view),
+#   first_price, last_price (raw token1 per token0, after the first / last price update in the block),
+#   n_senders (number of distinct swap senders).
+#
+# The cube is built once for each day file and stored in a compact columnar form:
+#   data/flow-cube/v{VERSION}/{YEAR}/{DATE}-cube.npz
+# The rows are sorted by pool and block; `pool_offsets` gives the rows of each pool.
+#
+# The prices come from the v3 Swap events in `uniswap-v3-all` (sqrtPriceX96) or from
+# the v2 Sync events (`-sync.csv` files next to the swaps). If these are not downloaded,
+# the prices are NaN.
+#
+# Run this file to build the cube for all days that do not have it yet.
+#
+
+import os
+import numpy as np
+import pandas as pd
+from swap_data import swaps_dir, list_day_files, load_swaps, get_in_out_amounts
+from amm_math import sqrt_price_x96_to_price, reserves_to_price
+
+YEAR = os.getenv("YEAR")
+if YEAR is None or len(YEAR) == 0:
+    YEAR = "2023"
+
+VERSION = os.getenv("VERSION")
+try:
+    VERSION = int(VERSION)
+except:
+    VERSION = 3
+
+self_dir = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(self_dir, "data")
+
+CUBE_COLUMNS = ["block", "n_trades", "token0_in", "token0_out", "token1_in", "token1_out",
+                "first_price", "last_price", "n_senders"]
+
+
+def cube_dir(version, year, data_dir=DATA_DIR):
+    return os.path.join(data_dir, "flow-cube", f"v{version}", str(year))
+
+
+def cube_filename(version, date, data_dir=DATA_DIR):
+    return os.path.join(cube_dir(version, date[:4], data_dir), date + "-cube.npz")
+
+
+def load_block_prices(version, date, data_dir=DATA_DIR):
+    # returns a dataframe with pool, block, first_price, last_price; or None if no source is present
+    year = date[:4]
+    if version == 3:
+        filename = os.path.join(data_dir, "uniswap-v3-all", year, date + "-events.csv")
+        if not os.access(filename, os.R_OK):
+            return None
+        df = pd.read_csv(filename, usecols=["block", "pool", "type", "price"],
+                         dtype={"block": np.int64, "pool": str, "type": np.int64, "price": np.float64})
+        df = df[df["type"] == 3]
+        prices = sqrt_price_x96_to_price(df["price"].to_numpy())
+    else:
+        filename = os.path.join(swaps_dir(data_dir, version, year), date + "-sync.csv")
+        if not os.access(filename, os.R_OK):
+            return None
+        df = pd.read_csv(filename, usecols=["block", "pool", "reserve0", "reserve1"],
+                         dtype={"block": np.int64, "pool": str, "reserve0": np.float64, "reserve1": np.float64})
+        prices = reserves_to_price(df["reserve0"].to_numpy(), df["reserve1"].to_numpy())
+
+    df = pd.DataFrame({"pool": df["pool"].to_numpy(), "block": df["block"].to_numpy(), "price": prices})
+    grouped = df.groupby(["pool", "block"], sort=False)["price"]
+    return pd.DataFrame({"first_price": grouped.first(), "last_price": grouped.last()}).reset_index()
+
+
+def build_day(version, date, swaps_filename, data_dir=DATA_DIR):
+    swaps = load_swaps(swaps_filename, version)
+    a0_in, a0_out, a1_in, a1_out = get_in_out_amounts(swaps, version)
+    df = pd.DataFrame({
+        "pool": swaps["pool"].to_numpy(),
+        "block": swaps["block"].to_numpy(),
+        "token0_in": a0_in,
+        "token0_out": a0_out,
+        "token1_in": a1_in,
+        "token1_out": a1_out,
+        "sender": swaps["sender"].to_numpy(),
+    })
+    grouped = df.groupby(["pool", "block"], sort=True)
+    cube = grouped.agg(n_trades=("block", "size"),
+                       token0_in=("token0_in", "sum"), token0_out=("token0_out", "sum"),
+                       token1_in=("token1_in", "sum"), token1_out=("token1_out", "sum"),
+                       n_senders=("sender", "nunique")).reset_index()
+
+    prices = load_block_prices(version, date, data_dir)
+    if prices is not None:
+        cube = cube.merge(prices, on=["pool", "block"], how="left")
+    else:
+        cube["first_price"] = np.nan
+        cube["last_price"] = np.nan
+
+    pools, pool_starts = np.unique(cube["pool"].to_numpy(), return_index=True)
+    pool_offsets = np.append(pool_starts, len(cube))
+
+    filename = cube_filename(version, date, data_dir)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    np.savez_compressed(filename,
+                        pools=pools.astype(str),
+                        pool_offsets=pool_offsets,
+                        block=cube["block"].to_numpy(np.int64),
+                        n_trades=cube["n_trades"].to_numpy(np.int32),
+                        token0_in=cube["token0_in"].to_numpy(np.float64),
+                        token0_out=cube["token0_out"].to_numpy(np.float64),
+                        token1_in=cube["token1_in"].to_numpy(np.float64),
+                        token1_out=cube["token1_out"].to_numpy(np.float64),
+                        first_price=cube["first_price"].to_numpy(np.float64),
+                        last_price=cube["last_price"].to_numpy(np.float64),
+                        n_senders=cube["n_senders"].to_numpy(np.int32))
+    return filename
+
+
+def update_cube(version, year, data_dir=DATA_DIR):
+    for date, swaps_filename in list_day_files(swaps_dir(data_dir, version, year)):
+        if os.access(cube_filename(version, date, data_dir), os.R_OK):
+            continue
+        print(f"building flow cube for {date}")
+        build_day(version, date, swaps_filename, data_dir)
+
+
+############################################################
+
+class DayCube:
+    def __init__(self, filename):
+        with np.load(filename, allow_pickle=False) as f:
+            self.pools = [str(u) for u in f["pools"]]
+            self.pool_offsets = f["pool_offsets"]
+            self.columns = {c: f[c] for c in CUBE_COLUMNS}
+        self.pool_index = {pool: i for i, pool in enumerate(self.pools)}
+
+    def __len__(self):
+        return len(self.columns["block"])
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def pool_rows(self, pool):
+        # returns a dict of column arrays for the given pool (empty arrays if the pool has no swaps)
+        i = self.pool_index.get(pool)
+        if i is None:
+            return {c: self.columns[c][:0] for c in CUBE_COLUMNS}
+        start, end = self.pool_offsets[i], self.pool_offsets[i + 1]
+        return {c: self.columns[c][start:end] for c in CUBE_COLUMNS}
+
+    def row_pools(self):
+        # the pool name of each row
+        counts = np.diff(self.pool_offsets)
+        return np.repeat(np.asarray(self.pools), counts)
+
+
+def load_day(version, date, data_dir=DATA_DIR):
+    filename = cube_filename(version, date, data_dir)
+    if not os.access(filename, os.R_OK):
+        return None
+    return DayCube(filename)
+
+
+def has_cube(version, dates, data_dir=DATA_DIR):
+    return len(dates) > 0 and all(os.access(cube_filename(version, d, data_dir), os.R_OK) for d in dates)
+
+
+def main():
+    print(f"building the flow cube for Uniswap v{VERSION}, year {YEAR}")
+    update_cube(VERSION, YEAR)
+
+
+if __name__ == "__main__":
+    main()
+    print("all done")
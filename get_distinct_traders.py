@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+#
+# This script gets the approximate number of unique traders and unique transactions
+# per pool, for each day and each month.
+#
+# Traders are the union of the `sender` and `to` addresses of the swaps.
+# The counts are estimated with HyperLogLog sketches. A sketch file is stored for each day
+# next to the swap data (`YYYY-MM-DD-distinct.npz`), so that any date range can be answered
+# by merging the daily sketches, without rescanning the swaps.
+#
+
+import os
+import numpy as np
+from swap_data import swaps_dir, list_day_files, load_swaps
+from distinct_counter import HyperLogLog, precision_for_error, save_day_sketches, load_day_sketches, merge_day_sketches
+
+YEAR = os.getenv("YEAR")
+if YEAR is None or len(YEAR) == 0:
+    YEAR = "2023"
+
+# if not set, the monthly counts are saved for all pools
+POOL = os.getenv("POOL")
+if POOL is not None:
+    POOL = POOL.lower()
+
+VERSION = os.getenv("VERSION")
+try:
+    VERSION = int(VERSION)
+except:
+    VERSION = 3
+if VERSION not in [2, 3]:
+    print("Uniswap v2 or v3 supported")
+    exit(-1)
+
+# relative standard error of the estimates
+ERROR = os.getenv("ERROR")
+if ERROR is None or len(ERROR) == 0:
+    ERROR = 0.01
+ERROR = float(ERROR)
+PRECISION = precision_for_error(ERROR)
+
+print(f"using Uniswap v{VERSION}, year {YEAR}, HyperLogLog precision {PRECISION}")
+
+self_dir = os.path.dirname(os.path.abspath(__file__))
+data_dir = swaps_dir(os.path.join(self_dir, "data"), VERSION, YEAR)
+
+
+def sketch_filename(swaps_filename):
+    return swaps_filename.replace("-swaps.csv", "-distinct.npz")
+
+
+def build_day_sketches(filename):
+    df = load_swaps(filename, VERSION, usecols=["pool", "to", "sender", "tx_hash"])
+    pools, rows = np.unique(df["pool"].to_numpy(), return_inverse=True)
+
+    traders = HyperLogLog(PRECISION, num_rows=len(pools))
+    traders.add(df["sender"].to_numpy(), rows)
+    traders.add(df["to"].to_numpy(), rows)
+
+    txs = HyperLogLog(PRECISION, num_rows=len(pools))
+    txs.add(df["tx_hash"].to_numpy(), rows)
+
+    save_day_sketches(sketch_filename(filename), pools, traders, txs)
+
+
+def update_sketches():
+    for date, filename in list_day_files(data_dir):
+        sketch_file = sketch_filename(filename)
+        if os.access(sketch_file, os.R_OK):
+            if load_day_sketches(sketch_file)[1].precision == PRECISION:
+                continue
+        print(f"building sketches for {date}")
+        build_day_sketches(filename)
+
+
+def count_range(dates, selected_pools=None):
+    files = [sketch_filename(filename) for date, filename in list_day_files(data_dir) if date in dates]
+    pools, traders, txs = merge_day_sketches(files, selected_pools)
+    if len(pools) == 0:
+        return {}
+    return {pool: (t, x) for pool, t, x in zip(pools, traders.count(), txs.count())}
+
+
+def main():
+    update_sketches()
+
+    days = [date for date, _ in list_day_files(data_dir)]
+    months = sorted(set(date[:7] for date in days))
+    selected_pools = None if POOL is None else set([POOL])
+
+    if POOL is not None:
+        print("date,traders,txs")
+        for date in days:
+            counts = count_range(set([date]), selected_pools)
+            traders, txs = counts.get(POOL, (0, 0))
+            print(f"{date},{traders:.0f},{txs:.0f}")
+
+    filename = f"distinct-v{VERSION}-{YEAR}.csv"
+    with open(filename, "w") as outf:
+        outf.write("month,pool,traders,txs\n")
+        for month in months + [YEAR]:
+            counts = count_range(set(date for date in days if date.startswith(month)), selected_pools)
+            for pool in sorted(counts):
+                traders, txs = counts[pool]
+                outf.write(f"{month},{pool},{traders:.0f},{txs:.0f}\n")
+            if POOL is not None and POOL in counts:
+                print(f"{month}: traders={counts[POOL][0]:.0f} txs={counts[POOL][1]:.0f}")
+    print(f"saved monthly and yearly counts in {filename}")
+
+
+if __name__ == "__main__":
+    main()
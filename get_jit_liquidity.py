@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+#
+# This script detects just-in-time (JIT) liquidity in Uniswap v3 pools: a position that is minted,
+# then used by one or more swaps, and then burned, all in the same block.
+#
+# The mints, burns and swaps of each day are merged into one stream in block and log order
+# (see `event_merge.py`). Within each block and pool, a burn is matched with the last mint
+# of the same range and the same liquidity before it; if there was at least one swap in the pool
+# between them, the position is counted as JIT liquidity.
+#
+# The volume filled by a JIT position is the difference of the amounts of its burn and its mint:
+# the token that the position received is the swap input, the other the swap output. The fees that it
+# captured are fee / (1 - fee) of the input, as the Burn amounts do not include the fees. If the swaps
+# of the block go in both directions, these are lower bounds, as only the net amounts are known.
+# The fee tier of each pool is found from the tick spacing of its mints.
+#
+# The amounts are in the smallest token units. Only the current block is kept in memory, plus
+# the totals of each pool. The results are written to:
+#   jit-liquidity-{YEAR}.csv
+#
+
+import os
+from math import gcd
+from itertools import groupby
+
+from v3_replay import MINT, BURN, SWAP
+from get_v3_fee_returns import fee_tier_from_ticks
+import event_merge
+
+YEAR = os.getenv("YEAR")
+if YEAR is None or len(YEAR) == 0:
+    YEAR = "2023"
+
+# a comma-separated list, or "all"
+POOL = os.getenv("POOL")
+if POOL is None or len(POOL) == 0:
+    POOL = "all"
+POOL = POOL.lower()
+POOLS = None if POOL == "all" else set(POOL.split(","))
+
+STATS_FIELDS = ["swaps", "volume0", "volume1", "jit_positions", "jit_blocks", "jit_swaps",
+                "jit_volume0", "jit_volume1", "jit_input0", "jit_input1"]
+
+
+def new_stats():
+    stats = {u: 0 for u in STATS_FIELDS}
+    # the gcd of the ticks of the mints, for the fee tier
+    stats["tick_gcd"] = 0
+    return stats
+
+
+#
+# Returns the JIT positions of the events of one pool in one block, as a list of (mint, burn, swaps),
+# where `swaps` are the swaps between them.
+#
+def find_jit_positions(events):
+    result = []
+    # (tick_lower, tick_upper, liquidity) -> [mint, swaps since the mint]
+    open_positions = {}
+    for event in events:
+        if event["type"] == MINT:
+            open_positions[(event["tick_lower"], event["tick_upper"], event["liquidity"])] = [event, []]
+        elif event["type"] == SWAP:
+            for position in open_positions.values():
+                position[1].append(event)
+        elif event["type"] == BURN:
+            position = open_positions.pop((event["tick_lower"], event["tick_upper"], event["liquidity"]), None)
+            if position is not None and len(position[1]):
+                result.append((position[0], event, position[1]))
+    return result
+
+
+def process_block(events, all_stats):
+    events.sort(key=lambda e: e["pool"]) # stable, keeps the log order within each pool
+    for pool, pool_events in groupby(events, key=lambda e: e["pool"]):
+        pool_events = list(pool_events)
+        stats = all_stats.get(pool)
+        if stats is None:
+            stats = all_stats[pool] = new_stats()
+        has_mint = has_burn = False
+        for event in pool_events:
+            if event["type"] == SWAP:
+                stats["swaps"] += 1
+                stats["volume0"] += abs(event["amount0"])
+                stats["volume1"] += abs(event["amount1"])
+            elif event["type"] == MINT:
+                has_mint = True
+                stats["tick_gcd"] = gcd(stats["tick_gcd"], event["tick_lower"], event["tick_upper"])
+            else:
+                has_burn = True
+        if not (has_mint and has_burn):
+            continue
+
+        jit_positions = find_jit_positions(pool_events)
+        if len(jit_positions) == 0:
+            continue
+        stats["jit_blocks"] += 1
+        jit_swaps = set()
+        for mint, burn, swaps in jit_positions:
+            stats["jit_positions"] += 1
+            jit_swaps.update(id(e) for e in swaps)
+            d0 = burn["amount0"] - mint["amount0"]
+            d1 = burn["amount1"] - mint["amount1"]
+            stats["jit_volume0"] += abs(d0)
+            stats["jit_volume1"] += abs(d1)
+            stats["jit_input0"] += max(d0, 0)
+            stats["jit_input1"] += max(d1, 0)
+        stats["jit_swaps"] += len(jit_swaps)
+
+
+def write_results(all_stats, filename):
+    with open(filename, "w") as f:
+        f.write("pool,fee_tier," + ",".join(STATS_FIELDS) + ",jit_fees0,jit_fees1,jit_share0,jit_share1\n")
+        pools = sorted(all_stats, key=lambda p: all_stats[p]["jit_positions"], reverse=True)
+        for pool in pools:
+            stats = all_stats[pool]
+            fee_tier = fee_tier_from_ticks([stats["tick_gcd"]])
+            factor = fee_tier / (1 - fee_tier) if fee_tier is not None else float("nan")
+            share0 = stats["jit_volume0"] / stats["volume0"] if stats["volume0"] else 0.0
+            share1 = stats["jit_volume1"] / stats["volume1"] if stats["volume1"] else 0.0
+            values = [pool, fee_tier] + [stats[u] for u in STATS_FIELDS] + \
+                [stats["jit_input0"] * factor, stats["jit_input1"] * factor, share0, share1]
+            f.write(",".join(str(u) for u in values) + "\n")
+
+
+def main():
+    all_stats = {}
+    for date, files in event_merge.day_files(YEAR):
+        tx_positions = event_merge.load_tx_positions(date)
+        if tx_positions is None:
+            print(f"{date}: no events file, the order within the blocks is approximate")
+        events = event_merge.merge_events(files, tx_positions, POOLS)
+        for block, block_events in groupby(events, key=lambda e: e["block"]):
+            process_block(list(block_events), all_stats)
+        print(date)
+
+    filename = f"jit-liquidity-{YEAR}.csv"
+    write_results(all_stats, filename)
+    num_positions = sum(stats["jit_positions"] for stats in all_stats.values())
+    num_pools = sum(1 for stats in all_stats.values() if stats["jit_positions"])
+    print(f"{num_positions} JIT positions in {num_pools} pools, results written to {filename}")
+
+
+if __name__ == "__main__":
+    main()
+    print("all done")
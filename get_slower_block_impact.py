@@ -6,6 +6,9 @@
 
 import os
 import numpy as np
+import pandas as pd
+from amm_math import sqrt_price_x96_to_log_price
+import flow_cube
 
 YEAR = os.getenv("YEAR")
 if YEAR is None or len(YEAR) == 0:
@@ -23,6 +26,17 @@ DECIMALS = int(DECIMALS)
 
 VERSION = 3
 
+# block times (in seconds) to simulate; each must be a multiple of 12 seconds
+BLOCK_TIMES = os.getenv("BLOCK_TIMES")
+if BLOCK_TIMES is None or len(BLOCK_TIMES) == 0:
+    BLOCK_TIMES = "24,36,48,60,120"
+BLOCK_TIMES = [int(u) for u in BLOCK_TIMES.split(",")]
+
+ORIGINAL_BLOCK_TIME = 12
+
+# read the per-block aggregates from the flow cube, where it exists (see `flow_cube.py`)
+USE_CUBE = os.getenv("USE_CUBE", "1") != "0"
+
 print(f"using pool {POOL} on Uniswap v{VERSION}, year {YEAR}, token0 decimals {DECIMALS}")
 
 self_dir = os.path.dirname(os.path.abspath(__file__))
@@ -30,137 +44,187 @@ data_dir = os.path.join(self_dir, "data", f"uniswap-v{VERSION}-all", YEAR)
 
 
 def load_csv(filename):
-    result = []
-    with open(os.path.join(data_dir, filename)) as f:
-        f.readline() # skip the header
-        #timestamp,block,pool,tx_hash,type,price,tick_lower,tick_upper,liquidity,amount0,amount1
-        for line in f.readlines():
-            fields = line.strip().split(",")
-            if len(fields) == 0:
-                continue
-            pool = fields[2]
-            if pool != POOL:
-                continue
-            event_type = fields[4]
-            if event_type != "3":
-                continue
-            block = int(fields[1])
-            price = int(fields[5]) ** 2 # use price instead of sqrt price
-            result.append((block, price, int(fields[-2]), int(fields[-1])))
-    return result
-
-
-def get_block_price(block_trades, use_last_price_in_block):
-    if len(block_trades) == 0:
-        return -1
-    index = -1 if use_last_price_in_block else 0
-    return block_trades[index][1]
-    
-
-def process_data(data, n_to_skip, use_last_price_in_block):
-    batch_size = n_to_skip + 1
-
-    volume0 = 0
-    reduced_volume0 = 0
-
-    n_blocks_with_trades = 0
-    reduced_n_blocks_with_trades = 0
-
-    n_blocks = len(data)
-    reduced_n_blocks = (n_blocks + n_to_skip) // batch_size
-
-    old_dex_price = -1
-
-    for i in range(0, n_blocks, batch_size):
-        all_empty = all([len(block_trades) == 0 for block_trades in data[i:i+batch_size]])
-        if all_empty:
-            continue
-
-        prices = []
-        volume0_per_subblock = []
-        
-        for j in range(batch_size):
-            if i + j >= len(data):
-                break
-            trades = data[i+j]
-            if len(trades) == 0:
-                continue
-            prices.append(get_block_price(trades, use_last_price_in_block))
-
-            volume0_per_subblock.append(0)
-            for trade in data[i+j]:
-                (block, price, amount0, amount1) = trade
-                volume0_per_subblock[-1] += abs(amount0)
-
-        n_blocks_with_trades += len(volume0_per_subblock)
-        volume0 += sum(volume0_per_subblock)
-
-        have_oscillations = True
-        oscillates_beyond_old = False
-
-        if len(prices) < 2:
-            have_oscillations = False
-        else:
-            if old_dex_price < prices[0] < prices[1] \
-               or old_dex_price > prices[0] > prices[1]:
-                have_oscillations = False
+    #timestamp,block,pool,tx_hash,type,price,tick_lower,tick_upper,liquidity,amount0,amount1
+    df = pd.read_csv(os.path.join(data_dir, filename),
+                     usecols=["block", "pool", "type", "price", "amount0"],
+                     dtype={"block": np.int64, "pool": str, "type": np.int64, "price": np.float64, "amount0": np.float64})
+    df = df[(df["pool"] == POOL) & (df["type"] == 3)]
+    # the prices are only compared with each other, so the log price is sufficient
+    log_prices = sqrt_price_x96_to_log_price(df["price"].to_numpy())
+    return df["block"].to_numpy(), log_prices, np.abs(df["amount0"].to_numpy())
 
-        if not have_oscillations:
-            reduced_n_blocks_with_trades += 1
 
-            reduced_volume0 += sum(volume0_per_subblock)
+#
+# Stores the trades in CSR form: the trades of block `start_block + i` are
+# `prices[offsets[i]:offsets[i+1]]` and `volumes0[offsets[i]:offsets[i+1]]`.
+#
+class BlockTrades:
+    def __init__(self, blocks, prices, volumes0):
+        self.start_block = blocks[0]
+        self.n_blocks = blocks[-1] - blocks[0] + 1
+        counts = np.bincount(blocks - self.start_block, minlength=self.n_blocks)
+        self.offsets = np.zeros(self.n_blocks + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.offsets[1:])
+        self.prices = prices
+        self.volumes0 = volumes0
+
+    #
+    # Returns (block index, price, volume) for each block with at least one trade.
+    #
+    def traded_blocks(self, use_last_price_in_block):
+        nonempty = np.flatnonzero(self.offsets[1:] > self.offsets[:-1])
+        starts = self.offsets[nonempty]
+        ends = self.offsets[nonempty + 1]
+        if use_last_price_in_block:
+            prices = self.prices[ends - 1]
         else:
-            if old_dex_price < prices[0] and old_dex_price > prices[1]:
-                oscillates_beyond_old = True
-
-            if old_dex_price > prices[0] and old_dex_price < prices[1]:
-                oscillates_beyond_old = True
-
-            if oscillates_beyond_old:
-                reduced_n_blocks_with_trades += 1
-                reduced_volume0 += volume0_per_subblock[-1]
-
-        if (not have_oscillations) or oscillates_beyond_old:
-            # have some trades, update the price
-            old_dex_price = prices[-1]
-   
-
-    print(f"block time = {12 * batch_size} sec")
-    print(f"original volume: {volume0/1e12:.0f} million USDC")
-    print(f"volume with new block time: {reduced_volume0/1e12:.0f} million USDC")
-
-    print(f"original blocks with trades: {100*n_blocks_with_trades/n_blocks:.2f} %")
-    expected = batch_size * 100 * n_blocks_with_trades / n_blocks
-    if expected > 100:
-        expected = 100
-    print(f"blocks with trades, new block time: {100*reduced_n_blocks_with_trades/reduced_n_blocks:.2f} % (if no reduction: {expected:.2f} %)")
+            prices = self.prices[starts]
+        volumes = np.add.reduceat(self.volumes0, starts)
+        return nonempty, prices, volumes
+
+
+#
+# Same interface as `BlockTrades`, but reads the per-block aggregates from the flow cube.
+#
+class CubeBlocks:
+    def __init__(self, blocks, first_prices, last_prices, volumes0):
+        self.start_block = blocks[0]
+        self.n_blocks = blocks[-1] - blocks[0] + 1
+        self.blocks = blocks
+        self.first_prices = first_prices
+        self.last_prices = last_prices
+        self.volumes0 = volumes0
+
+    def traded_blocks(self, use_last_price_in_block):
+        prices = self.last_prices if use_last_price_in_block else self.first_prices
+        return self.blocks - self.start_block, prices, self.volumes0
+
+
+def load_cube(dates):
+    columns = {"block": [], "first_price": [], "last_price": [], "volume0": []}
+    for date in dates:
+        rows = flow_cube.load_day(VERSION, date).pool_rows(POOL)
+        if np.any(np.isnan(rows["first_price"])):
+            # the cube was built without the price data
+            return None
+        columns["block"].append(rows["block"])
+        columns["first_price"].append(rows["first_price"])
+        columns["last_price"].append(rows["last_price"])
+        columns["volume0"].append(rows["token0_in"] + rows["token0_out"])
+    columns = {k: np.concatenate(v) for k, v in columns.items()}
+    return CubeBlocks(columns["block"], columns["first_price"], columns["last_price"], columns["volume0"])
+
+
+def process_data(block_trades, batch_size, use_last_price_in_block):
+    block_index, block_prices, block_volumes = block_trades.traded_blocks(use_last_price_in_block)
+
+    n_blocks = block_trades.n_blocks
+    reduced_n_blocks = (n_blocks + batch_size - 1) // batch_size
+
+    # group the traded blocks in batches: each batch becomes a single block
+    batch = block_index // batch_size
+    batch_starts = np.flatnonzero(np.diff(batch, prepend=-1))
+    batch_ends = np.append(batch_starts[1:], len(batch))
+    batch_counts = batch_ends - batch_starts
+    batch_volumes = np.add.reduceat(block_volumes, batch_starts)
+
+    first_price = block_prices[batch_starts]
+    second_price = block_prices[np.minimum(batch_starts + 1, batch_ends - 1)]
+    last_price = block_prices[batch_ends - 1]
+    last_volume = block_volumes[batch_ends - 1]
+
+    n_blocks_with_trades = len(block_index)
+    volume0 = block_volumes.sum()
+
+    # Batches with a single traded subblock always keep all of their volume and update the price.
+    # The price state only needs to be threaded through the batches with multiple subblocks.
+    keep_all = batch_counts < 2
+    keep_last = np.zeros(len(batch_counts), dtype=bool)
+    updated = keep_all.copy()
+
+    # below every price; the prices can be log prices, which are negative when the raw price is below 1
+    old_dex_price = -np.inf
+    first_price_l = first_price.tolist()
+    second_price_l = second_price.tolist()
+    last_price_l = last_price.tolist()
+    for i in np.flatnonzero(~keep_all).tolist():
+        if i > 0 and updated[i - 1]:
+            old_dex_price = last_price_l[i - 1]
+
+        p0 = first_price_l[i]
+        p1 = second_price_l[i]
+        if old_dex_price < p0 < p1 or old_dex_price > p0 > p1:
+            # no oscillations
+            keep_all[i] = True
+            updated[i] = True
+        elif p0 > old_dex_price > p1 or p0 < old_dex_price < p1:
+            # oscillates beyond the old price
+            keep_last[i] = True
+            updated[i] = True
+
+    reduced_n_blocks_with_trades = np.sum(keep_all | keep_last)
+    reduced_volume0 = batch_volumes[keep_all].sum() + last_volume[keep_last].sum()
+
+    expected = min(100, batch_size * 100 * n_blocks_with_trades / n_blocks)
+    return {
+        "block_time": ORIGINAL_BLOCK_TIME * batch_size,
+        "use_last_price_in_block": use_last_price_in_block,
+        "volume": volume0 / (10 ** DECIMALS),
+        "reduced_volume": reduced_volume0 / (10 ** DECIMALS),
+        "blocks_with_trades": 100 * n_blocks_with_trades / n_blocks,
+        "reduced_blocks_with_trades": 100 * reduced_n_blocks_with_trades / reduced_n_blocks,
+        "expected_blocks_with_trades": expected,
+    }
+
+
+def print_results(r):
+    print(f"block time = {r['block_time']} sec, use last price in block: {r['use_last_price_in_block']}")
+    print(f"original volume: {r['volume']*1e-6:.0f} million")
+    print(f"volume with new block time: {r['reduced_volume']*1e-6:.0f} million")
+    print(f"original blocks with trades: {r['blocks_with_trades']:.2f} %")
+    print(f"blocks with trades, new block time: {r['reduced_blocks_with_trades']:.2f} % (if no reduction: {r['expected_blocks_with_trades']:.2f} %)")
     print("")
 
 
 def main():
-    all_data = []
-    for filename in sorted(os.listdir(data_dir)):
-        if "-events.csv" in filename:
+    filenames = [f for f in sorted(os.listdir(data_dir)) if "-events.csv" in f]
+    dates = [f[:10] for f in filenames]
+
+    block_trades = None
+    if USE_CUBE and flow_cube.has_cube(VERSION, dates):
+        print("using the flow cube")
+        block_trades = load_cube(dates)
+
+    if block_trades is None:
+        all_blocks = []
+        all_prices = []
+        all_volumes = []
+        for filename in filenames:
             print(filename)
-            all_data += load_csv(filename)
-
-
-    n_blocks = all_data[-1][0] - all_data[0][0] + 1
-    data_by_block = [[] for _ in range(n_blocks)]
-    start_block = all_data[0][0]
-    for row in all_data:
-        block_index = row[0] - start_block
-        data_by_block[block_index].append(row)    
-
-    # if set to true, the price at the end of the block is used
-    # if set to false, the price after the first trade (assumed to be arb) is used instead
-    use_last_price_in_block = False
-
-    # TODO: support larger periods to skip!
-    for n_to_skip in [1]:
-        print("n_to_skip=", n_to_skip)
-        process_data(data_by_block, n_to_skip, use_last_price_in_block)
-        process_data(data_by_block, n_to_skip, not use_last_price_in_block)
+            blocks, prices, volumes0 = load_csv(filename)
+            all_blocks.append(blocks)
+            all_prices.append(prices)
+            all_volumes.append(volumes0)
+        block_trades = BlockTrades(np.concatenate(all_blocks), np.concatenate(all_prices), np.concatenate(all_volumes))
+
+    results = []
+    for block_time in BLOCK_TIMES:
+        assert block_time % ORIGINAL_BLOCK_TIME == 0, "block time must be a multiple of 12 seconds"
+        batch_size = block_time // ORIGINAL_BLOCK_TIME
+        # if set to true, the price at the end of the block is used
+        # if set to false, the price after the first trade (assumed to be arb) is used instead
+        for use_last_price_in_block in [False, True]:
+            r = process_data(block_trades, batch_size, use_last_price_in_block)
+            print_results(r)
+            results.append(r)
+
+    filename = f"slower-blocks-v{VERSION}-{YEAR}-{POOL}.csv"
+    with open(filename, "w") as outf:
+        outf.write("block_time,use_last_price,volume_ratio,blocks_with_trades,reduced_blocks_with_trades,expected_blocks_with_trades\n")
+        for r in results:
+            outf.write(f"{r['block_time']},{int(r['use_last_price_in_block'])},{r['reduced_volume']/r['volume']:.4f},"
+                       f"{r['blocks_with_trades']:.2f},{r['reduced_blocks_with_trades']:.2f},{r['expected_blocks_with_trades']:.2f}\n")
+    print(f"saved the table in {filename}")
 
 
 if __name__ == "__main__":
@@ -6,18 +6,27 @@
 #  2) the % of blocks with at least 1 trade
 #  3) the avg / mean / std of trade gaps between blocks
 #
+# The stats are kept as exact integer histograms, so the memory use does not
+# depend on the number of blocks. Works for both v2 and v3 swaps, and for
+# any number of pools at once (set POOL to a comma-separated list or "all").
+#
 
 import os
 import numpy as np
+from swap_data import swaps_dir, list_day_files, load_swaps
+from streaming_stats import IntHistogram
+import flow_cube
 
 YEAR = os.getenv("YEAR")
 if YEAR is None or len(YEAR) == 0:
     YEAR = "2023"
 
+# a single pool, a comma-separated list of pools, or "all"
 POOL = os.getenv("POOL")
 if POOL is None or len(POOL) == 0:
     POOL = "0x88e6a0c2ddd26feeb64f039a2c41296fcb3f5640" # USDC/ETH 0.05%
 POOL = POOL.lower()
+POOLS = None if POOL == "all" else POOL.split(",")
 
 DECIMALS = os.getenv("DECIMALS")
 if DECIMALS is None or len(DECIMALS) == 0:
@@ -34,66 +43,113 @@ if VERSION not in [2, 3]:
     print("Uniswap v2 or v3 supported")
     exit(-1)
 
+# read the per-block aggregates from the flow cube, where it exists (see `flow_cube.py`)
+USE_CUBE = os.getenv("USE_CUBE", "1") != "0"
+
 print(f"using pool {POOL} on Uniswap v{VERSION}, year {YEAR}, token0 decimals {DECIMALS}")
 
 self_dir = os.path.dirname(os.path.abspath(__file__))
-data_dir = os.path.join(self_dir, "data", f"uniswap-v{VERSION}-swaps", YEAR)
-
-def load_csv(filename):
-    result = []
-    with open(os.path.join(data_dir, filename)) as f:
-        f.readline() # skip the header
-        for line in f.readlines():
-            fields = line.strip().split(",")
-            if len(fields) == 0:
-                continue
-            pool = fields[2]
-            if pool != POOL:
-                continue
-            result.append(fields)
-    return result
-
-def process_day(data, block_stats, gap_stats, last_block):
-    in_block = 0
-    for row in data:
-        if VERSION == 3:
-            block = int(row[1])
-
-        if last_block is None:
-            last_block = block
-
-        if last_block == block:
-            in_block += 1
-        else:
-            gap = block - last_block - 1
-            gap_stats.append(gap)
-            while last_block < block:
-                block_stats.append(in_block)
-                in_block = 0
-                last_block += 1
-            in_block = 1
-
-    return last_block
+data_dir = swaps_dir(os.path.join(self_dir, "data"), VERSION, YEAR)
 
-def main():
-    block_stats = [] # trades per each block
-    gap_stats = []   # num of blocks w/o trades
-    last_block = None
-    for filename in sorted(os.listdir(data_dir)):
-        if "-swaps.csv" in filename:
-            print(filename)
-            data = load_csv(filename)
-            last_block = process_day(data, block_stats, gap_stats, last_block)
-
-    num_blocks = len(block_stats)
-    median = sorted(block_stats)[num_blocks // 2]
-    print(f"trades per block: avg={np.mean(block_stats):.2f} median={median} std={np.std(block_stats):.2f}")
-
-    num_traded_blocks = sum([1 if u > 0 else 0 for u in block_stats])
+
+#
+# Keeps the trade frequency stats of a single pool.
+# The trade count of the last seen block is kept pending, as more trades may follow in the next file.
+#
+class PoolStats:
+    def __init__(self):
+        self.block_stats = IntHistogram() # trades per each block
+        self.gap_stats = IntHistogram()   # num of blocks w/o trades
+        self.last_block = None
+        self.in_block = 0
+
+    def add_blocks(self, blocks):
+        traded_blocks, trades = np.unique(blocks, return_counts=True)
+        self.add_block_counts(traded_blocks, trades)
+
+    def add_block_counts(self, traded_blocks, trades):
+        if len(traded_blocks) == 0:
+            return
+        trades = trades.copy()
+        if self.last_block is not None:
+            if traded_blocks[0] == self.last_block:
+                trades[0] += self.in_block
+            else:
+                self.block_stats.add(self.in_block)
+                gap = traded_blocks[0] - self.last_block - 1
+                self.gap_stats.add(gap)
+                self.block_stats.add(0, gap)
+
+        gaps = np.diff(traded_blocks) - 1
+        self.gap_stats.add_values(gaps)
+        self.block_stats.add(0, int(gaps.sum()))
+        self.block_stats.add_values(trades[:-1])
+        self.last_block = traded_blocks[-1]
+        self.in_block = trades[-1]
+
+    def finish(self):
+        if self.last_block is not None:
+            self.block_stats.add(self.in_block)
+            self.in_block = 0
+            self.last_block = None
+
+
+def process_day(date, filename, all_stats):
+    cube = flow_cube.load_day(VERSION, date) if USE_CUBE else None
+    if cube is not None:
+        # fast path: the per-block trade counts are already aggregated
+        pools = cube.pools if POOLS is None else [p for p in POOLS if p in cube.pool_index]
+        for pool in pools:
+            rows = cube.pool_rows(pool)
+            if pool not in all_stats:
+                all_stats[pool] = PoolStats()
+            all_stats[pool].add_block_counts(rows["block"], rows["n_trades"].astype(np.int64))
+        return
+
+    data = load_swaps(filename, VERSION, pools=POOLS, usecols=["block", "pool"])
+    for pool, blocks in data.groupby("pool", sort=False)["block"]:
+        if pool not in all_stats:
+            all_stats[pool] = PoolStats()
+        all_stats[pool].add_blocks(blocks.to_numpy())
+
+
+def print_stats(pool, stats):
+    block_stats = stats.block_stats
+    gap_stats = stats.gap_stats
+    print(f"pool {pool}:")
+    print(f"trades per block: avg={block_stats.mean():.2f} median={block_stats.median()} std={block_stats.std():.2f}")
+
+    num_blocks = block_stats.total()
+    num_traded_blocks = block_stats.num_nonzero_values()
     print(f"% of blocks with some trades: {100*num_traded_blocks/num_blocks:.2f}")
 
-    median = sorted(gap_stats)[len(gap_stats) // 2]
-    print(f"no-trade gap size between block: avg={np.mean(gap_stats):.2f} median={median} std={np.std(gap_stats):.2f}")
+    print(f"no-trade gap size between block: avg={gap_stats.mean():.2f} median={gap_stats.median()} std={gap_stats.std():.2f}")
+
+
+def main():
+    all_stats = {}
+    for date, filename in list_day_files(data_dir):
+        print(filename)
+        process_day(date, filename, all_stats)
+
+    for stats in all_stats.values():
+        stats.finish()
+
+    if POOLS is not None and len(POOLS) == 1:
+        if POOLS[0] in all_stats:
+            print_stats(POOLS[0], all_stats[POOLS[0]])
+        return
+
+    filename = f"trade-frequency-v{VERSION}-{YEAR}.csv"
+    with open(filename, "w") as outf:
+        outf.write("pool,num_blocks,traded_blocks_percent,trades_per_block_avg,trades_per_block_median,trades_per_block_std,gap_avg,gap_median,gap_std\n")
+        for pool in sorted(all_stats, key=lambda p: -all_stats[p].block_stats.num_nonzero_values()):
+            b = all_stats[pool].block_stats
+            g = all_stats[pool].gap_stats
+            outf.write(f"{pool},{b.total()},{100*b.num_nonzero_values()/b.total():.2f},{b.mean():.4f},{b.median()},{b.std():.4f},"
+                       f"{g.mean():.4f},{g.median()},{g.std():.4f}\n")
+    print(f"saved stats of {len(all_stats)} pools in {filename}")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+
+#
+# This script computes the daily fee returns of Uniswap v3 pools from the replayed pool state (`v3_replay.py`).
+#
+# The fee return is the return of the fees per unit of in-range liquidity, relative to the value
+# of a full-range position with the same liquidity (2 * L * sqrt(P)), so that it can be compared with
+# the fee returns of the v2 pools. For each swap, the fee growth per unit of liquidity is
+# fee / (1 - fee) times the change of sqrt(P) (or 1 / sqrt(P), for the token0 input) over the ranges
+# that have liquidity; the ranges without liquidity that the swap crosses earn no fees.
+#
+# The result of each pool and day is cached in:
+#   data/v3-fee-returns/{CHAIN}/{POOL}/{DATE}.json
+# The missing days are computed in parallel, in groups of consecutive days, each group starting
+# from the replay checkpoint before it.
+#
+# The pools are given as a comma-separated list in POOLS, each optionally with its fee tier
+# (e.g. "0x88e6a0c2ddd26feeb64f039a2c41296fcb3f5640:0.0005"); if the fee tier is not given,
+# it is found from the tick spacing of the pool's initialized ticks.
+#
+
+import os
+import json
+import bisect
+from math import gcd
+from datetime import date, timedelta
+from concurrent.futures import ProcessPoolExecutor
+
+from amm_math import Q96, TICK_SPACINGS
+from block_index import timestamp_to_date
+import v3_replay
+from v3_replay import SWAP, tick_to_sqrt_price
+
+CHAIN = v3_replay.CHAIN
+
+YEAR = os.getenv("YEAR")
+if YEAR is None or len(YEAR) == 0:
+    YEAR = "2023"
+
+# the USDC/WETH pools
+DEFAULT_POOLS = {
+    "0x88e6a0c2ddd26feeb64f039a2c41296fcb3f5640": 0.0005,
+    "0x8ad599c3a0ff1de082011efddc58f1908eb6e6d8": 0.003,
+    "0x7bea39867e4169dbe237d55c8242a8f2fcdcc387": 0.01,
+}
+
+POOLS = os.getenv("POOLS")
+if POOLS is None or len(POOLS) == 0:
+    POOLS = dict(DEFAULT_POOLS)
+else:
+    POOLS = {u.split(":")[0].lower(): float(u.split(":")[1]) if ":" in u else DEFAULT_POOLS.get(u.lower())
+             for u in POOLS.split(",")}
+
+NUM_WORKERS = v3_replay.NUM_WORKERS
+
+DAYS_PER_TASK = int(os.getenv("DAYS_PER_TASK", "30"))
+
+self_dir = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(self_dir, "data")
+
+
+def cache_filename(chain, pool, day, data_dir=DATA_DIR):
+    return os.path.join(data_dir, "v3-fee-returns", chain, pool, day + ".json")
+
+
+def load_cached(chain, pool, day, data_dir=DATA_DIR):
+    filename = cache_filename(chain, pool, day, data_dir)
+    if not os.access(filename, os.R_OK):
+        return None
+    with open(filename) as f:
+        return json.load(f)
+
+
+def save_cached(chain, pool, day, result, data_dir=DATA_DIR):
+    filename = cache_filename(chain, pool, day, data_dir)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename + ".tmp", "w") as f:
+        json.dump(result, f)
+    os.replace(filename + ".tmp", filename)
+
+
+def year_days(year):
+    start = date(int(year), 1, 1)
+    end = min(date(int(year), 12, 31), date.today() - timedelta(days=1))
+    return [(start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range((end - start).days + 1)]
+
+############################################################
+
+def get_fee_tier(state):
+    return fee_tier_from_ticks(state.ticks)
+
+
+def fee_tier_from_ticks(ticks):
+    # from the tick spacing: the ticks of the positions are multiples of it
+    spacing = 0
+    for tick in ticks:
+        spacing = gcd(spacing, tick)
+    fee_tiers = {s: fee / 1e6 for fee, s in TICK_SPACINGS.items()}
+    # with few ticks, the gcd can be a multiple of the spacing; take the largest spacing that divides it
+    for s in sorted(fee_tiers, reverse=True):
+        if spacing and spacing % s == 0:
+            return fee_tiers[s]
+    return None
+
+
+#
+# The fee return of a full-range position during a swap that moves the pool from its current
+# sqrt price to `sqrt_price_end`, with the fees only earned in the ranges with liquidity.
+#
+def get_swap_fee_return(state, sqrt_price_end, fee_tier):
+    s0 = state.sqrt_price / Q96
+    end = sqrt_price_end / Q96
+    if s0 == 0 or end == s0:
+        return 0.0
+    s = s0
+    liquidity = state.liquidity
+    ticks = state.ticks
+    span = 0.0
+    if end < s:
+        # token0 in; the fee growth is in token0
+        i = bisect.bisect_right(ticks, state.tick) - 1
+        while s > end:
+            next_s = max(tick_to_sqrt_price(ticks[i]) if i >= 0 else 0.0, end)
+            if liquidity > 0:
+                span += 1 / next_s - 1 / s
+            s = next_s
+            if i >= 0 and s > end:
+                liquidity -= state.net[ticks[i]]
+                i -= 1
+        # the value of the token0 growth in token1, relative to 2 * sqrt(P) of token1
+        return fee_tier / (1 - fee_tier) * span * s0 / 2
+    # token1 in; the fee growth is in token1
+    i = bisect.bisect_right(ticks, state.tick)
+    while s < end:
+        next_s = min(tick_to_sqrt_price(ticks[i]) if i < len(ticks) else float("inf"), end)
+        if liquidity > 0:
+            span += next_s - s
+        s = next_s
+        if i < len(ticks) and s < end:
+            liquidity += state.net[ticks[i]]
+            i += 1
+    return fee_tier / (1 - fee_tier) * span / (2 * s0)
+
+
+def first_block(filename):
+    with open(filename) as f:
+        header = f.readline().strip().split(",")
+        line = f.readline()
+    if len(line) == 0:
+        return None
+    return int(line.split(",")[header.index("block")])
+
+
+#
+# Computes the results of the pool for a group of consecutive days and saves them in the cache.
+#
+def compute_days(task):
+    chain, pool, days = task["chain"], task["pool"], task["days"]
+    files = dict(v3_replay.event_files(chain, task["data_dir"]))
+    start_block = first_block(files[days[0]]) if days[0] in files else None
+    end_day = (date.fromisoformat(days[-1]) + timedelta(days=1)).strftime("%Y-%m-%d")
+    end_block = first_block(files[end_day]) if end_day in files else None
+    results = {day: {"fee_return": 0.0, "swaps": 0} for day in days}
+    if start_block is None:
+        print(f"{pool}: no events for {days[0]}")
+        return results
+
+    shard = v3_replay.get_shard(pool, task["num_shards"])
+    replay = v3_replay.start_replay(chain, shard, task["num_shards"], start_block, {pool}, task["data_dir"])
+    # before the first day, just replay
+    replay.run(start_block)
+    state = replay.states.get(pool)
+    fee_tier = task["fee_tier"]
+    if fee_tier is None and state is not None:
+        fee_tier = get_fee_tier(state)
+
+    def on_event(block, event_pool, state, event):
+        nonlocal fee_tier
+        if int(event["type"]) != SWAP or state is None:
+            return
+        if fee_tier is None:
+            fee_tier = get_fee_tier(state)
+            if fee_tier is None:
+                return
+        result = results.get(timestamp_to_date(event["timestamp"]))
+        if result is None:
+            return
+        result["fee_return"] += get_swap_fee_return(state, int(event["price"]), fee_tier)
+        result["swaps"] += 1
+
+    replay.run(end_block, callback=on_event)
+    if replay.stats["liquidity_errors"]:
+        print(f"warning: {pool}: {replay.stats['liquidity_errors']} liquidity errors in the replay")
+    for day, result in results.items():
+        result["fee_tier"] = fee_tier
+        save_cached(chain, pool, day, result, task["data_dir"])
+    print(f"{pool}: {days[0]}..{days[-1]} done")
+    return results
+
+
+def group_days(days):
+    # splits the days in groups of consecutive days, up to DAYS_PER_TASK each
+    groups = []
+    for day in days:
+        consecutive = len(groups) and \
+            date.fromisoformat(groups[-1][-1]) + timedelta(days=1) == date.fromisoformat(day)
+        if consecutive and len(groups[-1]) < DAYS_PER_TASK:
+            groups[-1].append(day)
+        else:
+            groups.append([day])
+    return groups
+
+
+#
+# Computes the daily fee returns of the pools for the days that are not cached yet.
+#
+def update_fee_returns(chain, pools, year, num_workers=NUM_WORKERS, data_dir=DATA_DIR):
+    tasks = []
+    for pool, fee_tier in pools.items():
+        missing = [day for day in year_days(year) if load_cached(chain, pool, day, data_dir) is None]
+        for days in group_days(missing):
+            tasks.append({"chain": chain, "pool": pool, "fee_tier": fee_tier, "days": days,
+                          "num_shards": v3_replay.NUM_SHARDS, "data_dir": data_dir})
+    print(f"{len(tasks)} tasks")
+    if num_workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(num_workers, len(tasks))) as executor:
+            list(executor.map(compute_days, tasks))
+    else:
+        for task in tasks:
+            compute_days(task)
+
+
+#
+# Returns the list of the daily fee returns of the pool in the year, or None if any day is not cached.
+#
+#
+# Returns {day: fee return} for the days of the year that are cached, for plotting on the days of other series
+#
+def load_daily_fee_returns(pool, year, chain=CHAIN, data_dir=DATA_DIR):
+    result = {}
+    for day in year_days(year):
+        cached = load_cached(chain, pool.lower(), day, data_dir)
+        if cached is not None:
+            result[day] = cached["fee_return"]
+    return result
+
+
+def load_fee_returns(pool, year, chain=CHAIN, data_dir=DATA_DIR):
+    result = []
+    for day in year_days(year):
+        cached = load_cached(chain, pool.lower(), day, data_dir)
+        if cached is None:
+            return None
+        result.append(cached["fee_return"])
+    return result
+
+
+def main():
+    print(f"computing the fee returns of {len(POOLS)} v3 pools on {CHAIN} in {YEAR}")
+    update_fee_returns(CHAIN, POOLS, YEAR)
+    for pool in POOLS:
+        returns = load_fee_returns(pool, YEAR)
+        if returns is None:
+            print(f"{pool}: incomplete")
+            continue
+        filename = f"fee-returns-v3-{YEAR}-{pool}.csv"
+        with open(filename, "w") as f:
+            f.write("day,fee_return\n")
+            for day, value in zip(year_days(YEAR), returns):
+                f.write(f"{day},{value}\n")
+        print(f"{pool}: mean daily fee return {100 * sum(returns) / len(returns):.4f}%, written to {filename}")
+
+
+if __name__ == "__main__":
+    main()
+    print("all done")
@@ -0,0 +1,197 @@
+#
+# This module contains fixed-memory heavy hitter sketches.
+#
+# They are used to find the most frequent (or the largest by volume) addresses
+# in a stream of swaps without keeping a counter for every address seen.
+#
+# Two sketches are provided, both with the same interface:
+#  1) SpaceSaving - the Space-Saving algorithm (Metwally et al.), weighted variant.
+#     Keeps at most `capacity` counters. Each reported count overestimates
+#     the true count by at most the reported error.
+#  2) CountMinTopK - Count-Min sketch (Cormode & Muthukrishnan) plus a bounded set of
+#     top candidates. The counts are overestimates by at most eps * total weight
+#     with probability 1 - delta.
+#
+# Both sketches can be merged, so that partial results from parallel workers
+# (e.g. one per pool or one per day) can be combined into a single summary.
+#
+
+import hashlib
+import heapq
+import math
+import numpy as np
+
+
+class SpaceSaving:
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.total = 0
+        # min-heap with lazy deletion; entries are (count, item)
+        self._heap = []
+
+    def __len__(self):
+        return len(self.counts)
+
+    def _push(self, item):
+        heapq.heappush(self._heap, (self.counts[item], item))
+        # rebuild the heap when there are too many stale entries
+        if len(self._heap) > 4 * self.capacity + 16:
+            self._heap = [(c, k) for k, c in self.counts.items()]
+            heapq.heapify(self._heap)
+
+    def _pop_min(self):
+        while True:
+            count, item = heapq.heappop(self._heap)
+            if self.counts.get(item) == count:
+                return count, item
+
+    def update(self, item, weight=1):
+        self.total += weight
+        if item in self.counts:
+            self.counts[item] += weight
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = weight
+            self.errors[item] = 0
+        else:
+            # replace the item with the smallest counter
+            min_count, min_item = self._pop_min()
+            del self.counts[min_item]
+            del self.errors[min_item]
+            self.counts[item] = min_count + weight
+            self.errors[item] = min_count
+        self._push(item)
+
+    def min_count(self):
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+    def estimate(self, item):
+        return self.counts.get(item, self.min_count())
+
+    def merge(self, other):
+        # missing items are bounded from above by the min counter of the other summary
+        min_self = self.min_count()
+        min_other = other.min_count()
+        counts = {}
+        errors = {}
+        for item in set(self.counts).union(other.counts):
+            c1 = self.counts.get(item)
+            c2 = other.counts.get(item)
+            e1 = self.errors.get(item, min_self) if c1 is not None else min_self
+            e2 = other.errors.get(item, min_other) if c2 is not None else min_other
+            counts[item] = (c1 if c1 is not None else min_self) + (c2 if c2 is not None else min_other)
+            errors[item] = e1 + e2
+
+        result = SpaceSaving(max(self.capacity, other.capacity))
+        kept = heapq.nlargest(result.capacity, counts.items(), key=lambda x: x[1])
+        result.counts = dict(kept)
+        result.errors = {k: errors[k] for k in result.counts}
+        result.total = self.total + other.total
+        result._heap = [(c, k) for k, c in result.counts.items()]
+        heapq.heapify(result._heap)
+        return result
+
+    def top(self, k=10):
+        # returns list of (item, count, error) tuples sorted by count
+        items = heapq.nlargest(k, self.counts.items(), key=lambda x: x[1])
+        return [(item, count, self.errors[item]) for item, count in items]
+
+
+def _hash64(item):
+    if not isinstance(item, bytes):
+        item = str(item).encode()
+    return int.from_bytes(hashlib.blake2b(item, digest_size=8).digest(), "little")
+
+
+class CountMinTopK:
+    def __init__(self, capacity=1000, eps=1e-4, delta=1e-3):
+        self.capacity = capacity
+        self.width = int(math.ceil(math.e / eps))
+        self.depth = int(math.ceil(math.log(1 / delta)))
+        self.table = np.zeros((self.depth, self.width), dtype=np.float64)
+        self.total = 0
+        # the current top candidates and their estimated counts
+        self.candidates = {}
+        # min-heap with lazy deletion; entries are (estimate, item)
+        self._heap = []
+
+    def __len__(self):
+        return len(self.candidates)
+
+    def _push(self, item):
+        heapq.heappush(self._heap, (self.candidates[item], item))
+        # rebuild the heap when there are too many stale entries
+        if len(self._heap) > 4 * self.capacity + 16:
+            self._heap = [(c, k) for k, c in self.candidates.items()]
+            heapq.heapify(self._heap)
+
+    def _peek_min(self):
+        while True:
+            estimate, item = self._heap[0]
+            if self.candidates.get(item) == estimate:
+                return estimate, item
+            heapq.heappop(self._heap)
+
+    def _indices(self, item):
+        # Kirsch-Mitzenmacher: derive all row hashes from two 32-bit halves
+        h = _hash64(item)
+        h1 = h & 0xffffffff
+        h2 = h >> 32
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def _estimate(self, indices):
+        return float(min(self.table[i, j] for i, j in enumerate(indices)))
+
+    def update(self, item, weight=1):
+        self.total += weight
+        indices = self._indices(item)
+        for i, j in enumerate(indices):
+            self.table[i, j] += weight
+        estimate = self._estimate(indices)
+        if item in self.candidates or len(self.candidates) < self.capacity:
+            self.candidates[item] = estimate
+            self._push(item)
+            return
+        min_estimate, min_item = self._peek_min()
+        if estimate > min_estimate:
+            heapq.heappop(self._heap)
+            del self.candidates[min_item]
+            self.candidates[item] = estimate
+            self._push(item)
+
+    def estimate(self, item):
+        return self._estimate(self._indices(item))
+
+    def merge(self, other):
+        assert self.table.shape == other.table.shape, "sketch dimensions must match"
+        result = CountMinTopK(max(self.capacity, other.capacity))
+        result.width = self.width
+        result.depth = self.depth
+        result.table = self.table + other.table
+        result.total = self.total + other.total
+        estimates = {item: result.estimate(item) for item in set(self.candidates).union(other.candidates)}
+        result.candidates = dict(heapq.nlargest(result.capacity, estimates.items(), key=lambda x: x[1]))
+        result._heap = [(c, k) for k, c in result.candidates.items()]
+        heapq.heapify(result._heap)
+        return result
+
+    def top(self, k=10):
+        # returns list of (item, count, error) tuples sorted by count
+        error = math.e / self.width * self.total
+        items = heapq.nlargest(k, self.candidates.items(), key=lambda x: x[1])
+        return [(item, count, error) for item, count in items]
+
+
+SKETCHES = {
+    "space-saving": SpaceSaving,
+    "count-min": CountMinTopK,
+}
+
+# the keyword arguments are passed to the sketch, e.g. eps and delta for "count-min"
+def make_sketch(name="space-saving", capacity=1000, **kwargs):
+    if name not in SKETCHES:
+        raise ValueError(f"unknown sketch type {name}, expected one of {list(SKETCHES)}")
+    return SKETCHES[name](capacity=capacity, **kwargs)
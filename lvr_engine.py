@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+#
+# This file computes the empirical loss-versus-rebalancing (LVR) and the markouts of a pool,
+# block by block, from the swap flows and an intraday CEX price series.
+#
+# For each block with swaps, the pool's net token changes (from the flow cube, see `flow_cube.py`)
+# are valued at the CEX price, relative to a rebalancing portfolio that made the same trades on the CEX:
+#   markout(h) = d_risky * P_cex(t + h) + d_numeraire
+# where t is the block timestamp (from the block index, see `block_index.py`) and
+# P_cex is the CEX price (from the intraday price store, see `cex_price_store.py`).
+# The markout is the LP's profit in the numeraire token, fees included; it is negative when
+# the LP traded at worse prices than the CEX.
+# The swap fees are valued at P_cex(t), and the LVR is the loss excluding the fees:
+#   lvr = fees - markout(0)
+#
+# All of this is vectorized over the blocks of each day. The daily aggregates are written to
+#   data/lvr/lvr-v{VERSION}-{YEAR}-{POOL}.csv
+# (see `lvr_filename`), where `plot_realized_returns.py` reads them from.
+# For v2 pools, the pool value at the start of each day (from the Sync events) is also given,
+# and the fees and LVR relative to it, comparable with `get_fee_return` in `plot_realized_returns.py`.
+#
+
+import os
+import numpy as np
+import pandas as pd
+from swap_data import swaps_dir, list_day_files
+from block_index import load_index, date_to_timestamp
+from cex_price_store import load_store
+import flow_cube
+
+YEAR = os.getenv("YEAR")
+if YEAR is None or len(YEAR) == 0:
+    YEAR = "2023"
+
+VERSION = os.getenv("VERSION")
+try:
+    VERSION = int(VERSION)
+except:
+    VERSION = 3
+
+POOL = os.getenv("POOL")
+if POOL is None or len(POOL) == 0:
+    if VERSION == 2:
+        POOL = "0xb4e16d0168e52d35cacd2c6185b44281ec28c9dc" # v2 USDC/ETH
+    else:
+        POOL = "0x88e6a0c2ddd26feeb64f039a2c41296fcb3f5640" # USDC/ETH 0.05%
+POOL = POOL.lower()
+
+FEE = os.getenv("FEE")
+try:
+    FEE = float(FEE)
+except:
+    FEE = 0.003 if VERSION == 2 else 0.0005
+
+# token decimals and the index of the risky (non-numeraire) token; the defaults are for USDC/WETH
+DECIMALS0 = int(os.getenv("DECIMALS0", "6"))
+DECIMALS1 = int(os.getenv("DECIMALS1", "18"))
+RISKY_TOKEN = int(os.getenv("RISKY_TOKEN", "1"))
+
+SYMBOL = os.getenv("SYMBOL")
+if SYMBOL is None or len(SYMBOL) == 0:
+    SYMBOL = "ETHUSDT"
+
+# the markout horizons, in seconds
+HORIZONS = os.getenv("HORIZONS")
+if HORIZONS is None or len(HORIZONS) == 0:
+    HORIZONS = "0,12,60,300,3600"
+HORIZONS = [int(u) for u in HORIZONS.split(",")]
+if 0 not in HORIZONS:
+    HORIZONS = [0] + HORIZONS
+
+# CEX prices older than this (in seconds) are treated as missing
+MAX_STALENESS = int(os.getenv("MAX_STALENESS", "300"))
+
+self_dir = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(self_dir, "data")
+
+
+def lvr_filename(version, year, pool, data_dir=DATA_DIR):
+    return os.path.join(data_dir, "lvr", f"lvr-v{version}-{year}-{pool}.csv")
+
+
+def net_flows(rows, decimals0=DECIMALS0, decimals1=DECIMALS1, risky_token=RISKY_TOKEN):
+    # returns (risky in, risky out, numeraire in, numeraire out) in whole tokens, from the pool's point of view
+    a0_in = rows["token0_in"] / 10.0 ** decimals0
+    a0_out = rows["token0_out"] / 10.0 ** decimals0
+    a1_in = rows["token1_in"] / 10.0 ** decimals1
+    a1_out = rows["token1_out"] / 10.0 ** decimals1
+    if risky_token == 1:
+        return a1_in, a1_out, a0_in, a0_out
+    return a0_in, a0_out, a1_in, a1_out
+
+
+#
+# Computes the per-block values for the cube rows of a pool.
+# Returns a dict of arrays: volume, fees, lvr, and markout_{h} for each horizon.
+#
+def block_markouts(rows, timestamps, store, horizons=HORIZONS, fee=FEE, max_staleness=MAX_STALENESS,
+                   decimals0=DECIMALS0, decimals1=DECIMALS1, risky_token=RISKY_TOKEN):
+    risky_in, risky_out, num_in, num_out = net_flows(rows, decimals0, decimals1, risky_token)
+    d_risky = risky_in - risky_out
+    d_num = num_in - num_out
+
+    price = store.asof(timestamps, max_staleness)
+    result = {
+        "cex_price": price,
+        "volume": risky_in * price + num_in,
+        "fees": fee * (risky_in * price + num_in),
+    }
+    for h in horizons:
+        p = price if h == 0 else store.asof(timestamps + h, max_staleness)
+        result[f"markout_{h}"] = d_risky * p + d_num
+    result["lvr"] = result["fees"] - result["markout_0"]
+    return result
+
+
+def load_pool_value(version, date, pool, store, block_index, data_dir=DATA_DIR,
+                    decimals0=DECIMALS0, decimals1=DECIMALS1, risky_token=RISKY_TOKEN):
+    # the value of a v2 pool in the numeraire token, after the first Sync of the day that has a CEX price;
+    # NaN if not available
+    if version != 2:
+        return np.nan
+    filename = os.path.join(swaps_dir(data_dir, version, date[:4]), date + "-sync.csv")
+    if not os.access(filename, os.R_OK):
+        return np.nan
+    df = pd.read_csv(filename, usecols=["block", "pool", "reserve0", "reserve1"],
+                     dtype={"block": np.int64, "pool": str, "reserve0": np.float64, "reserve1": np.float64})
+    df = df[df["pool"] == pool]
+    if len(df) == 0:
+        return np.nan
+    prices = store.asof(block_index.block_to_timestamp(df["block"].to_numpy()), MAX_STALENESS)
+    valid = np.flatnonzero(~np.isnan(prices))
+    if len(valid) == 0:
+        return np.nan
+    first = df.iloc[valid[0]]
+    reserves = [first["reserve0"] / 10.0 ** decimals0, first["reserve1"] / 10.0 ** decimals1]
+    return reserves[1 - risky_token] + reserves[risky_token] * prices[valid[0]]
+
+
+def process_day(version, date, swaps_filename, pool, store, block_index, horizons=HORIZONS, data_dir=DATA_DIR):
+    cube = flow_cube.load_day(version, date, data_dir)
+    if cube is None:
+        flow_cube.build_day(version, date, swaps_filename, data_dir)
+        cube = flow_cube.load_day(version, date, data_dir)
+    rows = cube.pool_rows(pool)
+    if len(rows["block"]) == 0:
+        return None
+
+    timestamps = block_index.block_to_timestamp(rows["block"])
+    # blocks before the start of the index are given the start of the day
+    timestamps = np.where(timestamps < 0, date_to_timestamp(date), timestamps)
+    values = block_markouts(rows, timestamps, store, horizons)
+
+    # the blocks without a CEX price are left out
+    valid = ~np.isnan(values["cex_price"])
+    result = {"date": date, "n_blocks": int(np.sum(valid)), "n_trades": int(np.sum(rows["n_trades"][valid]))}
+    for key in ["volume", "fees", "lvr"] + [f"markout_{h}" for h in horizons]:
+        result[key] = float(np.nansum(values[key][valid]))
+    pool_value = load_pool_value(version, date, pool, store, block_index, data_dir)
+    result["pool_value"] = pool_value
+    result["fee_return"] = result["fees"] / pool_value
+    result["lvr_return"] = result["lvr"] / pool_value
+    return result
+
+
+def main():
+    print(f"using pool {POOL} on Uniswap v{VERSION}, year {YEAR}, fee {FEE}, CEX symbol {SYMBOL}")
+    block_index = load_index("ethereum")
+    if block_index is None:
+        print("the block index is missing, run `block_index.py` first")
+        exit(-1)
+    store = load_store(SYMBOL)
+    if store is None:
+        print("the CEX price store is missing, run `cex_price_store.py` first")
+        exit(-1)
+
+    results = []
+    for date, swaps_filename in list_day_files(swaps_dir(DATA_DIR, VERSION, YEAR)):
+        result = process_day(VERSION, date, swaps_filename, POOL, store, block_index)
+        if result is not None:
+            results.append(result)
+
+    if len(results) == 0:
+        print("no swaps found")
+        return
+    df = pd.DataFrame(results)
+    filename = lvr_filename(VERSION, YEAR, POOL)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    df.to_csv(filename + ".tmp", index=False)
+    os.replace(filename + ".tmp", filename)
+    print(f"results written to {filename}")
+
+    total_volume = df["volume"].sum()
+    print(f"days={len(df)} volume={total_volume:.0f} fees={df['fees'].sum():.0f} lvr={df['lvr'].sum():.0f}")
+    for h in HORIZONS:
+        markout = df[f"markout_{h}"].sum()
+        print(f"  markout at {h} sec: {markout:.0f} ({10_000 * markout / total_volume:.2f} bps of volume)")
+
+
+if __name__ == "__main__":
+    main()
+    print("all done")
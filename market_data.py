@@ -0,0 +1,162 @@
+#
+# This module contains an offline-first cache for daily market data (OHLCV candles).
+#
+# The data of each symbol is stored in `data/cex-prices/{SYMBOL}.csv`, in the same format as
+# written by `download-cex-prices.py` (Date,Open,High,Low,Close,Adj Close,Volume).
+# A request for a date range is served from the local file; only the dates before the first
+# or after the last stored date are fetched, through a pluggable source (yfinance by default).
+# If the requested range is already covered, the network is not touched.
+#
+# Concurrent requests for the same symbol are coalesced: they wait for the first fetch
+# and then read its result from the cache.
+#
+# Set MARKET_DATA_OFFLINE=1 to never fetch; the requests then return only the stored data.
+#
+
+import os
+import threading
+from datetime import date, datetime, timedelta
+import pandas as pd
+
+self_dir = os.path.dirname(os.path.abspath(__file__))
+CEX_PRICE_DIR = os.path.join(self_dir, "data", "cex-prices")
+
+OFFLINE = os.getenv("MARKET_DATA_OFFLINE", "0") not in ["", "0"]
+
+COLUMNS = ["Open", "High", "Low", "Close", "Adj Close", "Volume"]
+
+
+def _to_date(d):
+    if isinstance(d, str):
+        return datetime.strptime(d[:10], "%Y-%m-%d").date()
+    if isinstance(d, datetime):
+        return d.date()
+    if isinstance(d, pd.Timestamp):
+        return d.date()
+    return d
+
+
+#
+# The default source: daily candles from yfinance in [start, end).
+# Returns a dataframe indexed by date, with (a subset of) the columns in COLUMNS.
+#
+def yfinance_source(symbol, start, end):
+    import yfinance as yf
+    data = yf.download(symbol, start=start.isoformat(), end=end.isoformat(), auto_adjust=False, progress=False)
+    if isinstance(data.columns, pd.MultiIndex):
+        # newer yfinance versions have a (field, ticker) column index
+        data.columns = data.columns.get_level_values(0)
+    return data
+
+
+def _normalize(df):
+    # a dataframe indexed by normalized, timezone-naive dates, with the known columns in the classic order
+    df = df.copy()
+    index = pd.to_datetime(df.index)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    df.index = index.normalize()
+    df.index.name = "Date"
+    df = df[[c for c in COLUMNS if c in df.columns]]
+    return df[~df.index.duplicated(keep="last")].sort_index()
+
+
+def read_store_file(filename):
+    df = pd.read_csv(filename)
+    if df.columns[0] == "Price":
+        # the multi-row header of newer yfinance versions: "Price,..." / "Ticker,..." / "Date,,,"
+        df = df.rename(columns={"Price": "Date"})
+        df = df[pd.to_datetime(df["Date"], format="%Y-%m-%d", errors="coerce").notna()]
+        for c in df.columns[1:]:
+            df[c] = pd.to_numeric(df[c])
+    df = df.set_index("Date")
+    return _normalize(df)
+
+
+class MarketDataCache:
+    def __init__(self, store_dir=CEX_PRICE_DIR, source=yfinance_source, offline=OFFLINE):
+        self.store_dir = store_dir
+        self.source = source
+        self.offline = offline
+        self.data = {}
+        # the ranges that were already fetched by this process, even if the source had no data for them
+        self.fetched = set()
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+
+    def filename(self, symbol):
+        return os.path.join(self.store_dir, symbol + ".csv")
+
+    def _lock(self, symbol):
+        with self.locks_lock:
+            if symbol not in self.locks:
+                self.locks[symbol] = threading.Lock()
+            return self.locks[symbol]
+
+    def _load(self, symbol):
+        if symbol not in self.data:
+            filename = self.filename(symbol)
+            if os.access(filename, os.R_OK):
+                self.data[symbol] = read_store_file(filename)
+            else:
+                self.data[symbol] = None
+        return self.data[symbol]
+
+    def _save(self, symbol, df):
+        os.makedirs(self.store_dir, exist_ok=True)
+        df.to_csv(self.filename(symbol), date_format="%Y-%m-%d")
+        self.data[symbol] = df
+
+    def missing_ranges(self, symbol, start, end):
+        # the [start, end) date ranges that are not covered by the stored data
+        if start >= end:
+            return []
+        df = self._load(symbol)
+        if df is None or len(df) == 0:
+            return [(start, end)]
+        first = df.index[0].date()
+        last = df.index[-1].date()
+        result = []
+        if start < first:
+            result.append((start, min(first, end)))
+        if end > last + timedelta(days=1):
+            result.append((max(last + timedelta(days=1), start), end))
+        return result
+
+    #
+    # Returns the candles of the symbol in [start, end), indexed by date.
+    # The dates can be strings ("YYYY-MM-DD"), dates or timestamps.
+    #
+    def get(self, symbol, start, end):
+        start = _to_date(start)
+        # the candles of today and the future are not final yet
+        end = min(_to_date(end), date.today())
+        with self._lock(symbol):
+            ranges = [r for r in self.missing_ranges(symbol, start, end) if (symbol,) + r not in self.fetched]
+            if ranges and not self.offline:
+                parts = [self.source(symbol, a, b) for a, b in ranges]
+                self.fetched.update((symbol,) + r for r in ranges)
+                parts = [_normalize(p) for p in parts if p is not None and len(p)]
+                if parts:
+                    stored = self._load(symbol)
+                    if stored is not None:
+                        parts.append(stored)
+                    self._save(symbol, _normalize(pd.concat(parts)))
+            df = self._load(symbol)
+        if df is None:
+            return pd.DataFrame(columns=COLUMNS, index=pd.DatetimeIndex([], name="Date"))
+        return df[(df.index >= pd.Timestamp(start)) & (df.index < pd.Timestamp(end))].copy()
+
+
+_default_cache = None
+
+
+def default_cache():
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = MarketDataCache()
+    return _default_cache
+
+
+def get_prices(symbol, start, end):
+    return default_cache().get(symbol, start, end)
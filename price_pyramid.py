@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+#
+# This file creates and reads a multi-resolution "price pyramid" for every pool:
+# OHLC + VWAP + volume bars at block, minute, hour and day resolution.
+#
+# The source is the v3 Swap events (`uniswap-v3-all`, sqrtPriceX96 and amount0)
+# or the v2 Sync events (`-sync.csv` files, reserves). For v2, the volume of a Sync event is
+# the change of reserve0 when the two reserves move in opposite directions (i.e. a swap);
+# the first Sync of a pool in each day file has no previous reserves, so has zero volume.
+#
+# Prices are raw token1 per token0, volumes are raw token0 amounts.
+#
+# Each day is processed in a single pass: the block bars are computed from the events,
+# and each coarser level is aggregated from the level below it. The bars are stored per level
+# and per day, so the pyramid can be appended day by day:
+#   data/price-pyramid/v{VERSION}/{LEVEL}/{YEAR}/{DATE}.npz
+#
+# Run this file to build the pyramid for all days that do not have it yet.
+#
+
+import os
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+from swap_data import swaps_dir, list_day_files
+from amm_math import sqrt_price_x96_to_price, reserves_to_price
+
+YEAR = os.getenv("YEAR")
+if YEAR is None or len(YEAR) == 0:
+    YEAR = "2023"
+
+VERSION = os.getenv("VERSION")
+try:
+    VERSION = int(VERSION)
+except:
+    VERSION = 3
+
+self_dir = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(self_dir, "data")
+
+# (name, resolution in seconds); the block level has no fixed resolution
+LEVELS = [("block", 0), ("minute", 60), ("hour", 3600), ("day", 86400)]
+
+BAR_COLUMNS = ["time", "block", "open", "high", "low", "close", "price_volume", "volume", "n"]
+
+
+def pyramid_filename(version, level, date, data_dir=DATA_DIR):
+    return os.path.join(data_dir, "price-pyramid", f"v{version}", level, date[:4], date + ".npz")
+
+
+def source_files(version, year, data_dir=DATA_DIR):
+    if version == 3:
+        return list_day_files(os.path.join(data_dir, "uniswap-v3-all", str(year)), "-events.csv")
+    return list_day_files(swaps_dir(data_dir, version, year), "-sync.csv")
+
+
+def load_events(version, filename):
+    # returns a dataframe with pool, timestamp, block, price, volume; sorted by pool and time
+    if version == 3:
+        df = pd.read_csv(filename, usecols=["timestamp", "block", "pool", "type", "price", "amount0"],
+                         dtype={"timestamp": np.int64, "block": np.int64, "pool": str, "type": np.int64,
+                                "price": np.float64, "amount0": np.float64})
+        df = df[df["type"] == 3]
+        price = sqrt_price_x96_to_price(df["price"].to_numpy())
+        volume = np.abs(df["amount0"].to_numpy())
+    else:
+        df = pd.read_csv(filename, usecols=["timestamp", "block", "pool", "reserve0", "reserve1"],
+                         dtype={"timestamp": np.int64, "block": np.int64, "pool": str,
+                                "reserve0": np.float64, "reserve1": np.float64})
+        price = reserves_to_price(df["reserve0"].to_numpy(), df["reserve1"].to_numpy())
+        volume = None
+
+    events = pd.DataFrame({"pool": df["pool"].to_numpy(), "timestamp": df["timestamp"].to_numpy(),
+                           "block": df["block"].to_numpy(), "price": price})
+    if version == 3:
+        events["volume"] = volume
+    else:
+        events["reserve0"] = df["reserve0"].to_numpy()
+        events["reserve1"] = df["reserve1"].to_numpy()
+    events = events.sort_values(["pool", "block"], kind="stable").reset_index(drop=True)
+
+    if version == 2:
+        same_pool = np.zeros(len(events), dtype=bool)
+        pools = events["pool"].to_numpy()
+        same_pool[1:] = pools[1:] == pools[:-1]
+        d0 = np.diff(events["reserve0"].to_numpy(), prepend=np.nan)
+        d1 = np.diff(events["reserve1"].to_numpy(), prepend=np.nan)
+        is_swap = same_pool & (d0 * d1 < 0)
+        events["volume"] = np.where(is_swap, np.abs(d0), 0.0)
+        events = events.drop(columns=["reserve0", "reserve1"])
+    return events
+
+
+def _segment_starts(codes, keys):
+    changed = np.ones(len(codes), dtype=bool)
+    changed[1:] = (codes[1:] != codes[:-1]) | (keys[1:] != keys[:-1])
+    return np.flatnonzero(changed)
+
+
+def _aggregate(codes, keys, bars):
+    # merges consecutive bars with the same (pool code, key); the input is sorted by both
+    starts = _segment_starts(codes, keys)
+    ends = np.append(starts[1:], len(codes)) - 1
+    result = {
+        "time": bars["time"][starts],
+        "block": bars["block"][starts],
+        "open": bars["open"][starts],
+        "high": np.maximum.reduceat(bars["high"], starts),
+        "low": np.minimum.reduceat(bars["low"], starts),
+        "close": bars["close"][ends],
+        "price_volume": np.add.reduceat(bars["price_volume"], starts),
+        "volume": np.add.reduceat(bars["volume"], starts),
+        "n": np.add.reduceat(bars["n"], starts),
+    }
+    return codes[starts], result
+
+
+def build_day(version, date, filename, data_dir=DATA_DIR):
+    events = load_events(version, filename)
+    pools, codes = np.unique(events["pool"].to_numpy(), return_inverse=True)
+    price = events["price"].to_numpy()
+    volume = events["volume"].to_numpy()
+    timestamps = events["timestamp"].to_numpy()
+    blocks = events["block"].to_numpy()
+
+    # each event is a bar with a single price
+    bars = {"time": timestamps, "block": blocks, "open": price, "high": price, "low": price, "close": price,
+            "price_volume": price * volume, "volume": volume, "n": np.ones(len(price), dtype=np.int64)}
+
+    for level, resolution in LEVELS:
+        if resolution == 0:
+            codes, bars = _aggregate(codes, blocks, bars)
+        else:
+            codes, bars = _aggregate(codes, bars["time"] // resolution, bars)
+            bars["time"] = (bars["time"] // resolution) * resolution
+        save_level(version, level, date, pools, codes, bars, data_dir)
+
+
+def save_level(version, level, date, pools, codes, bars, data_dir=DATA_DIR):
+    filename = pyramid_filename(version, level, date, data_dir)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    present, pool_starts = np.unique(codes, return_index=True)
+    np.savez_compressed(filename, pools=pools[present].astype(str),
+                        pool_offsets=np.append(pool_starts, len(codes)), **bars)
+
+
+def update_pyramid(version, year, data_dir=DATA_DIR):
+    for date, filename in source_files(version, year, data_dir):
+        if os.access(pyramid_filename(version, LEVELS[-1][0], date, data_dir), os.R_OK):
+            continue
+        print(f"building price pyramid for {date}")
+        build_day(version, date, filename, data_dir)
+
+
+############################################################
+
+def _date_range(start_time, end_time):
+    # the dates (YYYY-MM-DD) that overlap with [start_time, end_time)
+    first = start_time // 86400
+    last = (end_time - 1) // 86400
+    return [datetime.fromtimestamp(d * 86400, tz=timezone.utc).strftime("%Y-%m-%d") for d in range(first, last + 1)]
+
+
+def load_bars(version, level, pool, start_time, end_time, data_dir=DATA_DIR):
+    # returns a dict of bar arrays for the pool, for the bars that start in [start_time, end_time)
+    parts = {c: [] for c in BAR_COLUMNS}
+    for date in _date_range(start_time, end_time):
+        filename = pyramid_filename(version, level, date, data_dir)
+        if not os.access(filename, os.R_OK):
+            continue
+        with np.load(filename, allow_pickle=False) as f:
+            pools = f["pools"]
+            i = np.searchsorted(pools, pool)
+            if i == len(pools) or pools[i] != pool:
+                continue
+            start, end = f["pool_offsets"][i], f["pool_offsets"][i + 1]
+            for c in BAR_COLUMNS:
+                parts[c].append(f[c][start:end])
+
+    if len(parts["time"]) == 0:
+        return {c: np.zeros(0) for c in BAR_COLUMNS}
+    bars = {c: np.concatenate(v) for c, v in parts.items()}
+    selected = (bars["time"] >= start_time) & (bars["time"] < end_time)
+    return {c: v[selected] for c, v in bars.items()}
+
+
+#
+# Returns bars for the pool in [start_time, end_time), at the given resolution in seconds
+# (0 means block resolution). Reads the coarsest stored level that is precise enough,
+# and merges its bars further if needed. The result also has the "vwap" column.
+#
+def query(version, pool, start_time, end_time, resolution, data_dir=DATA_DIR):
+    pool = pool.lower()
+    if resolution == 0:
+        level, level_resolution = LEVELS[0]
+    else:
+        usable = [(name, r) for name, r in LEVELS if r > 0 and resolution % r == 0]
+        level, level_resolution = usable[-1] if usable else LEVELS[0]
+
+    bars = load_bars(version, level, pool, start_time, end_time, data_dir)
+    if resolution != 0 and resolution != level_resolution and len(bars["time"]) > 0:
+        bucket = bars["time"] // resolution
+        _, bars = _aggregate(np.zeros(len(bucket), dtype=np.int64), bucket, bars)
+        bars["time"] = (bars["time"] // resolution) * resolution
+        # drop the partial bucket that starts before start_time
+        selected = bars["time"] >= start_time
+        bars = {c: v[selected] for c, v in bars.items()}
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        bars["vwap"] = np.where(bars["volume"] > 0, bars["price_volume"] / bars["volume"], bars["close"])
+    return bars
+
+
+def main():
+    print(f"building the price pyramid for Uniswap v{VERSION}, year {YEAR}")
+    update_pyramid(VERSION, YEAR)
+
+
+if __name__ == "__main__":
+    main()
+    print("all done")
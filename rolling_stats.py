@@ -0,0 +1,69 @@
+#
+# This module contains incremental rolling-window statistics (mean and variance).
+#
+# `RollingWindow` keeps the mean and the sum of squared deviations of the last `window` values,
+# updated with Welford's method when a value enters or leaves the window. Until the window is
+# full, the statistics are over all values so far (expanding window).
+#
+# `rolling_stats` runs one accumulator per window size over an array in a single pass,
+# so all window sizes that a script needs are computed together.
+#
+
+import numpy as np
+
+
+class RollingWindow:
+    def __init__(self, window):
+        self.window = window
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    def remove(self, x):
+        if self.n <= 1:
+            self.n = 0
+            self.mean = 0.0
+            self.m2 = 0.0
+            return
+        self.n -= 1
+        delta = x - self.mean
+        self.mean -= delta / self.n
+        self.m2 -= delta * (x - self.mean)
+
+    def variance(self, ddof=0):
+        if self.n - ddof <= 0:
+            return np.nan
+        return max(self.m2, 0.0) / (self.n - ddof)
+
+    def std(self, ddof=0):
+        return np.sqrt(self.variance(ddof))
+
+
+#
+# Returns {window: (counts, means, variances)} for the given window sizes.
+# The values at index i are over the window that ends at i (inclusive), which has
+# min(i + 1, window) values. The variances are population variances (ddof=0), same as `np.var`.
+#
+def rolling_stats(values, windows):
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    accumulators = [RollingWindow(w) for w in windows]
+    counts = np.zeros((len(windows), n), dtype=np.int64)
+    means = np.zeros((len(windows), n))
+    variances = np.zeros((len(windows), n))
+    for i in range(n):
+        x = values[i]
+        for j, acc in enumerate(accumulators):
+            acc.add(x)
+            if acc.n > acc.window:
+                acc.remove(values[i - acc.window])
+            counts[j, i] = acc.n
+            means[j, i] = acc.mean
+            variances[j, i] = acc.variance()
+    return {w: (counts[j], means[j], variances[j]) for j, w in enumerate(windows)}
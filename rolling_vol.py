@@ -0,0 +1,125 @@
+#
+# This module contains rolling volatility estimators that work on numpy arrays:
+#  1) close-to-close (the sample standard deviation of log returns)
+#  2) Parkinson (high / low)
+#  3) Garman-Klass (open / high / low / close)
+#  4) Rogers-Satchell (open / high / low / close, drift independent)
+#
+# Each estimator is a rolling mean (or std) of a per-period term, computed with cumulative sums,
+# so the cost is O(n) for any window length. The inputs can be daily candles, intraday candles,
+# or any price series (e.g. on-chain prices; use `log_returns` and `close_to_close_vol` for these).
+#
+# The result for index i uses the window that ends at i (inclusive); the first `window - 1`
+# values are NaN. The volatility is per period; multiply by `sqrt(periods_per_year)` to annualize.
+#
+
+import numpy as np
+
+ESTIMATORS = ["close_to_close", "parkinson", "garman_klass", "rogers_satchell"]
+
+
+def log_returns(close, open_=None):
+    # log returns of close-to-close; the first one is close / open if `open_` is given, otherwise NaN
+    close = np.asarray(close, dtype=np.float64)
+    result = np.empty(len(close))
+    if len(close) == 0:
+        return result
+    result[0] = np.log(close[0] / open_[0]) if open_ is not None else np.nan
+    result[1:] = np.log(close[1:] / close[:-1])
+    return result
+
+
+def rolling_sum(values, window):
+    # the windows that contain a NaN give NaN
+    values = np.asarray(values, dtype=np.float64)
+    result = np.full(len(values), np.nan)
+    if window > len(values):
+        return result
+    missing = np.isnan(values)
+    cumulative = np.concatenate(([0.0], np.cumsum(np.where(missing, 0.0, values))))
+    num_missing = np.concatenate(([0], np.cumsum(missing)))
+    sums = cumulative[window:] - cumulative[:-window]
+    result[window - 1:] = np.where(num_missing[window:] - num_missing[:-window] > 0, np.nan, sums)
+    return result
+
+
+def rolling_mean(values, window):
+    return rolling_sum(values, window) / window
+
+
+def rolling_std(values, window, ddof=1):
+    # the values are centered first, to keep the precision of the sum-of-squares formula
+    values = np.asarray(values, dtype=np.float64)
+    centered = values - np.nanmean(values) if len(values) else values
+    s1 = rolling_sum(centered, window)
+    s2 = rolling_sum(centered ** 2, window)
+    variance = (s2 - s1 * s1 / window) / (window - ddof)
+    return np.sqrt(np.maximum(variance, 0.0))
+
+
+############################################################
+# per-period terms
+
+def parkinson_terms(high, low):
+    return np.log(np.asarray(high, dtype=np.float64) / np.asarray(low, dtype=np.float64)) ** 2
+
+
+def garman_klass_terms(open_, high, low, close):
+    hl = np.log(np.asarray(high, dtype=np.float64) / np.asarray(low, dtype=np.float64))
+    co = np.log(np.asarray(close, dtype=np.float64) / np.asarray(open_, dtype=np.float64))
+    return 0.5 * hl ** 2 - (2 * np.log(2) - 1) * co ** 2
+
+
+def rogers_satchell_terms(open_, high, low, close):
+    open_ = np.asarray(open_, dtype=np.float64)
+    high = np.asarray(high, dtype=np.float64)
+    low = np.asarray(low, dtype=np.float64)
+    close = np.asarray(close, dtype=np.float64)
+    return np.log(high / close) * np.log(high / open_) + np.log(low / close) * np.log(low / open_)
+
+
+############################################################
+# estimators
+
+def close_to_close_vol(returns, window, periods_per_year=1):
+    return rolling_std(returns, window, ddof=1) * np.sqrt(periods_per_year)
+
+
+def parkinson_vol(high, low, window, periods_per_year=1):
+    terms = parkinson_terms(high, low)
+    return np.sqrt(rolling_sum(terms, window) / (4 * window * np.log(2))) * np.sqrt(periods_per_year)
+
+
+def garman_klass_vol(open_, high, low, close, window, periods_per_year=1):
+    terms = garman_klass_terms(open_, high, low, close)
+    return np.sqrt(np.maximum(rolling_mean(terms, window), 0.0)) * np.sqrt(periods_per_year)
+
+
+def rogers_satchell_vol(open_, high, low, close, window, periods_per_year=1):
+    terms = rogers_satchell_terms(open_, high, low, close)
+    return np.sqrt(np.maximum(rolling_mean(terms, window), 0.0)) * np.sqrt(periods_per_year)
+
+
+#
+# Computes all estimators for all window lengths from OHLC candles.
+# Returns a dict {(estimator, window): array}. The close-to-close returns use
+# the first candle's open, same as `compute_price_metrics.calculate_historical_vols`.
+#
+def rolling_vols(open_, high, low, close, windows, periods_per_year=1, estimators=ESTIMATORS):
+    returns = log_returns(close, open_)
+    terms = {
+        "parkinson": parkinson_terms(high, low),
+        "garman_klass": garman_klass_terms(open_, high, low, close),
+        "rogers_satchell": rogers_satchell_terms(open_, high, low, close),
+    }
+    result = {}
+    for window in windows:
+        for estimator in estimators:
+            if estimator == "close_to_close":
+                vol = close_to_close_vol(returns, window, periods_per_year)
+            elif estimator == "parkinson":
+                vol = np.sqrt(rolling_sum(terms[estimator], window) / (4 * window * np.log(2)) * periods_per_year)
+            else:
+                vol = np.sqrt(np.maximum(rolling_mean(terms[estimator], window), 0.0) * periods_per_year)
+            result[(estimator, window)] = vol
+    return result
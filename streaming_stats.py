@@ -0,0 +1,99 @@
+#
+# This module contains streaming statistics over non-negative integer values
+# (e.g. trades per block, number of blocks between trades).
+#
+# The values are kept as an exact histogram: a dense array of counts for the small values,
+# and a dict of counts for the rest. The memory does not depend on the number of values,
+# only on the number of distinct large values, so a long tail (e.g. the gaps between the trades
+# of a rarely traded pool) stays small. Mean, std, median and quantiles are exact.
+#
+
+import numpy as np
+
+# the values below this are counted in the dense array
+DENSE_SIZE = 1024
+
+
+class IntHistogram:
+    def __init__(self):
+        self.counts = np.zeros(DENSE_SIZE, dtype=np.int64)
+        # value -> count, for the values >= DENSE_SIZE
+        self.overflow = {}
+
+    def add(self, value, count=1):
+        value = int(value)
+        if value < DENSE_SIZE:
+            self.counts[value] += count
+        elif count:
+            self.overflow[value] = self.overflow.get(value, 0) + int(count)
+
+    def add_values(self, values):
+        values = np.asarray(values, dtype=np.int64)
+        if len(values) == 0:
+            return
+        dense = values < DENSE_SIZE
+        self.counts += np.bincount(values[dense], minlength=DENSE_SIZE)
+        if not dense.all():
+            large, counts = np.unique(values[~dense], return_counts=True)
+            for value, count in zip(large.tolist(), counts.tolist()):
+                self.overflow[value] = self.overflow.get(value, 0) + count
+
+    def merge(self, other):
+        result = IntHistogram()
+        result.counts = self.counts + other.counts
+        result.overflow = dict(self.overflow)
+        for value, count in other.overflow.items():
+            result.overflow[value] = result.overflow.get(value, 0) + count
+        return result
+
+    def _items(self):
+        # the values with nonzero counts and their counts, sorted by value
+        values = np.nonzero(self.counts)[0]
+        large = sorted(self.overflow)
+        values = np.concatenate((values, np.asarray(large, dtype=np.int64)))
+        counts = np.concatenate((self.counts[values[:len(values) - len(large)]],
+                                 np.asarray([self.overflow[u] for u in large], dtype=np.int64)))
+        return values, counts
+
+    def total(self):
+        return int(self.counts.sum()) + sum(self.overflow.values())
+
+    def num_nonzero_values(self):
+        # the number of values that are > 0
+        return self.total() - int(self.counts[0])
+
+    def mean(self):
+        n = self.total()
+        if n == 0:
+            return np.nan
+        values, counts = self._items()
+        return float(np.dot(values.astype(np.float64), counts) / n)
+
+    def std(self):
+        # population standard deviation, same as np.std
+        n = self.total()
+        if n == 0:
+            return np.nan
+        values, counts = self._items()
+        values = values.astype(np.float64)
+        mean = np.dot(values, counts) / n
+        return float(np.sqrt(np.dot((values - mean) ** 2, counts) / n))
+
+    def value_at(self, index):
+        # the value at the given index in the sorted list of all values
+        values, counts = self._items()
+        cumulative = np.cumsum(counts)
+        return int(values[np.searchsorted(cumulative, index, side="right")])
+
+    def median(self):
+        # same as sorted(values)[len(values) // 2]
+        n = self.total()
+        if n == 0:
+            return np.nan
+        return self.value_at(n // 2)
+
+    def quantile(self, q):
+        n = self.total()
+        if n == 0:
+            return np.nan
+        return self.value_at(min(int(q * n), n - 1))
@@ -0,0 +1,70 @@
+#
+# This module loads the swap files created by `download-swap-data-v2.py`
+# and `download-swap-data-v3.py` into pandas dataframes.
+#
+# Note: the v2 files have a header that lists "to,tx_hash,sender",
+# but the columns are written as "to,sender,tx_hash"; the names here
+# follow the actual order of the data.
+#
+
+import os
+import numpy as np
+import pandas as pd
+
+V2_SWAP_COLUMNS = ["timestamp", "block", "pool", "amount0_in", "amount1_in", "amount0_out", "amount1_out", "to", "sender", "tx_hash"]
+V3_SWAP_COLUMNS = ["timestamp", "block", "pool", "amount0", "amount1", "to", "sender", "tx_hash"]
+
+# amounts can be larger than 2**63, so they are loaded as floats
+V2_AMOUNT_COLUMNS = ["amount0_in", "amount1_in", "amount0_out", "amount1_out"]
+V3_AMOUNT_COLUMNS = ["amount0", "amount1"]
+
+
+def swaps_dir(data_dir, version, year):
+    return os.path.join(data_dir, f"uniswap-v{version}-swaps", str(year))
+
+
+def list_day_files(directory, suffix="-swaps.csv"):
+    # returns sorted list of (date, full path) tuples
+    result = []
+    if not os.path.isdir(directory):
+        return result
+    for filename in sorted(os.listdir(directory)):
+        if filename.endswith(suffix):
+            result.append((filename[:10], os.path.join(directory, filename)))
+    return result
+
+
+def load_swaps(filename, version, pools=None, usecols=None):
+    names = V2_SWAP_COLUMNS if version == 2 else V3_SWAP_COLUMNS
+    amount_columns = V2_AMOUNT_COLUMNS if version == 2 else V3_AMOUNT_COLUMNS
+    dtype = {"timestamp": np.int64, "block": np.int64, "pool": str, "to": str, "sender": str, "tx_hash": str}
+    for c in amount_columns:
+        dtype[c] = np.float64
+    if usecols is not None:
+        usecols = [c for c in names if c in usecols]
+        dtype = {c: dtype[c] for c in usecols}
+    df = pd.read_csv(filename, header=0, names=names, usecols=usecols, dtype=dtype)
+    if pools is not None and "pool" in df.columns:
+        df = df[df["pool"].isin(pools)].reset_index(drop=True)
+    return df
+
+
+#
+# Returns (amount0_in, amount0_out, amount1_in, amount1_out) as non-negative float arrays,
+# from the point of view of the pool, for both v2 and v3 swaps.
+#
+def get_in_out_amounts(df, version):
+    if version == 2:
+        a0_in = df["amount0_in"].to_numpy()
+        a0_out = df["amount0_out"].to_numpy()
+        a1_in = df["amount1_in"].to_numpy()
+        a1_out = df["amount1_out"].to_numpy()
+        # remove fake "volume" created due to pool imbalance, returned to the swapper due to sync() call
+        net0 = a0_in - a0_out
+        net1 = a1_in - a1_out
+    else:
+        # the negative amount is given to the user
+        net0 = df["amount0"].to_numpy()
+        net1 = df["amount1"].to_numpy()
+    return (np.maximum(net0, 0), np.maximum(-net0, 0),
+            np.maximum(net1, 0), np.maximum(-net1, 0))
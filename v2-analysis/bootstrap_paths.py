@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+
+#
+# This module generates price paths by resampling historical block-level log returns
+# (stationary block bootstrap, Politis and Romano 1994), as an alternative to the GBM paths
+# in `price_paths`. The paths keep the fat tails and the volatility clustering of the real prices.
+#
+# The returns come from either:
+#  1) the prices of a pool: the v3 Swap events in `uniswap-v3-all` or the v2 Sync events;
+#     the blocks without swaps have zero returns;
+#  2) the intraday CEX price store (`cex_price_store.py`), sampled every BLOCK_TIME seconds.
+# They are built once and saved as a flat .npy array in `data/bootstrap-returns`. The array is
+# memory-mapped when the paths are generated, so many processes can share it without loading it.
+#
+# Each path is made of blocks of consecutive returns, starting at random positions; the block lengths
+# are geometrically distributed with the mean MEAN_BLOCK_LENGTH. The paths are generated in chunks of
+# blocks, in the same layout as `price_paths.GBMPaths`, and the random numbers come from per-segment
+# streams in the same way, so the paths are the same for any chunk size.
+#
+# Run this file to build the returns of a source and to simulate the LVR on the bootstrapped paths.
+#
+
+import os
+import sys
+import numpy as np
+
+from price_paths import SEGMENT_BLOCKS, CHUNK_BLOCKS
+from lvr_simulation import INITIAL_PRICE, INITIAL_VALUE, compute_lvr_paths
+
+sys.path.append("..")
+
+import price_pyramid
+import cex_price_store
+
+# "pool" or "cex"
+SOURCE = os.getenv("SOURCE")
+if SOURCE is None or len(SOURCE) == 0:
+    SOURCE = "pool"
+
+YEAR = os.getenv("YEAR")
+if YEAR is None or len(YEAR) == 0:
+    YEAR = "2023"
+
+VERSION = os.getenv("VERSION")
+try:
+    VERSION = int(VERSION)
+except:
+    VERSION = 3
+
+POOL = os.getenv("POOL")
+if POOL is None or len(POOL) == 0:
+    POOL = "0x88e6a0c2ddd26feeb64f039a2c41296fcb3f5640" if VERSION == 3 else "0xb4e16d0168e52d35cacd2c6185b44281ec28c9dc"
+POOL = POOL.lower()
+
+# the risky asset is token1 (WETH) in the USDC/WETH pools; its price is the inverse of the pool price
+RISKY_TOKEN = int(os.getenv("RISKY_TOKEN", "1"))
+
+SYMBOL = cex_price_store.SYMBOL
+
+BLOCK_TIME = int(os.getenv("BLOCK_TIME", "12"))
+
+# for the CEX prices: the samples with an older candle than this (in seconds) are skipped
+MAX_STALENESS = int(os.getenv("MAX_STALENESS", "300"))
+
+# in blocks; the default is about 2 hours of 12 second blocks
+MEAN_BLOCK_LENGTH = int(os.getenv("MEAN_BLOCK_LENGTH", "600"))
+
+NUM_SIMULATIONS = int(os.getenv("NUM_SIMULATIONS", "1000"))
+
+NUM_DAYS = int(os.getenv("NUM_DAYS", "10"))
+
+self_dir = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(self_dir, "..", "data")
+
+
+def returns_filename(name, data_dir=DATA_DIR):
+    return os.path.join(data_dir, "bootstrap-returns", name + ".npy")
+
+
+def pool_returns_name(version, year, pool):
+    return f"v{version}-{year}-{pool}"
+
+
+def cex_returns_name(symbol, block_time):
+    return f"cex-{symbol}-{block_time}s"
+
+############################################################
+# building the returns
+
+#
+# The log returns of the pool price, one per block, from the first to the last block with a swap.
+#
+def build_pool_returns(version, year, pool, risky_token=RISKY_TOKEN, data_dir=DATA_DIR):
+    parts = []
+    last_block = None
+    last_log_price = None
+    for date, filename in price_pyramid.source_files(version, year, data_dir):
+        events = price_pyramid.load_events(version, filename)
+        events = events[events["pool"] == pool]
+        prices = events["price"].to_numpy()
+        valid = np.isfinite(prices) & (prices > 0)
+        blocks = events["block"].to_numpy()[valid]
+        log_prices = np.log(prices[valid])
+        if len(blocks) == 0:
+            continue
+        if risky_token == 1:
+            log_prices = -log_prices
+        # the last price in each block; the events are sorted by block
+        is_last = np.append(blocks[1:] != blocks[:-1], True)
+        blocks = blocks[is_last]
+        log_prices = log_prices[is_last]
+
+        if last_block is None:
+            last_block = blocks[0]
+            last_log_price = log_prices[0]
+        new = blocks > last_block
+        blocks = blocks[new]
+        log_prices = log_prices[new]
+        if len(blocks) == 0:
+            continue
+        returns = np.zeros(blocks[-1] - last_block)
+        returns[blocks - last_block - 1] = np.diff(log_prices, prepend=last_log_price)
+        parts.append(returns)
+        last_block = blocks[-1]
+        last_log_price = log_prices[-1]
+        print(f"{date}: {len(returns)} blocks")
+    return np.concatenate(parts) if parts else np.zeros(0)
+
+
+#
+# The log returns of the CEX price, sampled every `block_time` seconds.
+# The returns that involve a missing or stale sample are skipped.
+#
+def build_cex_returns(symbol, block_time=BLOCK_TIME, max_staleness=MAX_STALENESS, data_dir=DATA_DIR):
+    store = cex_price_store.load_store(symbol, data_dir)
+    if store is None or len(store) == 0:
+        return np.zeros(0)
+    times = np.arange(store["time"][0], store["time"][-1] + 1, block_time)
+    log_prices = np.log(store.asof(times, max_staleness))
+    returns = np.diff(log_prices)
+    return returns[np.isfinite(returns)]
+
+
+def save_returns(name, returns, data_dir=DATA_DIR):
+    filename = returns_filename(name, data_dir)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    np.save(filename, returns.astype(np.float64))
+
+
+def load_returns(name, data_dir=DATA_DIR):
+    # memory-mapped, read only
+    filename = returns_filename(name, data_dir)
+    if not os.access(filename, os.R_OK):
+        return None
+    return np.load(filename, mmap_mode="r")
+
+############################################################
+# the paths
+
+class BootstrapPaths:
+    def __init__(self, returns, num_paths, num_blocks, initial_price, mean_block_length=MEAN_BLOCK_LENGTH,
+                 seed=123, demean=False):
+        self.returns = returns
+        self.num_paths = num_paths
+        # the number of blocks, including the first one, which has the initial price
+        self.num_blocks = num_blocks
+        self.initial_price = initial_price
+        self.mean_block_length = mean_block_length
+        self.seed = seed
+        # subtract the mean return, so that the paths have no drift from the historical trend
+        self.offset = float(np.mean(returns)) if demean else 0.0
+
+    def segment_draws(self, segment):
+        # for each return of the segment and each path: whether a new block starts, and where
+        seed_sequence = np.random.SeedSequence(self.seed, spawn_key=(segment,))
+        rng = np.random.Generator(np.random.PCG64(seed_sequence))
+        restart = rng.random((SEGMENT_BLOCKS, self.num_paths)) < 1 / self.mean_block_length
+        starts = rng.integers(0, len(self.returns), (SEGMENT_BLOCKS, self.num_paths))
+        return restart, starts
+
+    def return_indexes(self, start, end, previous):
+        # the indexes in `returns` of the returns [start, end) of each path;
+        # `previous` has the indexes of the return start-1 (None if start is 0)
+        restart = np.empty((end - start, self.num_paths), dtype=bool)
+        starts = np.empty((end - start, self.num_paths), dtype=np.int64)
+        i = start
+        while i < end:
+            segment = i // SEGMENT_BLOCKS
+            if self._segment != segment:
+                self._draws = self.segment_draws(segment)
+                self._segment = segment
+            offset = i - segment * SEGMENT_BLOCKS
+            n = min(end - i, SEGMENT_BLOCKS - offset)
+            restart[i - start:i - start + n] = self._draws[0][offset:offset + n]
+            starts[i - start:i - start + n] = self._draws[1][offset:offset + n]
+            i += n
+        if previous is None:
+            # the first block of each path starts at a random position
+            restart[0] = True
+            previous = np.zeros(self.num_paths, dtype=np.int64)
+
+        # the position of the last restart at or before each return, -1 if none in this range
+        t = np.arange(end - start).reshape(-1, 1)
+        last_restart = np.maximum.accumulate(np.where(restart, t, -1), axis=0)
+        restarted = last_restart >= 0
+        block_start = np.take_along_axis(starts, np.maximum(last_restart, 0), axis=0)
+        indexes = np.where(restarted, block_start + t - last_restart, previous + 1 + t)
+        return indexes % len(self.returns)
+
+    #
+    # Yields the prices of all paths in chunks with the shape (number of blocks in the chunk, num_paths).
+    # The first row of the first chunk has the initial price.
+    #
+    def chunks(self, chunk_blocks=CHUNK_BLOCKS):
+        self._segment = None
+        self._draws = None
+        last = np.full(self.num_paths, float(self.initial_price))
+        previous = None
+        for start in range(0, self.num_blocks, chunk_blocks):
+            end = min(start + chunk_blocks, self.num_blocks)
+            # return i leads to the price of block i+1
+            first_return = max(start - 1, 0)
+            if end - 1 > first_return:
+                indexes = self.return_indexes(first_return, end - 1, previous)
+                previous = indexes[-1]
+                factors = np.exp(self.returns[indexes] - self.offset)
+            else:
+                factors = np.zeros((0, self.num_paths))
+            if start == 0:
+                factors = np.vstack([np.ones(self.num_paths), factors])
+            prices = np.cumprod(np.vstack([last, factors]), axis=0)[1:]
+            last = prices[-1]
+            yield prices
+
+    def all(self):
+        # all prices at once; only for short periods
+        return np.vstack(list(self.chunks()))
+
+
+def main():
+    if SOURCE == "cex":
+        name = cex_returns_name(SYMBOL, BLOCK_TIME)
+    else:
+        name = pool_returns_name(VERSION, YEAR, POOL)
+    returns = load_returns(name)
+    if returns is None:
+        print(f"building the returns {name}")
+        if SOURCE == "cex":
+            save_returns(name, build_cex_returns(SYMBOL))
+        else:
+            save_returns(name, build_pool_returns(VERSION, YEAR, POOL))
+        returns = load_returns(name)
+    if len(returns) == 0:
+        print("no returns")
+        return
+
+    blocks_per_day = 86400 // BLOCK_TIME
+    sigma = np.std(returns) * np.sqrt(blocks_per_day)
+    print(f"{name}: {len(returns)} returns, daily sigma={sigma:.4f}")
+
+    paths = BootstrapPaths(returns, NUM_SIMULATIONS, NUM_DAYS * blocks_per_day, INITIAL_PRICE, demean=True)
+    tx_cost_bps = [0.0005, 0.001, 0.0015, 0.002]
+    swap_tx_cost_dollars = [INITIAL_VALUE * u / 10000 for u in tx_cost_bps]
+    lvr_and_fees = compute_lvr_paths(paths.chunks(), swap_tx_cost_dollars, 0.003)
+    expected_lvr = sigma ** 2 / 8 * NUM_DAYS
+    for bps, (lvr, fees, tx_per_block) in zip(tx_cost_bps, lvr_and_fees):
+        print(f"tx cost {bps} bps: LVR={lvr:.6f} (GBM: {expected_lvr:.6f}) fees={fees:.6f}"
+              f" percent recaptured={100 * fees / lvr:.2f} tx per block={tx_per_block:.4f}")
+
+
+if __name__ == '__main__':
+    main()
+    print("all done!")
@@ -31,9 +31,14 @@
 # Change the code for pools other than WETH/USDC!
 
 import os
+import sys
 import matplotlib.pyplot as pl
 pl.rcParams["savefig.dpi"] = 200
 
+sys.path.append("..")
+
+from heavy_hitters import make_sketch
+
 YEAR = os.getenv("YEAR")
 if YEAR is None or len(YEAR) == 0:
     YEAR = "2023"
@@ -52,6 +57,16 @@ if VERSION is None or len(VERSION) == 0:
     VERSION = 2
 VERSION = int(VERSION)
 
+# the unknown addresses are tracked in a fixed-size sketch ("space-saving" or "count-min")
+UNKNOWNS_SKETCH = os.getenv("UNKNOWNS_SKETCH")
+if UNKNOWNS_SKETCH is None or len(UNKNOWNS_SKETCH) == 0:
+    UNKNOWNS_SKETCH = "space-saving"
+
+UNKNOWNS_CAPACITY = os.getenv("UNKNOWNS_CAPACITY")
+if UNKNOWNS_CAPACITY is None or len(UNKNOWNS_CAPACITY) == 0:
+    UNKNOWNS_CAPACITY = 1000
+UNKNOWNS_CAPACITY = int(UNKNOWNS_CAPACITY)
+
 print(f"using pool {POOL} on Uniswap v{VERSION}, year {YEAR}")
 
 self_dir = os.path.dirname(os.path.abspath(__file__))
@@ -445,7 +460,7 @@ def classify_protocols(eth_buyers, eth_sellers):
     return uniswap, oneinch, cowswap, other
 
 
-def classify_trades(data, unknowns):
+def classify_trades(data, unknowns, unknown_volumes):
     current_block = None # start from a fresh block
     eth_buyers = {}
     eth_sellers = {}
@@ -532,8 +547,10 @@ def classify_trades(data, unknowns):
             address = sender
         else:
             # neither to nor the sender matched a known address
-            unknowns[sender] = unknowns.get(sender, 0) + 1
-            unknowns[to] = unknowns.get(to, 0) + 1
+            unknowns.update(sender)
+            unknowns.update(to)
+            unknown_volumes.update(sender, amount0_in + amount0_out)
+            unknown_volumes.update(to, amount0_in + amount0_out)
             # by default, use the sender's address
             address = sender
 
@@ -586,26 +603,30 @@ def main():
     days = []
     all_stats = []
 
-    unknowns = {}
+    # count-weighted and volume-weighted unknown addresses
+    unknowns = make_sketch(UNKNOWNS_SKETCH, UNKNOWNS_CAPACITY)
+    unknown_volumes = make_sketch(UNKNOWNS_SKETCH, UNKNOWNS_CAPACITY)
 
     for filename in sorted(os.listdir(data_dir)):
         if "-swaps.csv" in filename:
             print(filename)
             data = load_csv(filename)
             days.append(filename.split("-swaps")[0])
-            day_stats = classify_trades(data, unknowns)
+            day_stats = classify_trades(data, unknowns, unknown_volumes)
             print(day_stats)
             all_stats.append(day_stats)
 
-    print("unclassified traders:")
-    unknowns = list(unknowns.items())
-    unknowns.sort(key=lambda x: -x[1])
-    for i in range(min(len(unknowns), 10)):
-        print(unknowns[i])
+    # the counts are upper bounds; the second number is the max overestimation
+    print("unclassified traders by num tx:")
+    for address, count, error in unknowns.top(10):
+        print((address, count, error))
+
+    print("unclassified traders by volume:")
+    for address, volume, error in unknown_volumes.top(10):
+        print((address, volume / 1e6, error / 1e6))
 
     print("unclassified traders with many zeros in addresses:")
-    for i in range(len(unknowns)):
-        k, v = unknowns[i]
+    for k, v, _ in unknowns.top(len(unknowns)):
         if v < 10:
             break
         c = k.count("0")
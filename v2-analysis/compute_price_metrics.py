@@ -7,13 +7,19 @@
 # 3) Expected LVR
 #
 
-import yfinance as yf
+import os
+import sys
 import numpy as np
-import matplotlib.pyplot as pl
 import pandas as pd
+import matplotlib.pyplot as pl
 from ing_theme_matplotlib import mpl_style
 from math import sqrt
 
+sys.path.append("..")
+
+import rolling_vol
+from market_data import get_prices
+
 pl.rcParams["savefig.dpi"] = 200
 
 PAIR = "ETH-USD"
@@ -22,7 +28,36 @@ PERIOD_END = "2024-01-01"
 
 DAYS_IN_YEAR = 365
 
+# set this to compare the vectorized vols with the previous per-index loops before the analysis
+CHECK_PARITY = os.getenv("CHECK_PARITY", "0") != "0"
+
 def calculate_historical_vols(df, sessions_in_year):
+    # the first log return uses the open, all others are close to close
+    log_returns = rolling_vol.log_returns(df['Close'].to_numpy(), df['Open'].to_numpy())
+    df = df.assign(log_returns=log_returns)
+
+    # log returns squared - using high and low - for Parkinson volatility
+    df = df.assign(high_low_log_returns_squared=rolling_vol.parkinson_terms(df['High'].to_numpy(), df['Low'].to_numpy()))
+
+    # calculate the 7-day and 30-day standard deviation and vol;
+    # the 7-day values are padded with zeros, the 30-day values with NaN
+    for window, padding in [(7, 0), (30, np.nan)]:
+        if len(df) < window:
+            continue
+        sd = rolling_vol.rolling_std(log_returns, window, ddof=1)
+        park_vol = rolling_vol.parkinson_vol(df['High'].to_numpy(), df['Low'].to_numpy(), window, sessions_in_year)
+        vol = sd * np.sqrt(sessions_in_year)
+        for values in [sd, vol, park_vol]:
+            values[:window - 1] = padding
+        df = df.assign(**{f"sd_{window}_day": sd, f"vol_{window}_day": vol, f"park_vol_{window}_day": park_vol})
+
+    return df
+
+
+#
+# The previous per-index implementation of `calculate_historical_vols`, kept as the reference for `check_parity`
+#
+def calculate_historical_vols_loop(df, sessions_in_year):
     # calculate first log returns using the open
     log_returns = []
     log_returns.append(np.log(df.loc[0, 'Close'] / df.loc[0, 'Open']))
@@ -37,41 +72,81 @@ def calculate_historical_vols(df, sessions_in_year):
         high_low_log_returns_squared.append(np.log(df.loc[index, 'High'] / df.loc[index, 'Low']) ** 2)
     df = df.assign(high_low_log_returns_squared=high_low_log_returns_squared)
 
-    # calculate the 7-day standard deviation and vol
-    if len(df) > 6:
-        sd_7_day = [0] * 6
-        vol_7_day = [0] * 6
-        park_vol_7_day = [0] * 6
-        for index in range(len(df) - 6):
-            sd = np.std(df.loc[index:index + 6, 'log_returns'], ddof=1)
-            sd_7_day.append(sd)
-            vol_7_day.append(sd * np.sqrt(sessions_in_year))
-            park_vol_7_day.append(np.sqrt(
-                (1 / (4 * 7 * np.log(2)) * sum(df.loc[index:index + 6, 'high_low_log_returns_squared']))) * np.sqrt(
-                sessions_in_year))
-        df = df.assign(sd_7_day=sd_7_day)
-        df = df.assign(vol_7_day=vol_7_day)
-        df = df.assign(park_vol_7_day=park_vol_7_day)
-
-    # calculate the 30-day standard deviation and vol
-    if len(df) > 29:
-        sd_30_day = [np.nan] * 29
-        vol_30_day = [np.nan] * 29
-        park_vol_30_day = [np.nan] * 29
-        for index in range(len(df) - 29):
-            sd = np.std(df.loc[index:index + 29, 'log_returns'], ddof=1)
-            sd_30_day.append(sd)
-            vol_30_day.append(sd * np.sqrt(sessions_in_year))
-            park_vol_30_day.append(np.sqrt(
-                (1 / (4 * 30 * np.log(2)) * sum(df.loc[index:index + 29, 'high_low_log_returns_squared']))) * np.sqrt(
+    for window, padding in [(7, 0), (30, np.nan)]:
+        if len(df) < window:
+            continue
+        sd_values = [padding] * (window - 1)
+        vol_values = [padding] * (window - 1)
+        park_vol_values = [padding] * (window - 1)
+        for index in range(len(df) - window + 1):
+            sd = np.std(df.loc[index:index + window - 1, 'log_returns'], ddof=1)
+            sd_values.append(sd)
+            vol_values.append(sd * np.sqrt(sessions_in_year))
+            park_vol_values.append(np.sqrt(
+                (1 / (4 * window * np.log(2)) * sum(df.loc[index:index + window - 1, 'high_low_log_returns_squared']))) * np.sqrt(
                 sessions_in_year))
-        df = df.assign(sd_30_day=sd_30_day)
-        df = df.assign(vol_30_day=vol_30_day)
-        df = df.assign(park_vol_30_day=park_vol_30_day)
+        df = df.assign(**{f"sd_{window}_day": sd_values, f"vol_{window}_day": vol_values, f"park_vol_{window}_day": park_vol_values})
 
     return df
 
 
+def random_ohlc(n, rng, sigma=0.03):
+    close = 1000 * np.exp(np.cumsum(rng.normal(0, sigma, n)))
+    open_ = np.concatenate(([1000.0], close[:-1])) * np.exp(rng.normal(0, sigma / 10, n))
+    high = np.maximum(open_, close) * np.exp(np.abs(rng.normal(0, sigma, n)))
+    low = np.minimum(open_, close) * np.exp(-np.abs(rng.normal(0, sigma, n)))
+    return pd.DataFrame({"Open": open_, "High": high, "Low": low, "Close": close})
+
+
+def max_difference(a, b):
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    # the NaN padding must match exactly
+    assert np.array_equal(np.isnan(a), np.isnan(b))
+    valid = ~np.isnan(a)
+    return float(np.max(np.abs(a[valid] - b[valid]), initial=0.0))
+
+
+def check_parity(num_series=20, max_length=365, tolerance=1e-12):
+    # the vectorized estimators should give the same results as the per-index loops on random OHLC series;
+    # the lengths include the ones shorter than the 7-day and the 30-day windows
+    rng = np.random.default_rng(1)
+    lengths = [1, 6, 7, 29, 30] + list(rng.integers(31, max_length + 1, num_series))
+    worst = 0.0
+    for n in lengths:
+        df = random_ohlc(n, rng)
+        expected = calculate_historical_vols_loop(df, DAYS_IN_YEAR)
+        result = calculate_historical_vols(df, DAYS_IN_YEAR)
+        assert list(result.columns) == list(expected.columns)
+        for column in expected.columns:
+            worst = max(worst, max_difference(result[column], expected[column]))
+
+        # the estimators that `calculate_historical_vols` does not use, against the per-index formulas
+        o, h, l, c = [df[u].to_numpy() for u in ["Open", "High", "Low", "Close"]]
+        returns = rolling_vol.log_returns(c, o)
+        for window in [7, 30]:
+            vols = rolling_vol.rolling_vols(o, h, l, c, [window], DAYS_IN_YEAR)
+            for estimator in rolling_vol.ESTIMATORS:
+                expected = [np.nan] * min(window - 1, n)
+                for index in range(n - window + 1):
+                    end = index + window
+                    if estimator == "close_to_close":
+                        value = np.std(returns[index:end], ddof=1)
+                    elif estimator == "parkinson":
+                        value = np.sqrt(sum(np.log(h[index:end] / l[index:end]) ** 2) / (4 * window * np.log(2)))
+                    elif estimator == "garman_klass":
+                        value = np.sqrt(max(np.mean(0.5 * np.log(h[index:end] / l[index:end]) ** 2
+                                                    - (2 * np.log(2) - 1) * np.log(c[index:end] / o[index:end]) ** 2), 0.0))
+                    else:
+                        value = np.sqrt(max(np.mean(np.log(h[index:end] / c[index:end]) * np.log(h[index:end] / o[index:end])
+                                                    + np.log(l[index:end] / c[index:end]) * np.log(l[index:end] / o[index:end])), 0.0))
+                    expected.append(value * np.sqrt(DAYS_IN_YEAR))
+                worst = max(worst, max_difference(vols[(estimator, window)], expected))
+
+    print(f"parity check: max difference {worst:.3g} over {len(lengths)} series")
+    assert worst < tolerance
+
+
 def get_sigma_and_mu(data):
     data['Log Returns'] = np.log(data['Close']/data['Close'].shift())
     daily_std = data['Log Returns'].std()
@@ -84,8 +159,8 @@ def get_lvr(sigma, mu):
 
 
 def analyze(pair):
-    data = yf.download(pair, start=PERIOD_START, end=PERIOD_END)
-    data.to_csv(pair + ".csv")
+    # served from data/cex-prices; only the missing dates are downloaded
+    data = get_prices(pair, PERIOD_START, PERIOD_END)
     
     #print(data)
     num_days = len(data['Open'])
@@ -96,7 +171,7 @@ def analyze(pair):
     lvr = get_lvr(sigma, 0.0)
     lvr_with_mu = get_lvr(sigma, mu)
 
-    price_returns = data['Close'][-1] / data['Open'][0]
+    price_returns = data['Close'].iloc[-1] / data['Open'].iloc[0]
     lp_returns = sqrt(price_returns)
     hold_value = (1 + price_returns) / 2
     lp_value = 1 * lp_returns
@@ -104,7 +179,7 @@ def analyze(pair):
 
     print(f"{pair} sigma={sigma:.3f} mu={mu:.6f} lvr={lvr:.3f} lvr_with_mu={lvr_with_mu:.3f} R={price_returns:.3f} IL={il:.3f}")
     
-    return 100 * data['Open'] / data['Open'][0]
+    return 100 * data['Open'] / data['Open'].iloc[0]
 
 
 def main():
@@ -112,8 +187,7 @@ def main():
 
     eth = analyze("ETH-USD")
 
-    df = pd.read_csv('ETH-USD.csv')
-    df['Date'] = pd.to_datetime(df['Date'])
+    df = get_prices("ETH-USD", PERIOD_START, PERIOD_END).reset_index()
     df = calculate_historical_vols(df, DAYS_IN_YEAR)
     print(df)
 
@@ -139,4 +213,6 @@ def main():
 
 
 if __name__ == "__main__":
+    if CHECK_PARITY:
+        check_parity()
     main()
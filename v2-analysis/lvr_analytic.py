@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+#
+# This script estimates the LVR, the arbitrage fees and the arbitrage frequency of a full-range
+# constant product pool without Monte Carlo simulation.
+#
+# Between the arbitrage swaps, the log mispricing z = log(CEX price / pool price) is a random walk
+# with the per-block log returns of the CEX price. The arbitrage is profitable when z leaves the
+# no-trade band [z_low, z_high] given by the swap fee and the fixed swap tx cost; the swap moves the
+# pool price to the edge of the fee band, so z jumps to -log(1 - fee) or -log(1 + fee).
+# This is the discrete-block version of the model in Milionis, Moallemi and Roughgarden,
+# "Automated Market Making and Arbitrage Profits in the Presence of Fees" (2023).
+#
+# The mispricing is discretized on a grid over the band. The simulation starts with z = 0, and when
+# the band is wide, the chain does not reach its stationary distribution for a long time; so the
+# expected time spent in each cell over the period is computed from the stationary distribution and
+# the fundamental matrix of the chain. The expected fees and LVR of the swaps that leave the band
+# are integrated numerically.
+#
+# If the band is wide compared to the per-block returns, the chain makes one step per several blocks,
+# so that the grid stays small; the band is then narrowed by the Broadie-Glasserman-Kou continuity
+# correction, to account for the arbitrage that happens between the steps. This does not work when
+# the next swap is likely right after the previous one (low tx costs), so then the grid is coarser. The result is in the same units as `lvr_sweep`: the LVR and the fees
+# over the period relative to the pool value, and the number of arbitrage swaps per block.
+#
+# `main` compares the estimates with the simulation on a sample grid.
+#
+
+import os
+from math import erf, sqrt, ceil, log
+import numpy as np
+
+from lvr_simulation import INITIAL_PRICE, INITIAL_VALUE, get_liquidity, get_arb_price_bounds
+import lvr_sweep
+
+# the grid step is this fraction of the standard deviation of the returns per step
+STEPS_PER_SIGMA = 10
+MIN_GRID_SIZE = 200
+MAX_GRID_SIZE = 300
+# the Broadie-Glasserman-Kou correction for a barrier that is checked in discrete steps
+BARRIER_SHIFT = 0.5826
+# the steps of several blocks are only used if the points after the swaps are at least
+# this many standard deviations of the returns per step away from the band edges
+RESET_SIGMAS = 3
+# the jumps outside the band are integrated up to this many standard deviations
+TAIL_SIGMAS = 8
+
+# the maximal relative error accepted by the check against the simulation
+MAX_ERROR = float(os.getenv("MAX_ERROR", "0.05"))
+
+
+def get_band(fee_tier, swap_tx_cost, pool_value):
+    # the no-trade band of the log mispricing, for the pool at its initial state
+    reserve_y = pool_value / 2
+    reserve_x = reserve_y / INITIAL_PRICE
+    L = get_liquidity(reserve_x, reserve_y)
+    low, high = get_arb_price_bounds(reserve_x, reserve_y, L, swap_tx_cost, fee_tier, margin=0)
+    return log(max(float(low), 1e-300) / INITIAL_PRICE), log(float(high) / INITIAL_PRICE)
+
+
+#
+# The fee and the LVR (the LP loss vs the CEX) of an arbitrage swap, relative to the pool value,
+# for the log mispricing z before the swap. Same as in `lvr_simulation.LvrSimulation`,
+# with the pool price normalized to 1.
+#
+def get_swap_values(z, fee_tier):
+    q = np.exp(z)
+    to_price = np.where(z > 0, q * (1 - fee_tier), q * (1 + fee_tier))
+    delta_y = (np.sqrt(to_price) - 1) / 2
+    delta_x_value = (1 / np.sqrt(to_price) - 1) * q / 2
+    swap_fee = np.where(delta_x_value > 0, fee_tier * delta_x_value, fee_tier * delta_y)
+    lp_loss_vs_cex = -(delta_x_value + delta_y)
+    return swap_fee, lp_loss_vs_cex
+
+
+def normal_cdf(x):
+    return 0.5 * (1 + np.frompyfunc(erf, 1, 1)(x / sqrt(2)).astype(np.float64))
+
+
+def get_distribution_after(p0, transitions, pi, steps):
+    # p0 T^steps, by repeated squaring; stops early when the powers of T have converged
+    result = p0
+    power = transitions
+    while steps > 0:
+        if np.abs(power - pi).max() < 1e-12:
+            return pi
+        if steps & 1:
+            result = result @ power
+        steps >>= 1
+        if steps:
+            power = power @ power
+    return result
+
+
+#
+# Returns a dict with the expected "lvr", "fees" and "tx_per_block", same as `lvr_sweep.run_sweep`.
+#
+def estimate(sigma, fee_tier, swap_tx_cost, block_time, pool_value=INITIAL_VALUE, num_days=lvr_sweep.NUM_DAYS):
+    blocks_per_day = 86400 // int(block_time)
+    num_blocks = num_days * blocks_per_day
+    # the per-block log return; the price has no drift, so the log return has a negative one
+    block_s = sigma / sqrt(blocks_per_day)
+
+    z_low, z_high = get_band(fee_tier, swap_tx_cost, pool_value)
+    n = ceil((z_high - z_low) / (block_s / STEPS_PER_SIGMA))
+    blocks_per_step = 1
+    if n > MAX_GRID_SIZE:
+        distance = min(z_high + log(1 - fee_tier), -log(1 + fee_tier) - z_low)
+        blocks_per_step = min(ceil((n / MAX_GRID_SIZE) ** 2), int((distance / (RESET_SIGMAS * block_s)) ** 2))
+        blocks_per_step = max(blocks_per_step, 1)
+    s = block_s * sqrt(blocks_per_step)
+    m = -s ** 2 / 2
+    shift = BARRIER_SHIFT * (s - block_s)
+    z_low += shift
+    z_high -= shift
+
+    band = z_high - z_low
+    n = min(max(ceil(band / (s / STEPS_PER_SIGMA)), MIN_GRID_SIZE), MAX_GRID_SIZE)
+    h = band / n
+    k = ceil(TAIL_SIGMAS * s / h)
+
+    # cells -k .. n+k-1; the ones in [0, n) are in the band. The transition probability
+    # from cell i to cell j only depends on j - i, so the normal CDF is computed once per offset
+    offsets = np.arange(-(n + k), n + k + 1)
+    cdf = normal_cdf((offsets * h + h / 2 - m) / s)
+    j_minus_i = np.arange(-k, n + k)[None, :] - np.arange(n)[:, None]
+    probabilities = cdf[j_minus_i + n + k] - cdf[j_minus_i + n + k - 1]
+    edges = z_low + np.arange(-k, n + k + 1) * h
+    centers = (edges[1:] + edges[:-1]) / 2
+
+    # three more states, at exact points: after a swap up and after a swap down (the mispricing is
+    # at the edge of the fee band), and the start of the simulation (no mispricing)
+    points = np.clip([-log(1 - fee_tier), -log(1 + fee_tier), 0.0], z_low, z_high)
+    point_cdf = normal_cdf((edges[None, :] - points[:, None] - m) / s)
+    probabilities = np.vstack([probabilities, np.diff(point_cdf, axis=1)])
+
+    down = probabilities[:, :k]
+    up = probabilities[:, k + n:]
+    num_states = n + 3
+    transitions = np.zeros((num_states, num_states))
+    transitions[:, :n] = probabilities[:, k:k + n]
+    transitions[:, n] = up.sum(axis=1)
+    transitions[:, n + 1] = down.sum(axis=1)
+    transitions /= transitions.sum(axis=1, keepdims=True)
+
+    # the stationary distribution: pi (T - I) = 0, sum(pi) = 1
+    a = transitions.T - np.eye(num_states)
+    a[-1, :] = 1
+    b = np.zeros(num_states)
+    b[-1] = 1
+    pi = np.linalg.solve(a, b)
+
+    # the expected number of steps spent in each state before the price changes, starting from z = 0:
+    # sum(p0 T^t, t < steps) = p0 (I - T^steps + P) Z + (steps - 1) pi, where P has pi in every row
+    # and Z = (I - T + P)^-1 is the fundamental matrix
+    steps = round((num_blocks - 1) / blocks_per_step)
+    p0 = np.zeros(num_states)
+    p0[n + 2] = 1
+    stationary = np.tile(pi, (num_states, 1))
+    fundamental = np.linalg.inv(np.eye(num_states) - transitions + stationary)
+    p_steps = get_distribution_after(p0, transitions, pi, steps)
+    occupancy = (p0 - p_steps + pi) @ fundamental + (steps - 1) * pi
+
+    swap_fee, lp_loss_vs_cex = get_swap_values(centers, fee_tier)
+    outside = np.concatenate([down, np.zeros((num_states, n)), up], axis=1)
+    num_tx = occupancy @ outside.sum(axis=1)
+    fees = occupancy @ (outside @ swap_fee)
+    lvr = occupancy @ (outside @ lp_loss_vs_cex)
+    return {"lvr": lvr, "fees": fees, "tx_per_block": num_tx / num_blocks}
+
+
+#
+# Compares the estimates with the simulation (through the cached sweep) on the grid.
+# Returns the largest relative error of the fees, the LVR and the swap frequency.
+#
+def check_against_simulation(grid, num_days=1, num_paths=lvr_sweep.NUM_SIMULATIONS):
+    simulated = lvr_sweep.run_sweep(grid, num_days=num_days, num_paths=num_paths)
+    max_error = 0
+    for cell, sim in zip(grid, simulated):
+        est = estimate(**cell, num_days=num_days)
+        errors = {r: abs(est[r] - sim[r]) / abs(sim[r]) for r in lvr_sweep.RESULTS if sim[r] != 0}
+        recaptured_est = est["fees"] / est["lvr"]
+        recaptured_sim = sim["fees"] / sim["lvr"]
+        print(f"sigma={cell['sigma']} fee_tier={cell['fee_tier']} tx_cost={cell['swap_tx_cost']} block_time={cell['block_time']}:"
+              f" recaptured {100*recaptured_est:.2f}% vs {100*recaptured_sim:.2f}% simulated,"
+              + "".join(f" {r} error {100*e:.2f}%" for r, e in errors.items()))
+        max_error = max([max_error] + list(errors.values()))
+    return max_error
+
+
+def main():
+    # the same parameters as in `plot_lvr_recapture.plot_lvr_and_tx_cost`
+    for tx_cost_bps in [0.0005, 0.001, 0.0015, 0.002]:
+        result = estimate(0.03, 0.003, INITIAL_VALUE * tx_cost_bps / 10000, 12, num_days=10)
+        print(f"tx cost {tx_cost_bps} bps: percent recaptured {100 * result['fees'] / (0.03 ** 2 / 8 * 10):.2f}")
+
+    grid = lvr_sweep.make_grid([0.03, 0.05], [0.0005, 0.003], [0.0, 0.2, 20.0], [2, 12], [INITIAL_VALUE])
+    max_error = check_against_simulation(grid)
+    print(f"max relative error: {100*max_error:.2f}%")
+    if max_error > MAX_ERROR:
+        print("warning: the estimates do not match the simulation")
+
+
+if __name__ == '__main__':
+    main()
+    print("all done!")
@@ -0,0 +1,142 @@
+#
+# This module contains the vectorized simulation of arbitrage in a full-range constant product pool.
+#
+# The pool starts with the value `initial_value`, split equally between the two assets.
+# The arbitrageurs trade whenever the CEX price moves far enough from the pool price that
+# the trade is profitable after the swap fee and the fixed swap tx cost.
+# `plot_lvr_recapture.estimate_lvr` is the scalar version of the same simulation.
+#
+
+from math import sqrt
+import numpy as np
+
+INITIAL_PRICE = 1000
+
+# assume $1 million of liquidity in the pool (the larger, the better for all parties)
+INITIAL_VALUE = 1e6
+
+
+def get_liquidity(reserve_x, reserve_y):
+    return sqrt(reserve_x * reserve_y)
+
+
+#
+# Returns the CEX prices below / above which an arbitrage swap in the pool is profitable
+# (the same condition as in `estimate_lvr`), given the reserves and the swap tx cost.
+# Both are solutions of a quadratic equation in the square root of the target price;
+# they are widened by a small margin, so that the rounding errors do not exclude any arbitrage.
+#
+def get_arb_price_bounds(reserve_x, reserve_y, L, swap_tx_cost, fee_tier, margin=1e-9):
+    fee_factor_down = 1.0 - fee_tier
+    fee_factor_up = 1.0 + fee_tier
+    # CEX price below the pool price: the gain is x*s^2 - 2*L*s + y - cost, for s = sqrt(cex_price * (1 + fee))
+    s_low = (L - np.sqrt(reserve_x * swap_tx_cost)) / reserve_x
+    low = s_low ** 2 / fee_factor_up
+    # CEX price above the pool price: the gain is a*s^2 + b*s + c, for s = sqrt(cex_price * (1 - fee))
+    a = reserve_x / fee_factor_down
+    b = -L * (1 / fee_factor_down + fee_factor_up)
+    c = fee_factor_up * reserve_y - swap_tx_cost
+    s_high = (-b + np.sqrt(np.maximum(b * b - 4 * a * c, 0.0))) / (2 * a)
+    high = s_high ** 2 / fee_factor_down
+    return low * (1 + margin), high * (1 - margin)
+
+
+#
+# The vectorized version of `estimate_lvr`: simulates all price paths (the columns of the prices)
+# and all tx costs at once, one block at a time. The state has one element per (tx cost, path)
+# and is kept between the calls of `step`, so the prices can be given in chunks of blocks.
+# In most blocks, the arbitrage is not profitable for most of the elements, so the CEX price is
+# first compared with the price bounds of profitable arbitrage, and the swap is computed and
+# applied only for the elements outside of them.
+#
+class LvrSimulation:
+    def __init__(self, num_paths, swap_tx_costs, fee_tier, initial_value=INITIAL_VALUE, initial_price=INITIAL_PRICE):
+        self.fee_tier = fee_tier
+        self.swap_tx_costs = np.asarray(swap_tx_costs, dtype=np.float64)
+        shape = (len(self.swap_tx_costs), num_paths)
+
+        self.reserve_y = np.full(shape, initial_value / 2)
+        self.reserve_x = self.reserve_y / initial_price
+        self.pool_value0 = initial_value
+        self.L = get_liquidity(initial_value / 2 / initial_price, initial_value / 2)
+
+        self.cost = np.repeat(self.swap_tx_costs.reshape(-1, 1), num_paths, axis=1)
+        self.bound_low, self.bound_high = get_arb_price_bounds(self.reserve_x, self.reserve_y, self.L, self.cost, fee_tier)
+
+        self.lvr = np.zeros(shape)
+        self.collected_fees = np.zeros(shape)
+        self.num_tx = np.zeros(shape, dtype=np.int64)
+        self.num_blocks = 0
+
+    def step(self, prices):
+        fee_tier = self.fee_tier
+        fee_factor_down = 1.0 - fee_tier
+        fee_factor_up = 1.0 + fee_tier
+        L = self.L
+        reserve_x = self.reserve_x
+        reserve_y = self.reserve_y
+        bound_low = self.bound_low
+        bound_high = self.bound_high
+
+        for cex_price in prices:
+            rows, cols = np.nonzero((cex_price >= bound_high) | (cex_price <= bound_low))
+            if len(rows) == 0:
+                continue
+            p = cex_price[cols]
+            rx = reserve_x[rows, cols]
+            ry = reserve_y[rows, cols]
+            # the same computation as in `estimate_lvr`
+            pool_price = ry / rx
+            up = p > pool_price
+            to_price = np.where(up, p * fee_factor_down, p * fee_factor_up)
+            outside = np.where(up, to_price >= pool_price, to_price <= pool_price)
+
+            to_sqrt_price = np.sqrt(to_price)
+            delta_x = L / to_sqrt_price - rx
+            delta_y = L * to_sqrt_price - ry
+            swap_fee = np.where(delta_x > 0, fee_tier * delta_x * p, fee_tier * delta_y)
+
+            lp_loss_vs_cex = -(delta_x * p + delta_y)
+            arb_gain = lp_loss_vs_cex - swap_fee - self.swap_tx_costs[rows]
+            arb = outside & (arb_gain > 0)
+            if not np.any(arb):
+                continue
+
+            rows = rows[arb]
+            cols = cols[arb]
+            self.lvr[rows, cols] += lp_loss_vs_cex[arb]
+            self.collected_fees[rows, cols] += swap_fee[arb]
+            self.num_tx[rows, cols] += 1
+            rx = rx[arb] + delta_x[arb]
+            ry = ry[arb] + delta_y[arb]
+            reserve_x[rows, cols] = rx
+            reserve_y[rows, cols] = ry
+            bound_low[rows, cols], bound_high[rows, cols] = get_arb_price_bounds(rx, ry, L, self.cost[rows, cols], fee_tier)
+
+        self.num_blocks += len(prices)
+
+    #
+    # Returns (lvr, collected_fees, tx per block) arrays with the shape (len(swap_tx_costs), number of paths).
+    # Same as in `estimate_lvr`, the values are normalized by the initial value of the capital.
+    #
+    def result(self):
+        return (self.lvr / self.pool_value0,
+                self.collected_fees / self.pool_value0,
+                self.num_tx / max(self.num_blocks, 1))
+
+
+#
+# The vectorized version of `compute_lvr`, for many tx costs at once.
+# Takes an iterable of price chunks (consecutive blocks of the same paths);
+# returns a (lvr, fees, tx per block) tuple for each tx cost.
+#
+def compute_lvr_paths(price_chunks, swap_tx_costs, fee_tier):
+    print(f"compute_lvr_paths, swap_tx_costs={swap_tx_costs}, fee_tier={100*fee_tier:.2}%")
+    simulation = None
+    for prices in price_chunks:
+        if simulation is None:
+            simulation = LvrSimulation(prices.shape[1], swap_tx_costs, fee_tier)
+        simulation.step(prices)
+
+    all_lvr, all_fees, all_tx_per_block = simulation.result()
+    return [(np.mean(all_lvr[i]), np.mean(all_fees[i]), np.mean(all_tx_per_block[i])) for i in range(len(swap_tx_costs))]
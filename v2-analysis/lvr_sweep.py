@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+
+#
+# This script evaluates the LVR simulation on a grid of parameters:
+# (sigma, fee tier, swap tx cost, block time, pool value).
+#
+# All grid cells with the same block time use the same random numbers (common random numbers),
+# so the differences between the cells are not hidden by the simulation noise. The random numbers
+# are generated once per block time and put in shared memory, from where the worker processes read
+# them; if they do not fit in SHARED_MEMORY_MB, each worker generates them from the seed instead
+# (the numbers are the same in both cases).
+#
+# The cells that differ only by the tx cost are simulated together. The result of each cell is cached
+# in `data/lvr-sweep`, keyed by its parameters and the seed, so only the new cells are computed
+# when the grid is extended.
+#
+# The grid is given by comma-separated lists in the environment variables
+# SIGMAS, FEE_TIERS, TX_COSTS (in dollars), BLOCK_TIMES (in seconds) and POOL_VALUES (in dollars).
+#
+
+import os
+import csv
+import json
+import hashlib
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+
+from price_paths import GBMPaths
+from lvr_simulation import INITIAL_PRICE, INITIAL_VALUE, LvrSimulation
+
+self_dir = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(self_dir, "..", "data", "lvr-sweep")
+
+# increase this when the simulation changes, to invalidate the cached results
+MODEL_VERSION = 1
+
+NUM_DAYS = int(os.getenv("NUM_DAYS", "10"))
+
+NUM_SIMULATIONS = int(os.getenv("NUM_SIMULATIONS", "1000"))
+
+SEED = int(os.getenv("SEED", "123"))
+
+NUM_WORKERS = os.getenv("NUM_WORKERS")
+if NUM_WORKERS is None or len(NUM_WORKERS) == 0:
+    NUM_WORKERS = os.cpu_count()
+NUM_WORKERS = int(NUM_WORKERS)
+
+# the limit for the random numbers of one block time in shared memory
+SHARED_MEMORY_MB = int(os.getenv("SHARED_MEMORY_MB", "4096"))
+
+PARAMETERS = ["sigma", "fee_tier", "swap_tx_cost", "block_time", "pool_value"]
+
+RESULTS = ["lvr", "fees", "tx_per_block"]
+
+
+def get_env_list(name, default):
+    value = os.getenv(name)
+    if value is None or len(value) == 0:
+        return default
+    return [float(u) for u in value.split(",")]
+
+
+def make_grid(sigmas, fee_tiers, swap_tx_costs, block_times, pool_values):
+    return [dict(zip(PARAMETERS, values)) for values in
+            itertools.product(sigmas, fee_tiers, swap_tx_costs, block_times, pool_values)]
+
+############################################################
+# cache
+
+def cell_key(cell, num_days, num_paths, seed):
+    key = {p: float(cell[p]) for p in PARAMETERS}
+    key.update(num_days=num_days, num_paths=num_paths, seed=seed,
+               initial_price=INITIAL_PRICE, version=MODEL_VERSION)
+    return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
+
+def cache_filename(key):
+    return os.path.join(CACHE_DIR, key[:2], key + ".json")
+
+
+def load_cached(key):
+    filename = cache_filename(key)
+    if not os.access(filename, os.R_OK):
+        return None
+    with open(filename) as f:
+        return json.load(f)["result"]
+
+
+def save_cached(key, cell, result):
+    filename = cache_filename(key)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    # write to a temporary file first, so that an interrupted run does not leave a broken file
+    with open(filename + ".tmp", "w") as f:
+        json.dump({"cell": cell, "result": result}, f)
+    os.replace(filename + ".tmp", filename)
+
+############################################################
+# workers
+
+# the shared memory blocks attached by this process, by name
+attached = {}
+
+
+def get_normals(task):
+    if task["shm_name"] is None:
+        return None
+    if task["shm_name"] not in attached:
+        shm = shared_memory.SharedMemory(name=task["shm_name"])
+        attached[task["shm_name"]] = (shm, np.ndarray(task["shape"], dtype=np.float64, buffer=shm.buf))
+    return attached[task["shm_name"]][1]
+
+
+#
+# Simulates the cells of one group: same sigma, fee tier, block time and pool value, different tx costs.
+# Returns a dict with the results for each tx cost.
+#
+def run_group(task):
+    blocks_per_day = 86400 // int(task["block_time"])
+    paths = GBMPaths(task["sigma"], task["num_paths"], task["num_days"] * blocks_per_day, blocks_per_day,
+                     INITIAL_PRICE, seed=task["seed"], normals=get_normals(task))
+    simulation = LvrSimulation(task["num_paths"], task["swap_tx_costs"], task["fee_tier"],
+                               initial_value=task["pool_value"])
+    for prices in paths.chunks():
+        simulation.step(prices)
+    lvr, fees, tx_per_block = simulation.result()
+    return [{"lvr": float(np.mean(lvr[i])), "fees": float(np.mean(fees[i])), "tx_per_block": float(np.mean(tx_per_block[i]))}
+            for i in range(len(task["swap_tx_costs"]))]
+
+############################################################
+
+def create_shared_normals(block_time, num_days, num_paths, seed):
+    blocks_per_day = 86400 // int(block_time)
+    shape = (num_days * blocks_per_day - 1, num_paths)
+    shm = shared_memory.SharedMemory(create=True, size=max(shape[0] * shape[1] * 8, 1))
+    normals = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+    GBMPaths(1.0, num_paths, num_days * blocks_per_day, blocks_per_day, INITIAL_PRICE, seed=seed).generate_normals(normals)
+    return shm, shape
+
+
+#
+# Returns the results of the grid cells, in the same order, as dicts with the keys in RESULTS.
+# Only the cells that are not in the cache are simulated.
+#
+def run_sweep(grid, num_days=NUM_DAYS, num_paths=NUM_SIMULATIONS, seed=SEED, num_workers=NUM_WORKERS):
+    keys = [cell_key(cell, num_days, num_paths, seed) for cell in grid]
+    results = [load_cached(key) for key in keys]
+
+    # group the missing cells by everything except the tx cost
+    groups = {}
+    for i, cell in enumerate(grid):
+        if results[i] is None:
+            group = (cell["sigma"], cell["fee_tier"], cell["block_time"], cell["pool_value"])
+            groups.setdefault(group, []).append(i)
+    print(f"{len(grid)} cells, {len(grid) - sum(len(u) for u in groups.values())} cached, {len(groups)} groups to simulate")
+    if len(groups) == 0:
+        return results
+
+    shared = {}
+    try:
+        tasks = []
+        for (sigma, fee_tier, block_time, pool_value), indexes in groups.items():
+            if block_time not in shared:
+                size_mb = num_days * (86400 // int(block_time)) * num_paths * 8 / 1e6
+                shared[block_time] = create_shared_normals(block_time, num_days, num_paths, seed) \
+                    if size_mb <= SHARED_MEMORY_MB else (None, None)
+            shm, shape = shared[block_time]
+            tasks.append({
+                "sigma": sigma, "fee_tier": fee_tier, "block_time": block_time, "pool_value": pool_value,
+                "swap_tx_costs": sorted(set(grid[i]["swap_tx_cost"] for i in indexes)),
+                "num_days": num_days, "num_paths": num_paths, "seed": seed,
+                "shm_name": shm.name if shm is not None else None, "shape": shape,
+            })
+
+        if num_workers > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(max_workers=min(num_workers, len(tasks))) as executor:
+                task_results = executor.map(run_group, tasks)
+                for task, indexes, task_result in zip(tasks, groups.values(), task_results):
+                    save_group(grid, keys, results, task, indexes, task_result)
+        else:
+            for task, indexes in zip(tasks, groups.values()):
+                save_group(grid, keys, results, task, indexes, run_group(task))
+    finally:
+        for shm, _ in shared.values():
+            if shm is not None:
+                if shm.name in attached:
+                    attached.pop(shm.name)[0].close()
+                shm.close()
+                shm.unlink()
+
+    return results
+
+
+def save_group(grid, keys, results, task, indexes, task_result):
+    by_cost = dict(zip(task["swap_tx_costs"], task_result))
+    for i in indexes:
+        results[i] = by_cost[grid[i]["swap_tx_cost"]]
+        save_cached(keys[i], grid[i], results[i])
+    print(f"sigma={task['sigma']} fee_tier={task['fee_tier']} block_time={task['block_time']} pool_value={task['pool_value']} done")
+
+
+def main():
+    grid = make_grid(get_env_list("SIGMAS", [0.03]),
+                     get_env_list("FEE_TIERS", [0.003]),
+                     get_env_list("TX_COSTS", [0.05, 0.1, 0.15, 0.2]),
+                     get_env_list("BLOCK_TIMES", [12]),
+                     get_env_list("POOL_VALUES", [INITIAL_VALUE]))
+    results = run_sweep(grid)
+
+    filename = "lvr-sweep.csv"
+    with open(filename, "w") as f:
+        writer = csv.writer(f)
+        writer.writerow(PARAMETERS + RESULTS + ["recaptured"])
+        for cell, result in zip(grid, results):
+            # the expected LVR relative to the pool value is sigma^2 / 8 per day
+            expected_lvr = cell["sigma"] ** 2 / 8 * NUM_DAYS
+            writer.writerow([cell[p] for p in PARAMETERS] + [result[r] for r in RESULTS]
+                            + [result["fees"] / expected_lvr])
+    print(f"results written to {filename}")
+
+
+if __name__ == '__main__':
+    main()
+    print("all done!")
@@ -4,18 +4,17 @@
 # This plots the figures for the article on LVR.
 #
 
+import os
 import matplotlib.pyplot as pl
 import numpy as np
 from ing_theme_matplotlib import mpl_style
 from math import sqrt
 
+from lvr_simulation import INITIAL_PRICE, INITIAL_VALUE, get_liquidity, compute_lvr_paths
+import lvr_sweep
 
-# Constants for the LP positions
 
-INITIAL_PRICE = 1000
-
-# assume $1 million of liquidity in the pool (the larger, the better for all parties)
-INITIAL_VALUE = 1e6
+# the constants for the LP positions (INITIAL_PRICE, INITIAL_VALUE) are in `lvr_simulation`
 
 # Constants for price simulations
 SIGMA = 0.03
@@ -30,17 +29,15 @@ SWAP_FEE_03 = 0.3 / 100
 
 NUM_SIMULATIONS = 10000
 
+# set this to compare the vectorized simulation with the scalar one
+CHECK_SCALAR = os.getenv("CHECK_SCALAR", "0") != "0"
+
 
 # Constants for plotting
 pl.rcParams["savefig.dpi"] = 200
 
 ############################################################
 
-def get_liquidity(reserve_x, reserve_y):
-    return sqrt(reserve_x * reserve_y)
-
-############################################################
-
 #
 # Use geometrical Brownian motion to simulate price evolution.
 #
@@ -139,20 +136,26 @@ def compute_lvr(all_prices, swap_tx_cost, fee_tier):
 
     return np.mean(all_lvr), np.mean(all_fees), np.mean(all_tx_per_block)
 
+
+def check_vectorized(num_simulations=20, num_days=1):
+    # the vectorized simulation should give the same results as the scalar one on the same paths
+    all_prices = get_price_path(SIGMA, blocks_per_day=BLOCKS_PER_DAY, M=num_simulations, num_days=num_days)
+    swap_tx_costs = [INITIAL_VALUE * u / 10000 for u in [0.0005, 0.002]]
+    # split into chunks, to check that the state is carried over
+    chunks = [all_prices[i:i + 1000] for i in range(0, len(all_prices), 1000)]
+    vectorized = compute_lvr_paths(chunks, swap_tx_costs, SWAP_FEE_03)
+    for cost, result in zip(swap_tx_costs, vectorized):
+        scalar = compute_lvr(all_prices, cost, SWAP_FEE_03)
+        print(f"tx cost {cost}: scalar={scalar} vectorized={result}")
+        assert np.allclose(scalar, result, rtol=1e-9, atol=0)
+
 ############################################################
 
 def plot_lvr_and_tx_cost():
     fig, ax = pl.subplots()
     fig.set_size_inches((6, 4))
 
-    # reduce the number of simulations, since we iterate over each block
-    num_simulations = 200
-
-    all_prices = get_price_path(SIGMA, blocks_per_day=BLOCKS_PER_DAY, M=num_simulations)
-    final_prices = all_prices[-1,:]
-    returns = final_prices / INITIAL_PRICE
-    year_sigma = SIGMA * sqrt(365) # convert from daily to yearly volatility
-    print(f"sigma={year_sigma:.2f} mean={np.mean(final_prices):.4f} std={np.std(np.log(returns)):.4f}")
+    num_simulations = NUM_SIMULATIONS
 
     coeff = 365 / NUM_DAYS
     lvr = (SIGMA ** 2) / 8
@@ -165,7 +168,11 @@ def plot_lvr_and_tx_cost():
     swap_tx_cost_dollars = [INITIAL_VALUE * u / 10000 for u in tx_cost_bps]
     print(swap_tx_cost_dollars)
 
-    lvr_and_fees = [compute_lvr(all_prices, cost, SWAP_FEE_03) for cost in swap_tx_cost_dollars]
+    # the results are cached per tx cost, so only the new ones are simulated
+    grid = lvr_sweep.make_grid([SIGMA], [SWAP_FEE_03], swap_tx_cost_dollars, [86400 // BLOCKS_PER_DAY], [INITIAL_VALUE])
+    results = lvr_sweep.run_sweep(grid, num_days=NUM_DAYS, num_paths=num_simulations)
+    lvr_and_fees = [(u["lvr"], u["fees"], u["tx_per_block"]) for u in results]
+
     pl.plot(x, [coeff * 100 * u[0] for u in lvr_and_fees], label="Losses to LVR", marker="v", color="red")
     pl.plot(x, [coeff * 100 * u[1] for u in lvr_and_fees], label="Gains from arb fees, 0.3% pool", marker="o", color="orange")
 
@@ -187,6 +194,9 @@ def plot_lvr_and_tx_cost():
 def main():
     mpl_style(True)
 
+    if CHECK_SCALAR:
+        check_vectorized()
+
     # check what % of LVR goes to the LP as fees, as a function of Tx cost
     plot_lvr_and_tx_cost()
 
@@ -0,0 +1,95 @@
+#
+# This module contains a streaming generator of price paths (geometric Brownian motion).
+#
+# The paths are generated in chunks of blocks, for all simulations at once, so the memory use
+# is (chunk size * number of paths * 8) bytes regardless of the length of the simulated period.
+# The last price of each chunk is carried over to the next one.
+#
+# The random numbers come from independent streams, one per segment of `SEGMENT_BLOCKS` blocks,
+# derived from the seed with `np.random.SeedSequence`. Any block's random numbers depend only on
+# the seed, the number of paths and the block number, so the paths are the same for any chunk size.
+#
+# The standard normal numbers can also be given as an array (e.g. in shared memory), so that many
+# paths with different parameters are computed from the same random numbers (common random numbers).
+# `generate_normals` fills such an array with the same numbers that are generated from the seed.
+#
+
+import numpy as np
+
+# the number of blocks per random number stream
+SEGMENT_BLOCKS = 1024
+
+# the default number of blocks per chunk
+CHUNK_BLOCKS = 1024
+
+
+class GBMPaths:
+    def __init__(self, sigma_per_day, num_paths, num_blocks, blocks_per_day, initial_price, mu=0.0, seed=123,
+                 normals=None):
+        self.sigma_per_day = sigma_per_day
+        self.num_paths = num_paths
+        # the number of blocks, including the first one, which has the initial price
+        self.num_blocks = num_blocks
+        self.blocks_per_day = blocks_per_day
+        self.initial_price = initial_price
+        self.mu = mu
+        self.seed = seed
+        # optional, shape (num_blocks - 1, num_paths)
+        self.normals = normals
+
+    def segment_normals(self, segment):
+        # standard normal numbers for the returns of the blocks of one segment, shape (SEGMENT_BLOCKS, num_paths)
+        seed_sequence = np.random.SeedSequence(self.seed, spawn_key=(segment,))
+        rng = np.random.Generator(np.random.PCG64(seed_sequence))
+        return rng.standard_normal((SEGMENT_BLOCKS, self.num_paths))
+
+    def return_factors(self, start, end):
+        # the price multipliers of the returns with indexes [start, end); return i leads to the price of block i+1
+        dt = 1 / self.blocks_per_day
+        drift = (self.mu - self.sigma_per_day ** 2 / 2) * dt
+        scale = self.sigma_per_day * np.sqrt(dt)
+        if self.normals is not None:
+            return np.exp(drift + scale * self.normals[start:end])
+        result = np.empty((end - start, self.num_paths))
+        i = start
+        while i < end:
+            segment = i // SEGMENT_BLOCKS
+            if self._segment != segment:
+                self._normals = self.segment_normals(segment)
+                self._segment = segment
+            offset = i - segment * SEGMENT_BLOCKS
+            n = min(end - i, SEGMENT_BLOCKS - offset)
+            result[i - start:i - start + n] = self._normals[offset:offset + n]
+            i += n
+        return np.exp(drift + scale * result)
+
+    #
+    # Yields the prices of all paths in chunks with the shape (number of blocks in the chunk, num_paths).
+    # The first row of the first chunk has the initial price.
+    #
+    def chunks(self, chunk_blocks=CHUNK_BLOCKS):
+        self._segment = None
+        self._normals = None
+        last = np.full(self.num_paths, float(self.initial_price))
+        for start in range(0, self.num_blocks, chunk_blocks):
+            end = min(start + chunk_blocks, self.num_blocks)
+            if start == 0:
+                factors = np.vstack([np.ones(self.num_paths), self.return_factors(0, end - 1)])
+            else:
+                factors = self.return_factors(start - 1, end - 1)
+            # multiply one block at a time, so the result does not depend on the chunk boundaries
+            prices = np.cumprod(np.vstack([last, factors]), axis=0)[1:]
+            last = prices[-1]
+            yield prices
+
+    def generate_normals(self, out):
+        # fills `out`, with the shape (num_blocks - 1, num_paths), with the numbers generated from the seed
+        for segment in range((self.num_blocks - 1 + SEGMENT_BLOCKS - 1) // SEGMENT_BLOCKS):
+            start = segment * SEGMENT_BLOCKS
+            end = min(start + SEGMENT_BLOCKS, self.num_blocks - 1)
+            out[start:end] = self.segment_normals(segment)[:end - start]
+        return out
+
+    def all(self):
+        # all prices at once; only for short periods
+        return np.vstack(list(self.chunks()))
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+
+#
+# This module contains the vectorized simulation of arbitrage in a v3 (concentrated liquidity) pool.
+#
+# The pool has one or more LP positions, each with its own tick range and liquidity; the liquidity
+# at a price is the sum of the liquidity of the positions whose range contains it. Same as in
+# `lvr_simulation.LvrSimulation`, the arbitrageurs move the pool price to the edge of the fee band
+# around the CEX price whenever the trade is profitable after the swap fee and the fixed swap tx cost.
+# The token amounts of the swap are the sums over the positions, so the swap can cross any number
+# of ranges, including the ones with no liquidity.
+#
+# For each position, the LVR, the collected fees and the fraction of blocks with the pool price
+# in its range are reported, normalized by the value of the position at the start.
+# A single position over the full tick range is the same pool as in `lvr_simulation`.
+#
+# The prices are given in chunks, as generated by `price_paths.GBMPaths` or `bootstrap_paths.BootstrapPaths`.
+#
+
+import os
+import sys
+from math import sqrt, log, floor, ceil
+import numpy as np
+
+from price_paths import GBMPaths
+from lvr_simulation import INITIAL_PRICE, INITIAL_VALUE, LvrSimulation
+
+sys.path.append("..")
+
+from amm_math import LOG_TICK_BASE, MIN_TICK, MAX_TICK, TICK_SPACINGS, tick_to_price
+
+SIGMA = 0.03
+
+BLOCKS_PER_DAY = 86400 // 12
+
+NUM_DAYS = int(os.getenv("NUM_DAYS", "10"))
+
+NUM_SIMULATIONS = int(os.getenv("NUM_SIMULATIONS", "1000"))
+
+
+def get_tick_spacing(fee_tier):
+    return TICK_SPACINGS[round(fee_tier * 1e6)]
+
+
+#
+# Returns the ticks of the range that contains [price_lower, price_upper], rounded to the tick spacing.
+#
+def get_range_ticks(price_lower, price_upper, tick_spacing):
+    min_tick, max_tick = get_full_range_ticks(tick_spacing)
+    tick_lower = floor(log(price_lower) / LOG_TICK_BASE / tick_spacing) * tick_spacing
+    tick_upper = ceil(log(price_upper) / LOG_TICK_BASE / tick_spacing) * tick_spacing
+    return max(tick_lower, min_tick), min(tick_upper, max_tick)
+
+
+def get_full_range_ticks(tick_spacing):
+    return ceil(MIN_TICK / tick_spacing) * tick_spacing, floor(MAX_TICK / tick_spacing) * tick_spacing
+
+
+#
+# Returns a position as a dict with its ticks, value and liquidity; the liquidity is such that
+# the position has the given value at the given price.
+#
+def make_position(tick_lower, tick_upper, value, price):
+    sqrt_lower = sqrt(tick_to_price(tick_lower))
+    sqrt_upper = sqrt(tick_to_price(tick_upper))
+    s = min(max(sqrt(price), sqrt_lower), sqrt_upper)
+    value_per_liquidity = (1 / s - 1 / sqrt_upper) * price + (s - sqrt_lower)
+    return {"tick_lower": tick_lower, "tick_upper": tick_upper, "value": value,
+            "liquidity": value / value_per_liquidity}
+
+
+#
+# Returns the positions with the same value, centered around the price, with the given
+# relative widths (e.g. 0.1 for the range [price / 1.1, price * 1.1]); None for full range.
+#
+def make_positions(widths, fee_tier, value_per_position=INITIAL_VALUE, price=INITIAL_PRICE):
+    tick_spacing = get_tick_spacing(fee_tier)
+    result = []
+    for width in widths:
+        if width is None:
+            tick_lower, tick_upper = get_full_range_ticks(tick_spacing)
+        else:
+            tick_lower, tick_upper = get_range_ticks(price / (1 + width), price * (1 + width), tick_spacing)
+        result.append(make_position(tick_lower, tick_upper, value_per_position, price))
+    return result
+
+
+#
+# The vectorized simulation of all price paths (the columns of the prices) and all tx costs at once,
+# one block at a time, with the state kept between the calls of `step`.
+# The arbitrage is only possible if the CEX price is outside the fee band around the pool price,
+# so the swaps are computed only for the elements outside of it.
+#
+class V3ArbSimulation:
+    def __init__(self, num_paths, swap_tx_costs, fee_tier, positions, initial_price=INITIAL_PRICE):
+        self.fee_tier = fee_tier
+        self.swap_tx_costs = np.asarray(swap_tx_costs, dtype=np.float64)
+        self.positions = positions
+        shape = (len(self.swap_tx_costs), num_paths)
+        num_positions = len(positions)
+
+        self.liquidity = np.array([u["liquidity"] for u in positions])
+        self.sqrt_lower = np.sqrt(tick_to_price([u["tick_lower"] for u in positions]))
+        self.sqrt_upper = np.sqrt(tick_to_price([u["tick_upper"] for u in positions]))
+        self.values0 = np.array([u["value"] for u in positions], dtype=np.float64)
+
+        self.sqrt_price = np.full(shape, sqrt(initial_price))
+        self.bound_low, self.bound_high = self.get_fee_band(self.sqrt_price)
+
+        self.lvr = np.zeros((num_positions,) + shape)
+        self.collected_fees = np.zeros((num_positions,) + shape)
+        self.blocks_in_range = np.zeros((num_positions,) + shape, dtype=np.int64)
+        # the block since which the pool has had its current price
+        self.price_since = np.zeros(shape, dtype=np.int64)
+        self.num_tx = np.zeros(shape, dtype=np.int64)
+        self.num_blocks = 0
+
+    def get_fee_band(self, sqrt_price, margin=1e-9):
+        # the CEX prices below / above which the arbitrage can be profitable
+        pool_price = sqrt_price ** 2
+        return pool_price / (1 + self.fee_tier) * (1 + margin), pool_price / (1 - self.fee_tier) * (1 - margin)
+
+    def get_amounts(self, sqrt_price):
+        # the token amounts of each position, shape (len(sqrt_price), number of positions)
+        s = np.clip(sqrt_price.reshape(-1, 1), self.sqrt_lower, self.sqrt_upper)
+        return self.liquidity * (1 / s - 1 / self.sqrt_upper), self.liquidity * (s - self.sqrt_lower)
+
+    def in_range(self, sqrt_price):
+        s = sqrt_price.reshape(-1, 1)
+        return (s >= self.sqrt_lower) & (s < self.sqrt_upper)
+
+    def step(self, prices):
+        fee_tier = self.fee_tier
+        fee_factor_down = 1.0 - fee_tier
+        fee_factor_up = 1.0 + fee_tier
+        sqrt_price = self.sqrt_price
+        bound_low = self.bound_low
+        bound_high = self.bound_high
+
+        for i, cex_price in enumerate(prices):
+            rows, cols = np.nonzero((cex_price >= bound_high) | (cex_price <= bound_low))
+            if len(rows) == 0:
+                continue
+            p = cex_price[cols]
+            s0 = sqrt_price[rows, cols]
+            pool_price = s0 ** 2
+            up = p > pool_price
+            to_price = np.where(up, p * fee_factor_down, p * fee_factor_up)
+            outside = np.where(up, to_price >= pool_price, to_price <= pool_price)
+
+            # the changes of the amounts of each position
+            s1 = np.sqrt(to_price)
+            x0, y0 = self.get_amounts(s0)
+            x1, y1 = self.get_amounts(s1)
+            delta_x = x1 - x0
+            delta_y = y1 - y0
+            p = p.reshape(-1, 1)
+            swap_fee = np.where(delta_x > 0, fee_tier * delta_x * p, fee_tier * delta_y)
+            lp_loss_vs_cex = -(delta_x * p + delta_y)
+
+            arb_gain = lp_loss_vs_cex.sum(axis=1) - swap_fee.sum(axis=1) - self.swap_tx_costs[rows]
+            arb = outside & (arb_gain > 0)
+            if not np.any(arb):
+                continue
+
+            rows = rows[arb]
+            cols = cols[arb]
+            block = self.num_blocks + i
+            self.blocks_in_range[:, rows, cols] += (self.in_range(s0[arb]) * (block - self.price_since[rows, cols]).reshape(-1, 1)).T
+            self.price_since[rows, cols] = block
+            self.lvr[:, rows, cols] += lp_loss_vs_cex[arb].T
+            self.collected_fees[:, rows, cols] += swap_fee[arb].T
+            self.num_tx[rows, cols] += 1
+            sqrt_price[rows, cols] = s1[arb]
+            bound_low[rows, cols], bound_high[rows, cols] = self.get_fee_band(s1[arb])
+
+        self.num_blocks += len(prices)
+
+    #
+    # Returns (lvr, collected_fees, time in range) arrays with the shape
+    # (number of positions, len(swap_tx_costs), number of paths), and the tx per block with the shape
+    # (len(swap_tx_costs), number of paths). The values are normalized by the initial values of the positions.
+    #
+    def result(self):
+        remaining = self.in_range(self.sqrt_price.ravel()).T.reshape(self.blocks_in_range.shape)
+        blocks_in_range = self.blocks_in_range + remaining * (self.num_blocks - self.price_since)
+        values0 = self.values0.reshape(-1, 1, 1)
+        num_blocks = max(self.num_blocks, 1)
+        return (self.lvr / values0,
+                self.collected_fees / values0,
+                blocks_in_range / num_blocks,
+                self.num_tx / num_blocks)
+
+
+#
+# Takes an iterable of price chunks; returns a list with a dict of the mean results
+# ("lvr", "fees", "time_in_range", "tx_per_block") for each position, for each tx cost.
+#
+def compute_v3_lvr_paths(price_chunks, swap_tx_costs, fee_tier, positions):
+    print(f"compute_v3_lvr_paths, swap_tx_costs={swap_tx_costs}, fee_tier={100*fee_tier:.2}%, {len(positions)} positions")
+    simulation = None
+    for prices in price_chunks:
+        if simulation is None:
+            simulation = V3ArbSimulation(prices.shape[1], swap_tx_costs, fee_tier, positions)
+        simulation.step(prices)
+
+    lvr, fees, time_in_range, tx_per_block = simulation.result()
+    return [[{"lvr": np.mean(lvr[j, i]), "fees": np.mean(fees[j, i]), "time_in_range": np.mean(time_in_range[j, i]),
+              "tx_per_block": np.mean(tx_per_block[i])} for j in range(len(positions))]
+            for i in range(len(swap_tx_costs))]
+
+
+#
+# A single full-range position should give the same results as the constant product simulation.
+#
+def check_full_range(num_simulations=100, num_days=1):
+    fee_tier = 0.003
+    swap_tx_costs = [0.0, 50.0, 200.0]
+    paths = GBMPaths(SIGMA, num_simulations, num_days * BLOCKS_PER_DAY, BLOCKS_PER_DAY, INITIAL_PRICE)
+    v2 = LvrSimulation(num_simulations, swap_tx_costs, fee_tier)
+    v3 = V3ArbSimulation(num_simulations, swap_tx_costs, fee_tier, make_positions([None], fee_tier))
+    for prices in paths.chunks():
+        v2.step(prices)
+        v3.step(prices)
+    v2_lvr, v2_fees, v2_tx_per_block = v2.result()
+    v3_lvr, v3_fees, time_in_range, v3_tx_per_block = v3.result()
+    # with no tx cost, the gains of the smallest swaps are close to zero, so a few of them can differ by the rounding
+    assert np.allclose(v2_lvr, v3_lvr[0], rtol=1e-6, atol=1e-12)
+    assert np.allclose(v2_fees, v3_fees[0], rtol=1e-6, atol=1e-12)
+    assert np.allclose(v2_tx_per_block.sum(axis=1), v3_tx_per_block.sum(axis=1), rtol=1e-3)
+    assert np.all(time_in_range == 1)
+    print("full range check passed")
+
+
+def main():
+    check_full_range()
+
+    paths = GBMPaths(SIGMA, NUM_SIMULATIONS, NUM_DAYS * BLOCKS_PER_DAY, BLOCKS_PER_DAY, INITIAL_PRICE)
+    swap_tx_costs = [1.0, 10.0]
+    widths = [None, 0.5, 0.1, 0.02]
+    expected_lvr = SIGMA ** 2 / 8 * NUM_DAYS
+    for fee_tier in [0.0005, 0.003]:
+        # each configuration is simulated separately, as the only liquidity in the pool
+        for width in widths:
+            positions = make_positions([width], fee_tier)
+            results = compute_v3_lvr_paths(paths.chunks(), swap_tx_costs, fee_tier, positions)
+            for cost, [r] in zip(swap_tx_costs, results):
+                print(f"fee_tier={fee_tier} width={width} tx_cost={cost}: LVR={r['lvr']:.6f}"
+                      f" ({r['lvr'] / expected_lvr:.2f}x full range) fees={r['fees']:.6f}"
+                      f" recaptured={100 * r['fees'] / r['lvr']:.2f}% time in range={100 * r['time_in_range']:.1f}%"
+                      f" tx per block={r['tx_per_block']:.4f}")
+
+        # all positions in the same pool
+        positions = make_positions(widths, fee_tier)
+        results = compute_v3_lvr_paths(paths.chunks(), swap_tx_costs, fee_tier, positions)
+        for cost, result in zip(swap_tx_costs, results):
+            for width, r in zip(widths, result):
+                print(f"fee_tier={fee_tier} tx_cost={cost} shared pool, width={width}: LVR={r['lvr']:.6f}"
+                      f" fees={r['fees']:.6f} recaptured={100 * r['fees'] / r['lvr']:.2f}%"
+                      f" time in range={100 * r['time_in_range']:.1f}%")
+
+
+if __name__ == '__main__':
+    main()
+    print("all done!")
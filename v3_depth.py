@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+
+#
+# This file answers depth and price impact queries for a Uniswap v3 pool at many blocks at once,
+# from the pool state rebuilt by `v3_replay.py`:
+#  1) depth: the amounts that a swap must put in (and gets out) to move the price by x%;
+#  2) price impact: the relative price change caused by a swap with the given input amount.
+# The amounts are in the smallest token units and do not include the swap fee, unless `fee` is given.
+#
+# The state of the pool at each sampled block is kept as a snapshot of its liquidity distribution:
+# the price, the active liquidity, and the liquidityNet of the initialized ticks within a factor of
+# MAX_PRICE_RATIO of the price (the queries that go further give NaN). The snapshots of many blocks
+# are stored in flat arrays, with `offsets` giving the ticks of each one, so the liquidity of each range
+# and the amounts needed to reach each tick are cumulative sums over all snapshots at once,
+# and the queries are searches in these sums.
+#
+# The snapshots are taken every INTERVAL seconds of the year (the blocks come from the block index,
+# see `block_index.py`). They are computed by replaying the events from the replay checkpoints,
+# one segment between two checkpoints per task, and cached per segment:
+#   data/v3-depth/{CHAIN}/{POOL}/{INTERVAL}s/{CHECKPOINT}.npz
+# The last segment is not cached, as the next checkpoint does not exist yet.
+#
+# Run this file to compute the depth of the pool at +-MOVES, written to:
+#   depth-v3-{YEAR}-{POOL}.csv
+#
+
+import os
+import bisect
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from amm_math import Q96, LOG_TICK_BASE
+from block_index import load_index, date_to_timestamp
+import v3_replay
+
+CHAIN = v3_replay.CHAIN
+
+YEAR = os.getenv("YEAR")
+if YEAR is None or len(YEAR) == 0:
+    YEAR = "2023"
+
+POOL = os.getenv("POOL")
+if POOL is None or len(POOL) == 0:
+    POOL = "0x88e6a0c2ddd26feeb64f039a2c41296fcb3f5640" # USDC/ETH 0.05%
+POOL = POOL.lower()
+
+# in seconds
+INTERVAL = int(os.getenv("INTERVAL", "3600"))
+
+# the relative price changes for the depth
+MOVES = os.getenv("MOVES")
+if MOVES is None or len(MOVES) == 0:
+    MOVES = "0.001,0.005,0.01,0.02,0.05,0.1"
+MOVES = [float(u) for u in MOVES.split(",")]
+
+MAX_PRICE_RATIO = float(os.getenv("MAX_PRICE_RATIO", "2.0"))
+
+NUM_WORKERS = v3_replay.NUM_WORKERS
+
+self_dir = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(self_dir, "data")
+
+
+def cache_filename(chain, pool, interval, checkpoint, data_dir=DATA_DIR):
+    return os.path.join(data_dir, "v3-depth", chain, pool, f"{interval}s", f"{checkpoint:012d}.npz")
+
+
+#
+# For sorted `values` split in groups by `offsets`, returns the index in its group of the last value
+# that is <= each query (-1 if none); `query_groups` has the group of each query.
+#
+def group_searchsorted(offsets, values, query_groups, queries):
+    n = len(values)
+    groups = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    all_groups = np.concatenate((groups, query_groups))
+    all_values = np.concatenate((values, queries))
+    is_query = np.concatenate((np.zeros(n, dtype=bool), np.ones(len(queries), dtype=bool)))
+    # the values before the queries that are equal to them
+    order = np.lexsort((is_query, all_values, all_groups))
+    counts = np.cumsum(~is_query[order])
+    sorted_queries = is_query[order]
+    result = np.empty(len(queries), dtype=np.int64)
+    result[order[sorted_queries] - n] = counts[sorted_queries]
+    return result - offsets[query_groups] - 1
+
+
+def group_cumsum(offsets, values):
+    # the cumulative sums of `values` within each group
+    total = np.cumsum(values)
+    starts = np.concatenate(([0.0], total))[offsets[:-1]]
+    return total - np.repeat(starts, np.diff(offsets))
+
+
+class DepthSnapshots:
+    def __init__(self, blocks, sqrt_price, tick, liquidity, offsets, ticks, net, max_price_ratio=MAX_PRICE_RATIO):
+        self.blocks = np.asarray(blocks, dtype=np.int64)
+        # not scaled by Q96; 0 if the pool is not initialized
+        self.sqrt_price = np.asarray(sqrt_price, dtype=np.float64)
+        self.tick = np.asarray(tick, dtype=np.int64)
+        self.liquidity = np.asarray(liquidity, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.ticks = np.asarray(ticks, dtype=np.int64)
+        self.net = np.asarray(net, dtype=np.float64)
+        self.max_price_ratio = max_price_ratio
+        self._sides = {}
+
+    def __len__(self):
+        return len(self.blocks)
+
+    @classmethod
+    def from_states(cls, blocks, states, max_price_ratio=MAX_PRICE_RATIO):
+        # `states` has the PoolState at each block, or None
+        sqrt_prices, current_ticks, liquidities, offsets, ticks, net = [], [], [], [0], [], []
+        max_log_distance = np.log(max_price_ratio) / LOG_TICK_BASE
+        for state in states:
+            if state is None or state.sqrt_price == 0:
+                sqrt_prices.append(0.0)
+                current_ticks.append(0)
+                liquidities.append(0.0)
+            else:
+                sqrt_prices.append(state.sqrt_price / Q96)
+                current_ticks.append(state.tick)
+                liquidities.append(float(state.liquidity))
+                lo = bisect.bisect_left(state.ticks, state.tick - max_log_distance)
+                hi = bisect.bisect_right(state.ticks, state.tick + max_log_distance)
+                ticks += state.ticks[lo:hi]
+                net += [float(state.net[t]) for t in state.ticks[lo:hi]]
+            offsets.append(len(ticks))
+        return cls(blocks, sqrt_prices, current_ticks, liquidities, offsets, ticks, net, max_price_ratio)
+
+    @classmethod
+    def concatenate(cls, snapshots):
+        offsets = [np.zeros(1, dtype=np.int64)]
+        for u in snapshots:
+            offsets.append(u.offsets[1:] + offsets[-1][-1])
+        return cls(np.concatenate([u.blocks for u in snapshots]),
+                   np.concatenate([u.sqrt_price for u in snapshots]),
+                   np.concatenate([u.tick for u in snapshots]),
+                   np.concatenate([u.liquidity for u in snapshots]),
+                   np.concatenate(offsets),
+                   np.concatenate([u.ticks for u in snapshots]),
+                   np.concatenate([u.net for u in snapshots]),
+                   snapshots[0].max_price_ratio)
+
+    def save(self, filename):
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename + ".tmp", "wb") as f:
+            np.savez_compressed(f, blocks=self.blocks, sqrt_price=self.sqrt_price, tick=self.tick,
+                                liquidity=self.liquidity, offsets=self.offsets, ticks=self.ticks, net=self.net,
+                                max_price_ratio=np.float64(self.max_price_ratio))
+        os.replace(filename + ".tmp", filename)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as f:
+            return cls(f["blocks"], f["sqrt_price"], f["tick"], f["liquidity"], f["offsets"], f["ticks"], f["net"],
+                       float(f["max_price_ratio"]))
+
+    #
+    # The ticks that a swap crosses in one direction, in the order it crosses them, with the swap
+    # as a move of x = sqrt(P) (token1 in, `up`) or x = 1 / sqrt(P) (token0 in), which both increase.
+    # For each tick: x, the input and output amounts to reach it, and the liquidity after crossing it.
+    #
+    def side(self, up):
+        if up in self._sides:
+            return self._sides[up]
+        groups = np.repeat(np.arange(len(self)), np.diff(self.offsets))
+        if up:
+            selected = self.ticks > self.tick[groups]
+            order = np.flatnonzero(selected)
+        else:
+            # descending within each snapshot
+            selected = self.ticks <= self.tick[groups]
+            order = np.flatnonzero(selected)
+            order = order[np.lexsort((-self.ticks[order], groups[order]))]
+        groups = groups[order]
+        offsets = np.searchsorted(groups, np.arange(len(self) + 1))
+        sign = 1 if up else -1
+        tick_x = np.exp(sign * self.ticks[order] * LOG_TICK_BASE / 2)
+        with np.errstate(divide="ignore"):
+            start_x = self.sqrt_price ** sign
+
+        # the liquidity after crossing each tick, and before it; the rounding errors of the sums
+        # are set to zero, as the ranges without liquidity are skipped by the swaps
+        after = self.liquidity[groups] + sign * group_cumsum(offsets, self.net[order])
+        tolerance = 1e-12 * (self.liquidity[groups] + group_cumsum(offsets, np.abs(self.net[order])))
+        after[np.abs(after) <= tolerance] = 0.0
+        before = np.concatenate(([0.0], after[:-1]))
+        firsts = offsets[:-1][np.diff(offsets) > 0]
+        before[firsts] = self.liquidity[groups[firsts]]
+        previous_x = np.concatenate(([0.0], tick_x[:-1]))
+        previous_x[firsts] = start_x[groups[firsts]]
+        before = np.maximum(before, 0)
+        amount_in = group_cumsum(offsets, before * (tick_x - previous_x))
+        amount_out = group_cumsum(offsets, before * (1 / previous_x - 1 / tick_x))
+        result = {"offsets": offsets, "x": tick_x, "in": amount_in, "out": amount_out,
+                  "liquidity": np.maximum(after, 0), "start_x": start_x}
+        self._sides[up] = result
+        return result
+
+    def _at(self, side, query_groups, index):
+        # the values at the tick `index` of each query, or at the start if the index is -1
+        i = np.maximum(side["offsets"][query_groups] + index, 0)
+        start = index < 0
+        x = np.where(start, side["start_x"][query_groups], side["x"][i] if len(side["x"]) else 0.0)
+        amount_in = np.where(start, 0.0, side["in"][i] if len(side["in"]) else 0.0)
+        amount_out = np.where(start, 0.0, side["out"][i] if len(side["out"]) else 0.0)
+        liquidity = np.where(start, self.liquidity[query_groups], side["liquidity"][i] if len(side["liquidity"]) else 0.0)
+        return x, amount_in, amount_out, liquidity
+
+    #
+    # The amounts that move the price by each of `moves` (relative price changes, e.g. 0.01 or -0.01);
+    # returns (amount in, amount out) with the shape (snapshots, moves). The input is token1
+    # for the positive moves and token0 for the negative moves.
+    #
+    def depth(self, moves, fee=0.0):
+        moves = np.asarray(moves, dtype=np.float64)
+        amount_in = np.full((len(self), len(moves)), np.nan)
+        amount_out = np.full((len(self), len(moves)), np.nan)
+        valid = self.sqrt_price > 0
+        for up in (True, False):
+            columns = np.flatnonzero(moves > 0 if up else moves < 0)
+            if len(columns) == 0:
+                continue
+            side = self.side(up)
+            # the target x of each snapshot and move
+            ratio = np.sqrt(1 + moves[columns]) if up else 1 / np.sqrt(1 + moves[columns])
+            query_groups = np.repeat(np.arange(len(self)), len(columns))
+            target = side["start_x"][query_groups] * np.tile(ratio, len(self))
+            index = group_searchsorted(side["offsets"], side["x"], query_groups, target)
+            x, a_in, a_out, liquidity = self._at(side, query_groups, index)
+            # NaN for the snapshots without a price
+            with np.errstate(divide="ignore", invalid="ignore"):
+                a_in = a_in + liquidity * (target - x)
+                a_out = a_out + liquidity * (1 / x - 1 / target)
+            in_window = np.tile(ratio ** 2 <= self.max_price_ratio, len(self)) & valid[query_groups]
+            amount_in[:, columns] = np.where(in_window, a_in / (1 - fee), np.nan).reshape(len(self), -1)
+            amount_out[:, columns] = np.where(in_window, a_out, np.nan).reshape(len(self), -1)
+        amount_in[:, moves == 0] = 0.0
+        amount_out[:, moves == 0] = 0.0
+        return amount_in, amount_out
+
+    #
+    # The relative price change after a swap with each of the input `amounts` of token1 (`token_in` = 1)
+    # or token0; the shape is (snapshots, amounts). A swap that ends at a range without liquidity
+    # moves the price across the whole range.
+    #
+    def price_impact(self, amounts, token_in, fee=0.0):
+        amounts = np.asarray(amounts, dtype=np.float64) * (1 - fee)
+        up = token_in == 1
+        side = self.side(up)
+        query_groups = np.repeat(np.arange(len(self)), len(amounts))
+        queries = np.tile(amounts, len(self))
+        index = group_searchsorted(side["offsets"], side["in"], query_groups, queries)
+        x, a_in, _, liquidity = self._at(side, query_groups, index)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            end_x = np.where(liquidity > 0, x + (queries - a_in) / liquidity, np.inf)
+            ratio = (end_x / side["start_x"][query_groups]) ** 2
+        in_window = (ratio <= self.max_price_ratio) & (self.sqrt_price[query_groups] > 0)
+        change = ratio - 1 if up else 1 / ratio - 1
+        return np.where(in_window, change, np.nan).reshape(len(self), -1)
+
+############################################################
+
+def sample_blocks(index, year, interval=INTERVAL):
+    start = date_to_timestamp(f"{year}-01-01")
+    end = min(date_to_timestamp(f"{int(year) + 1}-01-01"), int(index.timestamps[-1]) + 1)
+    blocks = index.timestamp_to_block(np.arange(start, end, interval))
+    return np.unique(blocks[blocks <= index.blocks[-1]])
+
+
+def compute_segment(task):
+    pool = task["pool"]
+    blocks = task["blocks"]
+    replay = v3_replay.start_replay(task["chain"], v3_replay.get_shard(pool, task["num_shards"]), task["num_shards"],
+                                    int(blocks[0]), {pool}, task["data_dir"])
+    parts = []
+
+    def take_snapshots(state, end):
+        # the snapshots of the blocks up to `end`; the replay changes the state in place,
+        # so they are taken right away
+        while len(parts) < len(blocks) and blocks[len(parts)] <= end:
+            parts.append(DepthSnapshots.from_states([blocks[len(parts)]], [state], task["max_price_ratio"]))
+
+    # the callback is called before the events of the pool, so the state is the one before the block
+    replay.run(int(blocks[-1]), callback=lambda block, event_pool, state, event: take_snapshots(state, block))
+    take_snapshots(replay.states.get(pool), blocks[-1])
+    snapshots = DepthSnapshots.concatenate(parts)
+    if task["cache"]:
+        snapshots.save(cache_filename(task["chain"], pool, task["interval"], task["checkpoint"], task["data_dir"]))
+    print(f"{pool}: blocks {blocks[0]}..{blocks[-1]} done")
+    return snapshots
+
+
+#
+# Returns the snapshots of the pool at the blocks, from the cache or computed in parallel.
+#
+def load_snapshots(chain, pool, blocks, interval=INTERVAL, max_price_ratio=MAX_PRICE_RATIO,
+                   num_workers=NUM_WORKERS, data_dir=DATA_DIR):
+    pool = pool.lower()
+    num_shards = v3_replay.NUM_SHARDS
+    directory = v3_replay.checkpoint_dir(chain, v3_replay.get_shard(pool, num_shards), num_shards, data_dir)
+    checkpoints = v3_replay.list_checkpoints(directory)
+    # the segment of each block: the last checkpoint at or before it, 0 if none
+    segment_index = np.searchsorted(checkpoints, blocks, side="right") - 1
+    parts = {}
+    tasks = []
+    for i in np.unique(segment_index):
+        checkpoint = checkpoints[i] if i >= 0 else 0
+        segment_blocks = blocks[segment_index == i]
+        filename = cache_filename(chain, pool, interval, checkpoint, data_dir)
+        if os.access(filename, os.R_OK):
+            cached = DepthSnapshots.load(filename)
+            if np.array_equal(cached.blocks, segment_blocks) and cached.max_price_ratio == max_price_ratio:
+                parts[checkpoint] = cached
+                continue
+        tasks.append({"chain": chain, "pool": pool, "blocks": segment_blocks, "checkpoint": checkpoint,
+                      "cache": i + 1 < len(checkpoints), "interval": interval, "max_price_ratio": max_price_ratio,
+                      "num_shards": num_shards, "data_dir": data_dir})
+    print(f"{len(parts)} cached segments, {len(tasks)} to compute")
+    if num_workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(num_workers, len(tasks))) as executor:
+            results = list(executor.map(compute_segment, tasks))
+    else:
+        results = [compute_segment(task) for task in tasks]
+    for task, snapshots in zip(tasks, results):
+        parts[task["checkpoint"]] = snapshots
+    return DepthSnapshots.concatenate([parts[u] for u in sorted(parts)])
+
+
+def main():
+    index = load_index(CHAIN)
+    if index is None or len(index) == 0:
+        print(f"no block index for {CHAIN}, run `block_index.py` first")
+        return
+    blocks = sample_blocks(index, YEAR)
+    print(f"the depth of {POOL} on {CHAIN} at {len(blocks)} blocks in {YEAR}")
+    snapshots = load_snapshots(CHAIN, POOL, blocks)
+    moves = sorted(MOVES + [-u for u in MOVES])
+    amount_in, _ = snapshots.depth(moves)
+    filename = f"depth-v3-{YEAR}-{POOL}.csv"
+    with open(filename, "w") as f:
+        # the input is token0 for the negative moves and token1 for the positive ones
+        f.write("block,timestamp,price," + ",".join(f"depth_{u}" for u in moves) + "\n")
+        timestamps = index.block_to_timestamp(snapshots.blocks)
+        for i in range(len(snapshots)):
+            values = [snapshots.blocks[i], timestamps[i], snapshots.sqrt_price[i] ** 2] + list(amount_in[i])
+            f.write(",".join(str(u) for u in values) + "\n")
+    print(f"written to {filename}")
+
+
+if __name__ == "__main__":
+    main()
+    print("all done")
@@ -0,0 +1,499 @@
+#!/usr/bin/env python
+
+#
+# This file replays the Uniswap v3 events in `uniswap-v3-all` (or `uniswap-arb-v3-all`) to rebuild
+# the state of each pool: sqrtPriceX96, the current tick, the active liquidity, and the liquidityGross /
+# liquidityNet of each initialized tick (kept in a sorted tick array).
+#
+# Initialize sets the price; Mint and Burn update the ticks of the range, and the active liquidity if the
+# range contains the current tick; Swap moves the pool to the recorded price and tick and crosses
+# the initialized ticks in between. Flash and Collect do not change the state.
+#
+# Each Swap event is validated against the replayed state:
+#  1) the liquidity recorded in the event must equal the active liquidity after the crossed ticks;
+#  2) the price recorded in the event must be close to the price predicted from the output amount
+#     of the swap and the replayed liquidity of the ticks it crosses (unless the swap ends in a range
+#     with no liquidity).
+#
+# The pools are split in NUM_SHARDS shards by address, which are replayed in parallel. The state of
+# each shard is saved every CHECKPOINT_BLOCKS blocks:
+#   data/v3-replay/{CHAIN}/shard-{SHARD}-of-{NUM_SHARDS}/{BLOCK}.npz
+# The checkpoint has the state before the events of BLOCK. The large integers are stored as
+# 64-bit words (least significant first), e.g. the int128 liquidityNet as a (lo, hi) pair,
+# in two's complement. The state of a pool at any block is loaded from the last checkpoint
+# before it (found by bisection) plus the replay of the events since then.
+# Running this file again continues from the last checkpoints.
+#
+# The segments between the checkpoints are independent, so they can be processed in parallel;
+# `validate_year` does that to check that the replay from each checkpoint reaches the next one.
+#
+
+import os
+import csv
+import glob
+import bisect
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from amm_math import Q96, TICK_BASE
+
+CHAIN = os.getenv("CHAIN")
+if CHAIN is None or len(CHAIN) == 0:
+    CHAIN = "ethereum"
+
+YEAR = os.getenv("YEAR")
+
+NUM_SHARDS = int(os.getenv("NUM_SHARDS", "16"))
+
+NUM_WORKERS = os.getenv("NUM_WORKERS")
+if NUM_WORKERS is None or len(NUM_WORKERS) == 0:
+    NUM_WORKERS = os.cpu_count()
+NUM_WORKERS = int(NUM_WORKERS)
+
+# about a week of blocks on Ethereum and a day on Arbitrum
+DEFAULT_CHECKPOINT_BLOCKS = {"ethereum": 50_000, "arbitrum": 300_000}
+CHECKPOINT_BLOCKS = os.getenv("CHECKPOINT_BLOCKS")
+try:
+    CHECKPOINT_BLOCKS = int(CHECKPOINT_BLOCKS)
+except:
+    CHECKPOINT_BLOCKS = DEFAULT_CHECKPOINT_BLOCKS.get(CHAIN, 50_000)
+
+# the maximal relative difference between the recorded and the predicted sqrt price of a swap
+PRICE_TOLERANCE = float(os.getenv("PRICE_TOLERANCE", "1e-6"))
+
+self_dir = os.path.dirname(os.path.abspath(__file__))
+DATA_DIR = os.path.join(self_dir, "data")
+
+EVENTS_DIRS = {"ethereum": "uniswap-v3-all", "arbitrum": "uniswap-arb-v3-all"}
+
+# the event types in the data files
+MINT = 1
+BURN = 2
+SWAP = 3
+INITIALIZE = 4
+FLASH = 5
+COLLECT = 6
+
+WORD_BITS = 64
+WORD_MASK = (1 << WORD_BITS) - 1
+
+
+def event_files(chain, data_dir=DATA_DIR):
+    # returns sorted list of (date, full path) tuples, for all years
+    pattern = os.path.join(data_dir, EVENTS_DIRS[chain], "*", "*-events.csv")
+    return sorted((os.path.basename(f)[:10], f) for f in glob.glob(pattern))
+
+
+def checkpoint_dir(chain, shard, num_shards=NUM_SHARDS, data_dir=DATA_DIR):
+    return os.path.join(data_dir, "v3-replay", chain, f"shard-{shard}-of-{num_shards}")
+
+
+def get_shard(pool, num_shards=NUM_SHARDS):
+    return int(pool[-8:], 16) % num_shards
+
+############################################################
+# large integers as 64-bit words
+
+#
+# Python ints -> uint64 array with the shape (len(values), num_words), the least significant word first.
+# Negative values are stored in two's complement.
+#
+def split_int(values, num_words):
+    values = np.array([int(u) for u in values], dtype=object) % (1 << (WORD_BITS * num_words))
+    result = np.zeros((len(values), num_words), dtype=np.uint64)
+    for w in range(num_words):
+        result[:, w] = ((values >> (WORD_BITS * w)) & WORD_MASK).astype(np.uint64)
+    return result
+
+
+def join_int(words, signed=False):
+    # the inverse of `split_int`; returns a list of Python ints
+    num_words = words.shape[1]
+    result = [0] * len(words)
+    for w in range(num_words):
+        column = words[:, w].tolist()
+        result = [r | (c << (WORD_BITS * w)) for r, c in zip(result, column)]
+    if signed:
+        modulo = 1 << (WORD_BITS * num_words)
+        result = [r - modulo if r >= modulo // 2 else r for r in result]
+    return result
+
+############################################################
+# pool state
+
+def tick_to_sqrt_price(tick):
+    return TICK_BASE ** (tick / 2)
+
+
+class PoolState:
+    def __init__(self, sqrt_price=0, tick=0, liquidity=0):
+        # sqrtPriceX96
+        self.sqrt_price = sqrt_price
+        self.tick = tick
+        self.liquidity = liquidity
+        # the initialized ticks, sorted
+        self.ticks = []
+        self.gross = {}
+        self.net = {}
+
+    def update_tick(self, tick, delta, upper):
+        gross = self.gross.get(tick, 0) + delta
+        if gross == 0:
+            # the tick is no longer initialized (its liquidityNet is also zero)
+            if tick in self.gross:
+                self.ticks.pop(bisect.bisect_left(self.ticks, tick))
+                del self.gross[tick]
+                del self.net[tick]
+            return
+        if tick not in self.gross:
+            bisect.insort(self.ticks, tick)
+        self.gross[tick] = gross
+        self.net[tick] = self.net.get(tick, 0) + (-delta if upper else delta)
+
+    def modify_position(self, tick_lower, tick_upper, delta):
+        if delta == 0:
+            return
+        self.update_tick(tick_lower, delta, False)
+        self.update_tick(tick_upper, delta, True)
+        if tick_lower <= self.tick < tick_upper:
+            self.liquidity += delta
+
+    def cross_to(self, tick):
+        # moves the current tick, updating the active liquidity by the liquidityNet of the crossed ticks
+        if tick > self.tick:
+            lo = bisect.bisect_right(self.ticks, self.tick)
+            hi = bisect.bisect_right(self.ticks, tick)
+            for t in self.ticks[lo:hi]:
+                self.liquidity += self.net[t]
+        elif tick < self.tick:
+            lo = bisect.bisect_right(self.ticks, tick)
+            hi = bisect.bisect_right(self.ticks, self.tick)
+            for t in self.ticks[lo:hi]:
+                self.liquidity -= self.net[t]
+        self.tick = tick
+
+    #
+    # The sqrt price (not scaled by Q96) after a swap with the given amounts (from the pool's point
+    # of view), computed from the output amount and the liquidity of the ticks that the swap crosses.
+    #
+    def predict_sqrt_price(self, amount0, amount1):
+        s = self.sqrt_price / Q96
+        liquidity = self.liquidity
+        if amount0 > 0:
+            # token0 in, token1 out, the price goes down
+            amount_out = -amount1
+            i = bisect.bisect_right(self.ticks, self.tick) - 1
+            while True:
+                next_s = tick_to_sqrt_price(self.ticks[i]) if i >= 0 else 0.0
+                available = liquidity * (s - next_s)
+                if i < 0 or (liquidity > 0 and amount_out <= available):
+                    return s - amount_out / liquidity if liquidity > 0 else s
+                amount_out -= available
+                s = next_s
+                liquidity -= self.net[self.ticks[i]]
+                i -= 1
+        else:
+            # token1 in, token0 out, the price goes up
+            amount_out = -amount0
+            i = bisect.bisect_right(self.ticks, self.tick)
+            while True:
+                next_s = tick_to_sqrt_price(self.ticks[i]) if i < len(self.ticks) else float("inf")
+                available = liquidity * (1 / s - 1 / next_s)
+                if i >= len(self.ticks) or (liquidity > 0 and amount_out <= available):
+                    return 1 / (1 / s - amount_out / liquidity) if liquidity > 0 else s
+                amount_out -= available
+                s = next_s
+                liquidity += self.net[self.ticks[i]]
+                i += 1
+
+############################################################
+# checkpoints
+
+def save_checkpoint(directory, block, date, states):
+    pools = sorted(states.keys())
+    tick_pools = []
+    ticks = []
+    gross = []
+    net = []
+    for i, pool in enumerate(pools):
+        state = states[pool]
+        tick_pools += [i] * len(state.ticks)
+        ticks += state.ticks
+        gross += [state.gross[t] for t in state.ticks]
+        net += [state.net[t] for t in state.ticks]
+    os.makedirs(directory, exist_ok=True)
+    filename = os.path.join(directory, f"{block:012d}.npz")
+    # write to a temporary file first, so that an interrupted run does not leave a broken file
+    with open(filename + ".tmp", "wb") as f:
+        np.savez(f, block=np.int64(block), date=np.array(date),
+                 pools=np.array(pools, dtype=str),
+                 sqrt_price=split_int([states[p].sqrt_price for p in pools], 3),
+                 tick=np.array([states[p].tick for p in pools], dtype=np.int64),
+                 liquidity=split_int([states[p].liquidity for p in pools], 2),
+                 tick_pools=np.array(tick_pools, dtype=np.int64),
+                 ticks=np.array(ticks, dtype=np.int64),
+                 liquidity_gross=split_int(gross, 2),
+                 liquidity_net=split_int(net, 2))
+    os.replace(filename + ".tmp", filename)
+
+
+def list_checkpoints(directory):
+    # returns the sorted list of checkpoint blocks
+    if not os.path.isdir(directory):
+        return []
+    return sorted(int(f[:-len(".npz")]) for f in os.listdir(directory) if f.endswith(".npz"))
+
+
+def find_checkpoint(directory, block):
+    # the last checkpoint at or before the block, or None
+    blocks = list_checkpoints(directory)
+    i = bisect.bisect_right(blocks, block) - 1
+    return blocks[i] if i >= 0 else None
+
+
+#
+# Returns (block, date, states); `pools` optionally selects the pools to load.
+#
+def load_checkpoint(directory, block, pools=None):
+    with np.load(os.path.join(directory, f"{block:012d}.npz")) as f:
+        all_pools = [str(u) for u in f["pools"]]
+        selected = [i for i, p in enumerate(all_pools) if pools is None or p in pools]
+        sqrt_prices = join_int(f["sqrt_price"][selected])
+        liquidities = join_int(f["liquidity"][selected])
+        # each f[key] reads the whole array from the file again, so read them once
+        pool_ticks = f["tick"]
+        tick_pools = f["tick_pools"]
+        ticks = f["ticks"]
+        liquidity_gross = f["liquidity_gross"]
+        liquidity_net = f["liquidity_net"]
+        block = int(f["block"])
+        date = str(f["date"])
+    # the ticks are sorted by pool
+    starts = np.searchsorted(tick_pools, selected, side="left")
+    ends = np.searchsorted(tick_pools, selected, side="right")
+    states = {}
+    for i, sqrt_price, liquidity, start, end in zip(selected, sqrt_prices, liquidities, starts, ends):
+        state = PoolState(sqrt_price, int(pool_ticks[i]), liquidity)
+        state.ticks = ticks[start:end].tolist()
+        state.gross = dict(zip(state.ticks, join_int(liquidity_gross[start:end])))
+        state.net = dict(zip(state.ticks, join_int(liquidity_net[start:end], signed=True)))
+        states[all_pools[i]] = state
+    return block, date, states
+
+############################################################
+# replay
+
+def new_stats():
+    return {"swaps": 0, "price_errors": 0, "liquidity_errors": 0, "max_price_error": 0.0}
+
+
+def merge_stats(total, stats):
+    for key in ["swaps", "price_errors", "liquidity_errors"]:
+        total[key] += stats[key]
+    total["max_price_error"] = max(total["max_price_error"], stats["max_price_error"])
+    return total
+
+
+class Replay:
+    #
+    # Replays the events of the pools for which `accept(pool)` is true, starting from the given states
+    # before `block`; the events before `block` in the file of `date` are skipped.
+    #
+    def __init__(self, chain, accept, states=None, block=0, date=None, data_dir=DATA_DIR):
+        self.chain = chain
+        self.accept = accept
+        self.states = states if states is not None else {}
+        self.block = block
+        self.date = date
+        self.data_dir = data_dir
+        self.stats = new_stats()
+        self.accepted = {}
+
+    def apply_swap(self, state, sqrt_price, tick, liquidity, amount0, amount1):
+        self.stats["swaps"] += 1
+        # the price in a range with no liquidity does not depend on the amounts, so it is not checked
+        if liquidity > 0 and amount0 != 0 and amount1 != 0:
+            predicted = state.predict_sqrt_price(amount0, amount1)
+            error = abs(predicted * Q96 / sqrt_price - 1)
+            self.stats["max_price_error"] = max(self.stats["max_price_error"], error)
+            if error > PRICE_TOLERANCE:
+                self.stats["price_errors"] += 1
+        state.sqrt_price = sqrt_price
+        state.cross_to(tick)
+        if state.liquidity != liquidity:
+            self.stats["liquidity_errors"] += 1
+            # continue from the recorded value, so that one error is counted once
+            state.liquidity = liquidity
+
+    def apply(self, event_type, pool, price, tick_lower, tick_upper, liquidity, amount0, amount1):
+        if event_type == INITIALIZE:
+            self.states[pool] = PoolState(int(price), int(tick_lower))
+            return
+        if event_type not in (MINT, BURN, SWAP):
+            return
+        state = self.states.get(pool)
+        if state is None:
+            # not initialized in the replayed period
+            return
+        if event_type == SWAP:
+            self.apply_swap(state, int(price), int(tick_lower), int(liquidity), int(amount0), int(amount1))
+        else:
+            delta = int(liquidity) if event_type == MINT else -int(liquidity)
+            state.modify_position(int(tick_lower), int(tick_upper), delta)
+
+    #
+    # Replays the events until `end_block` (exclusive; None for all). If `checkpoint_directory` is given,
+    # the states are saved there every `checkpoint_blocks` blocks. `callback(block, pool, state, event)`
+    # is called before each accepted event, with the event as a dict of the row.
+    #
+    def run(self, end_block=None, checkpoint_directory=None, checkpoint_blocks=CHECKPOINT_BLOCKS, callback=None):
+        next_checkpoint = (self.block // checkpoint_blocks + 1) * checkpoint_blocks
+        for date, filename in event_files(self.chain, self.data_dir):
+            if self.date is not None and date < self.date:
+                continue
+            self.date = date
+            with open(filename) as f:
+                reader = csv.reader(f)
+                columns = {c: i for i, c in enumerate(next(reader))}
+                block_column = columns["block"]
+                pool_column = columns["pool"]
+                fields = [columns[c] for c in ["type", "pool", "price", "tick_lower", "tick_upper", "liquidity", "amount0", "amount1"]]
+                for row in reader:
+                    block = int(row[block_column])
+                    if block < self.block:
+                        continue
+                    if end_block is not None and block >= end_block:
+                        self.block = end_block
+                        return self.stats
+                    if checkpoint_directory is not None and block >= next_checkpoint:
+                        checkpoint = block // checkpoint_blocks * checkpoint_blocks
+                        save_checkpoint(checkpoint_directory, checkpoint, date, self.states)
+                        next_checkpoint = checkpoint + checkpoint_blocks
+                    self.block = block
+                    pool = row[pool_column]
+                    accepted = self.accepted.get(pool)
+                    if accepted is None:
+                        accepted = self.accepted[pool] = self.accept(pool)
+                    if not accepted:
+                        continue
+                    event = [row[i] for i in fields]
+                    event[0] = int(event[0])
+                    if callback is not None:
+                        callback(block, pool, self.states.get(pool), dict(zip(columns, row)))
+                    self.apply(*event)
+        if end_block is not None:
+            self.block = end_block
+        return self.stats
+
+
+def start_replay(chain, shard, num_shards=NUM_SHARDS, block=None, pools=None, data_dir=DATA_DIR):
+    # a replay of the shard (or of the given pools in it) from the last checkpoint at or before the block
+    directory = checkpoint_dir(chain, shard, num_shards, data_dir)
+    checkpoint = find_checkpoint(directory, block if block is not None else float("inf"))
+    if pools is not None:
+        accept = lambda pool: pool in pools
+    else:
+        accept = lambda pool: get_shard(pool, num_shards) == shard
+    if checkpoint is None:
+        return Replay(chain, accept, data_dir=data_dir)
+    checkpoint_block, date, states = load_checkpoint(directory, checkpoint, pools)
+    return Replay(chain, accept, states, checkpoint_block, date, data_dir)
+
+
+#
+# Returns the state of the pool before the events of the block, or None if it is not initialized.
+#
+def load_pool_state(chain, pool, block, num_shards=NUM_SHARDS, data_dir=DATA_DIR):
+    pool = pool.lower()
+    replay = start_replay(chain, get_shard(pool, num_shards), num_shards, block, {pool}, data_dir)
+    replay.run(block)
+    return replay.states.get(pool)
+
+############################################################
+# parallel processing
+
+def build_shard(task):
+    replay = start_replay(task["chain"], task["shard"], task["num_shards"], data_dir=task["data_dir"])
+    directory = checkpoint_dir(task["chain"], task["shard"], task["num_shards"], task["data_dir"])
+    return replay.run(checkpoint_directory=directory, checkpoint_blocks=task["checkpoint_blocks"])
+
+
+#
+# Replays all events from the last checkpoints, writing the new checkpoints; returns the validation stats.
+#
+def build_checkpoints(chain, num_shards=NUM_SHARDS, checkpoint_blocks=CHECKPOINT_BLOCKS, num_workers=NUM_WORKERS,
+                      data_dir=DATA_DIR):
+    tasks = [{"chain": chain, "shard": shard, "num_shards": num_shards,
+              "checkpoint_blocks": checkpoint_blocks, "data_dir": data_dir} for shard in range(num_shards)]
+    return run_tasks(build_shard, tasks, num_workers)
+
+
+def states_equal(a, b):
+    return (a.sqrt_price == b.sqrt_price and a.tick == b.tick and a.liquidity == b.liquidity
+            and a.ticks == b.ticks and a.gross == b.gross and a.net == b.net)
+
+
+def validate_segment(task):
+    directory = checkpoint_dir(task["chain"], task["shard"], task["num_shards"], task["data_dir"])
+    block, date, states = load_checkpoint(directory, task["start_block"])
+    replay = Replay(task["chain"], lambda pool: get_shard(pool, task["num_shards"]) == task["shard"],
+                    states, block, date, task["data_dir"])
+    stats = replay.run(task["end_block"])
+    _, _, expected = load_checkpoint(directory, task["end_block"])
+    stats["state_errors"] = sum(1 for pool in set(expected) | set(replay.states)
+                                if pool not in expected or pool not in replay.states
+                                or not states_equal(expected[pool], replay.states[pool]))
+    return stats
+
+
+#
+# Replays the segments between the consecutive checkpoints that start in the year, in parallel,
+# and checks that each of them ends in the state of the next checkpoint.
+#
+def validate_year(chain, year, num_shards=NUM_SHARDS, num_workers=NUM_WORKERS, data_dir=DATA_DIR):
+    tasks = []
+    for shard in range(num_shards):
+        directory = checkpoint_dir(chain, shard, num_shards, data_dir)
+        blocks = list_checkpoints(directory)
+        for start_block, end_block in zip(blocks[:-1], blocks[1:]):
+            with np.load(os.path.join(directory, f"{start_block:012d}.npz")) as f:
+                if not str(f["date"]).startswith(str(year)):
+                    continue
+            tasks.append({"chain": chain, "shard": shard, "num_shards": num_shards,
+                          "start_block": start_block, "end_block": end_block, "data_dir": data_dir})
+    print(f"validating {len(tasks)} segments")
+    results = run_tasks(validate_segment, tasks, num_workers)
+    results["state_errors"] = results.get("state_errors", 0)
+    return results
+
+
+def run_tasks(function, tasks, num_workers):
+    total = new_stats()
+    if num_workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(num_workers, len(tasks))) as executor:
+            results = list(executor.map(function, tasks))
+    else:
+        results = [function(task) for task in tasks]
+    for stats in results:
+        merge_stats(total, stats)
+        if "state_errors" in stats:
+            total["state_errors"] = total.get("state_errors", 0) + stats["state_errors"]
+    return total
+
+
+def print_stats(stats):
+    print(f"{stats['swaps']} swaps, {stats['liquidity_errors']} liquidity errors,"
+          f" {stats['price_errors']} price errors (max relative error {stats['max_price_error']:.2e})"
+          + (f", {stats['state_errors']} state errors" if "state_errors" in stats else ""))
+
+
+def main():
+    print(f"replaying the v3 events on {CHAIN}, {NUM_SHARDS} shards")
+    print_stats(build_checkpoints(CHAIN))
+    if YEAR is not None and len(YEAR):
+        print_stats(validate_year(CHAIN, YEAR))
+
+
+if __name__ == "__main__":
+    main()
+    print("all done")